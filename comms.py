@@ -1,19 +1,19 @@
 import threading
 import asyncio
 import serial_asyncio
-import aiofiles
 import logging
 import functools
 import sys
 import re
 import traceback
 import serial.tools.list_ports
-import subprocess
 import socket
 import time
+import collections
+from array import array
 from notify import Notify
-
-async_main_loop = None
+from gcode_index import GcodeIndex
+from gcode_minify import GcodeMinifier
 
 
 class SerialConnection(asyncio.Protocol):
@@ -28,6 +28,7 @@ class SerialConnection(asyncio.Protocol):
         self._paused = False
         self._drain_waiter = None
         self._connection_lost = False
+        self._rxbuf = bytearray()
         self.transport = None
 
     def connection_made(self, transport):
@@ -54,21 +55,35 @@ class SerialConnection(asyncio.Protocol):
             self.transport.serial.reset_output_buffer()
 
     def send_message(self, data, hipri=False):
-        """ Feed a message to the sender coroutine. """
-        self.log.debug('SerialConnection: send_message: {}'.format(data))
-        self.transport.write(data.encode('utf-8'))
+        """ Feed a message to the sender coroutine. data is a str, or bytes which are written as they are """
+        if self.log.isEnabledFor(logging.DEBUG):
+            # this gets called for every line streamed so don't format the message unless it will be logged
+            self.log.debug('SerialConnection: send_message: {}'.format(data if isinstance(data, str) else bytes(data)))
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.transport.write(data)
 
     def data_received(self, data):
         # print('data received', repr(data))
-        str = ''
+        # accumulate the raw bytes and only decode complete lines, a \n can never be part of a multibyte
+        # utf-8 sequence, so this never splits a character, and any partial line stays in the buffer
+        self._rxbuf += data
+        n = self._rxbuf.rfind(b'\n')
+        if n < 0:
+            return
+
         try:
-            # FIXME this is a problem when it splits utf-8, may need to get whole lines here anyway
-            str = data.decode('utf-8')
-        except Exception as err:
-            self.log.error("SerialConnection: Got decode error on data {}: {}".format(repr(data), err))
-            str = repr(data)  # send it upstream anyway
+            s = self._rxbuf[:n].decode('utf-8')
+        except UnicodeDecodeError as err:
+            self.log.error("SerialConnection: Got decode error on data {}: {}".format(repr(self._rxbuf[:n]), err))
+            s = self._rxbuf[:n].decode('utf-8', 'replace')  # send it upstream anyway
 
-        self.cb.incoming_data(str)
+        del self._rxbuf[:n + 1]
+
+        for l in s.split('\n'):
+            l = l.rstrip()  # strip off \r and trailing spaces
+            if l:
+                self.cb.incoming_line(l)
 
     def connection_lost(self, exc):
         self.log.debug('SerialConnection: port closed')
@@ -125,18 +140,607 @@ class SerialConnection(asyncio.Protocol):
                 waiter.set_result(None)
 
 
+class StreamWindow():
+    ''' Credit based flow control for streaming, similar to grbl character counting.
+        Keeps track of the lines (and bytes) that have been sent but not yet ok'd, and only lets
+        more lines be sent when there is room in the window. Each ok frees the oldest line.
+        Optionally the number of lines in flight is auto tuned from the measured ok latency. '''
+
+    def __init__(self, max_lines=8, max_bytes=256, autotune=False, min_lines=2, limit_lines=32):
+        self.log = logging.getLogger()  # .getChild('StreamWindow')
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.autotune = autotune
+        self.min_lines = min_lines
+        self.limit_lines = limit_lines
+        self.latency = None  # smoothed ok latency in seconds
+        self.min_latency = None  # best ok latency seen, an estimate of the link round trip
+        self._inflight = collections.deque()  # (nbytes, time sent) of each line not yet ok'd
+        self._nbytes = 0
+        self._acks = 0
+        self._waiter = None
+        self._cancelled = False
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def has_room(self, n):
+        if not self._inflight:
+            # always allow one line, even if it is bigger than the window
+            return True
+        return len(self._inflight) < self.max_lines and self._nbytes + n <= self.max_bytes
+
+    @asyncio.coroutine
+    def acquire(self, n):
+        ''' wait until there is room for a line of n bytes and reserve it, returns False if cancelled '''
+        while not self._cancelled and not self.has_room(n):
+            self._waiter = asyncio.Event()
+            yield from self._waiter.wait()
+            self._waiter = None
+
+        if self._cancelled:
+            return False
+
+        self._inflight.append((n, time.time()))
+        self._nbytes += n
+        return True
+
+    @asyncio.coroutine
+    def drain(self):
+        ''' wait until all lines in flight have been ok'd, returns False if cancelled '''
+        while not self._cancelled and self._inflight:
+            self._waiter = asyncio.Event()
+            yield from self._waiter.wait()
+            self._waiter = None
+
+        return not self._cancelled
+
+    def release(self):
+        ''' called for each ok received, frees the credit of the oldest line in flight '''
+        if not self._inflight:
+            # an ok for something we did not send, eg a command sent while paused
+            return
+
+        n, t = self._inflight.popleft()
+        self._nbytes -= n
+        if self.autotune:
+            self._tune(time.time() - t)
+        self._wakeup()
+
+    def reset(self):
+        ''' forget everything in flight, the controller has discarded it '''
+        self._inflight.clear()
+        self._nbytes = 0
+        self._wakeup()
+
+    def cancel(self):
+        ''' wake up anything waiting on the window so the stream can abort '''
+        self._cancelled = True
+        self._wakeup()
+
+    def _wakeup(self):
+        if self._waiter is not None:
+            self._waiter.set()
+
+    def _tune(self, lat):
+        # if the oks come back about as fast as the link allows then the controller is not queuing
+        # anything up, so we can afford more lines in flight. If the latency goes way up the lines
+        # are sitting in the controllers buffers, which just makes pause and abort slower to act
+        if self.min_latency is None or lat < self.min_latency:
+            self.min_latency = lat
+        self.latency = lat if self.latency is None else self.latency * 0.9 + lat * 0.1
+
+        # adjust at most once per window full of oks
+        self._acks += 1
+        if self._acks < self.max_lines:
+            return
+        self._acks = 0
+
+        base = max(self.min_latency, 0.001)
+        if self.latency < 2 * base and self.max_lines < self.limit_lines:
+            self.max_lines += 1
+            self.log.debug('StreamWindow: increased window to {} lines, latency {:1.4f}'.format(self.max_lines, self.latency))
+        elif self.latency > 4 * base and self.max_lines > self.min_lines:
+            self.max_lines -= 1
+            self.log.debug('StreamWindow: decreased window to {} lines, latency {:1.4f}'.format(self.max_lines, self.latency))
+
+
+class LineReader():
+    ''' Reads a gcode file in large chunks in a background thread, splits it into lines and classifies them.
+        The lines are kept in a bounded ring that the streamer drains, the next chunk is prefetched when the
+        ring runs low, so the streamer only has to wait on file I/O if it empties the ring.
+        The file is read as bytes and gcode lines are kept as bytes with their \n, so they are written to the port
+        without being decoded and encoded again. Only MSG and NOTIFY lines, which get displayed, are decoded to str.
+        If given, transform is called (in the background thread) on each gcode line as a str and returns the line to send,
+        or an empty string if there is nothing left to send '''
+    GCODE = 0
+    MSG = 1
+    NOTIFY = 2
+
+    def __init__(self, fn, chunk_size=65536, low_water=1024, offset=0, transform=None):
+        self.fn = fn
+        self.transform = transform
+        self.offset = offset  # byte offset of the line to start reading from
+        self.chunk_size = chunk_size
+        self.low_water = low_water  # prefetch the next chunk when the ring has fewer lines than this
+        self._f = None
+        self._lines = collections.deque()
+        self._fragment = b''
+        self._pending = None
+        self._eof = False
+
+    @asyncio.coroutine
+    def open(self):
+        loop = asyncio.get_event_loop()
+        self._f = yield from loop.run_in_executor(None, functools.partial(open, self.fn, 'rb'))
+        if self.offset:
+            self._f.seek(self.offset)
+        self._prefetch()
+
+    @asyncio.coroutine
+    def close(self):
+        if self._pending is not None:
+            # let any outstanding read finish before we close the file under it
+            yield from asyncio.wait([self._pending])
+            self._pending = None
+        if self._f:
+            self._f.close()
+            self._f = None
+
+    @asyncio.coroutine
+    def readline(self):
+        ''' returns the next (type, line) from the ring, or None at EOF '''
+        if self._pending is not None and self._pending.done():
+            self._collect()
+
+        while not self._lines:
+            if self._pending is None:
+                if self._eof:
+                    return None
+                self._prefetch()
+            yield from asyncio.wait([self._pending])
+            self._collect()
+
+        if self._pending is None and not self._eof and len(self._lines) < self.low_water:
+            self._prefetch()
+
+        return self._lines.popleft()
+
+    def _prefetch(self):
+        self._pending = asyncio.get_event_loop().run_in_executor(None, self._read_chunk)
+
+    def _collect(self):
+        chunk = self._pending.result()
+        self._pending = None
+        if chunk is None:
+            self._eof = True
+        else:
+            self._lines.extend(chunk)
+
+    def _read_chunk(self):
+        # runs in the executor thread, returns a list of (type, line) or None at EOF
+        data = self._f.read(self.chunk_size)
+        if not data:
+            if not self._fragment:
+                return None
+            # last line had no terminating newline
+            data = b'\n'
+        lines = (self._fragment + data).split(b'\n')
+        self._fragment = lines.pop()
+
+        result = []
+        for l in lines:
+            l = l.strip()
+            if not l or l[0] == 0x3b:  # ;
+                continue
+            if l[0] == 0x28:  # (
+                if l.startswith(b'(MSG'):
+                    result.append((LineReader.MSG, l.decode('utf-8', 'replace')))
+                elif l.startswith(b'(NOTIFY'):
+                    result.append((LineReader.NOTIFY, l.decode('utf-8', 'replace')))
+                continue
+            if self.transform is not None:
+                l = self.transform(l.decode('utf-8', 'replace'))
+                if l:
+                    result.append((LineReader.GCODE, (l + '\n').encode('utf-8')))
+            else:
+                result.append((LineReader.GCODE, l + b'\n'))
+
+        return result
+
+
+class ResendBuffer():
+    ''' Line numbered and checksummed streaming, each line is sent as N<line> ... *<checksum>.
+        Keeps the last lines sent so they can be resent when the controller asks for them with rs N<line>,
+        and which lines are in flight, so replies to lines sent before a resend started can be ignored.
+        Lines are bytes, as the streamer sends them '''
+
+    def __init__(self, size=256):
+        self.lineno = 0
+        self.resends = 0
+        self.pending = collections.deque()  # (n, line) waiting to be resent
+        self._history = collections.deque(maxlen=size)  # (n, line) of the last lines numbered
+        self._inflight = collections.deque()  # (n, seq) of each line sent that has not been replied to yet
+        self._seq = 0  # counts every line sent including resends
+        self._mark = 0  # seq when the last resend was queued
+
+    @staticmethod
+    def checksum(s):
+        cs = 0
+        for c in s:
+            cs ^= c
+        return cs
+
+    @staticmethod
+    def _format(n, line):
+        s = 'N{} '.format(n).encode('utf-8') + line
+        return s + '*{}\n'.format(ResendBuffer.checksum(s)).encode('utf-8')
+
+    def reset(self, n=0):
+        ''' returns the M110 line that sets the controllers line number to n '''
+        self.lineno = n
+        self._history.clear()
+        self.pending.clear()
+        return (n, ResendBuffer._format(n, b'M110'))
+
+    @staticmethod
+    def overhead(n):
+        ''' the most numbering a line as n adds to it '''
+        return len('N{} *255'.format(n))
+
+    def number(self, line):
+        ''' returns (n, line) with the line number and checksum added '''
+        self.lineno += 1
+        r = (self.lineno, ResendBuffer._format(self.lineno, line.rstrip()))
+        self._history.append(r)
+        return r
+
+    def sent(self, n):
+        self._seq += 1
+        self._inflight.append((n, self._seq))
+
+    def replied(self):
+        ''' an ok (or !!) was received for the oldest line in flight '''
+        if self._inflight:
+            self._inflight.popleft()
+
+    def resend_request(self, k):
+        ''' the controller rejected the oldest line in flight and wants everything from line k on.
+            returns False if those lines are no longer available '''
+        n, seq = self._inflight.popleft() if self._inflight else (None, self._seq + 1)
+        if seq <= self._mark:
+            # reply to a line sent before the current resend was queued, that resend covers it
+            return True
+
+        lines = [x for x in self._history if x[0] >= k]
+        if lines and lines[0][0] == k:
+            self.pending = collections.deque(lines)
+        elif n is not None and n > 0:
+            # the controller has counted lines we did not number (eg commands sent while paused)
+            # so set its line number back to just before the rejected line and resend from there
+            self.pending = collections.deque([x for x in self._history if x[0] >= n])
+            self.pending.appendleft((n - 1, ResendBuffer._format(n - 1, b'M110')))
+        else:
+            return False
+
+        self._mark = self._seq
+        self.resends += 1
+        return True
+
+
+class LineTimings():
+    ''' Ring buffer of when each streamed line was queued to be sent, written to the port and acked.
+        It is always on, so it just stores the times in preallocated arrays, the percentiles are worked out
+        when asked for. wait (queued to written) is the host and flow control, ok (written to acked) is
+        the link and the controller.
+        A starvation event is recorded when a line is written with nothing in flight and it is more than
+        starvation_time since the last ack, or the controller reports Idle in the middle of a stream '''
+
+    def __init__(self, size=4096, starvation_time=0.05):
+        self.size = size
+        self.starvation_time = starvation_time
+        self.starvations = collections.deque(maxlen=100)  # (wall time, 'host' or 'idle', gap in seconds)
+        self._queued = array('d', bytes(8 * size))
+        self._written = array('d', bytes(8 * size))
+        self._acked = array('d', bytes(8 * size))
+        self._n = 0  # number of lines queued
+        self._ack = 0  # number of lines acked
+        self._last_ack = 0
+
+    def __len__(self):
+        return min(self._n, self.size)
+
+    def queued(self):
+        ''' a line is about to be sent, returns its index '''
+        i = self._n
+        self._queued[i % self.size] = time.perf_counter()
+        self._n += 1
+        return i
+
+    def written(self, i):
+        t = time.perf_counter()
+        self._written[i % self.size] = t
+        if self._ack == i and self._last_ack and t - self._last_ack > self.starvation_time:
+            # nothing was in flight, so the controller has been waiting on us
+            self.starvations.append((time.time(), 'host', t - self._last_ack))
+
+    def acked(self):
+        if self._ack < self._n:
+            t = time.perf_counter()
+            self._acked[self._ack % self.size] = t
+            self._ack += 1
+            self._last_ack = t
+
+    def expect_gap(self):
+        ''' called when the stream waits on purpose (paused, M0), so the gap is not counted as starvation '''
+        self._last_ack = 0
+
+    def starved(self, kind, gap=0):
+        self.starvations.append((time.time(), kind, gap))
+
+    def reset(self, keep=False):
+        ''' forget the lines in flight, they are never going to be acked. if keep is set the timings of the lines
+            that were acked are kept, so they can still be looked at after the stream '''
+        if keep:
+            self._n = self._ack
+        else:
+            self._n = self._ack = 0
+            self.starvations.clear()
+        self._last_ack = 0
+
+    def percentiles(self, ps=(50, 90, 99)):
+        ''' returns {'lines': n, 'wait': [...], 'ok': [...]} the percentiles in seconds over the acked lines in the buffer '''
+        start = max(self._n - self.size, 0)
+        wait = []
+        ok = []
+        for i in range(start, self._ack):
+            k = i % self.size
+            wait.append(self._written[k] - self._queued[k])
+            ok.append(self._acked[k] - self._written[k])
+
+        r = {'lines': len(ok)}
+        for name, ll in (('wait', wait), ('ok', ok)):
+            ll.sort()
+            r[name] = [ll[min(int(len(ll) * p / 100.0), len(ll) - 1)] for p in ps] if ll else []
+        return r
+
+    def summary(self):
+        ''' a few lines of text describing the timings '''
+        p = self.percentiles()
+        if not p['lines']:
+            return ['No line timings yet']
+
+        ms = lambda ll: '/'.join('{:1.2f}'.format(x * 1000) for x in ll)
+        res = [
+            'Line timings over the last {} lines, p50/p90/p99 in ms'.format(p['lines']),
+            '  queued to written (host): {}'.format(ms(p['wait'])),
+            '  written to ok (link and controller): {}'.format(ms(p['ok'])),
+            '  starvation events: {}'.format(len(self.starvations))
+        ]
+        for t, kind, gap in list(self.starvations)[-5:]:
+            res.append('    {} {} {:1.3f}s'.format(time.strftime('%X', time.localtime(t)), kind, gap))
+        return res
+
+
+class StreamProgress():
+    ''' The progress of a stream, the streamer just updates the counts and a separate task samples them
+        every interval seconds and calls the progress callback with a Report, if anything changed or at least
+        every idle_interval seconds (so the UI still gets told while paused).
+        line is the line to show in the UI, bytes the bytes written and oks the oks received '''
+
+    Report = collections.namedtuple('Report', ['line', 'bytes', 'oks'])
+
+    def __init__(self, callback, interval=0.25, idle_interval=1):
+        self.callback = callback
+        self.interval = interval
+        self.idle_interval = idle_interval
+        self.line = 0
+        self.bytes = 0
+        self.oks = 0
+        self._last = None
+        self._last_time = 0
+        self._task = None
+
+    def report(self):
+        return StreamProgress.Report(self.line, self.bytes, self.oks)
+
+    def start(self):
+        self._task = asyncio.async(self._sample())
+
+    def stop(self):
+        ''' stop sampling and send the final counts '''
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._send(True)
+
+    def _send(self, force=False):
+        r = self.report()
+        now = time.monotonic()
+        if force or r != self._last or now - self._last_time >= self.idle_interval:
+            self._last = r
+            self._last_time = now
+            self.callback(r)
+
+    @asyncio.coroutine
+    def _sample(self):
+        while True:
+            yield from asyncio.sleep(self.interval)
+            self._send()
+
+
+class StatusReport():
+    ''' A parsed status report, fields not in the report are None '''
+    __slots__ = ('state', 'mpos', 'wpos', 'feed', 'feed_req', 'feed_ovr', 'spindle', 'laser', 'temperatures')
+
+    def __init__(self, state):
+        self.state = state
+        self.mpos = None  # [x, y, z, ...]
+        self.wpos = None  # [x, y, z]
+        self.feed = None  # current feedrate
+        self.feed_req = None  # requested feedrate
+        self.feed_ovr = None  # feedrate override %
+        self.spindle = None
+        self.laser = None
+        self.temperatures = None  # {designator: (current, target)}
+
+    @staticmethod
+    def parse(s):
+        ''' parse <Idle|MPos:68.9980,-49.9240,40.0000,12.3456|WPos:68.9980,-49.9240,40.0000|F:12345.12|S:1.2>
+            if temp readings are enabled then it also has T:25.0,0.0|B:25.2,0.0
+            returns None if it is the old status format '''
+        fields = s[1:-1].split('|')
+        n = len(fields)
+        if n < 3:
+            return None
+
+        sr = StatusReport(fields[0])
+        for i in range(1, n):
+            # dispatch on the first character, cheaper than splitting out the name
+            f = fields[i]
+            c = f[0]
+            if c == 'M' and f.startswith('MPos:'):
+                sr.mpos = list(map(float, f[5:].split(',')))
+            elif c == 'W' and f.startswith('WPos:'):
+                sr.wpos = list(map(float, f[5:].split(',')))
+            elif c == 'F' and f[1] == ':':
+                v = f[2:].split(',')
+                sr.feed = float(v[0])
+                if len(v) == 2:
+                    # F:current,override
+                    sr.feed_req = sr.feed
+                    sr.feed_ovr = float(v[1])
+                elif len(v) == 3:
+                    # F:current,requested,override
+                    sr.feed_req = float(v[1])
+                    sr.feed_ovr = float(v[2])
+            elif c == 'S' and f[1] == ':':
+                sr.spindle = float(f[2:].partition(',')[0])
+            elif c == 'L' and f[1] == ':':
+                sr.laser = float(f[2:].partition(',')[0])
+            elif c == 'T' or c == 'B':
+                k, _, v = f.partition(':')
+                if k == 'T' or k == 'T1' or k == 'B':
+                    t, _, v = v.partition(',')
+                    if sr.temperatures is None:
+                        sr.temperatures = {}
+                    sr.temperatures[k] = (float(t), float(v))
+
+        return sr
+
+
+class CommsLoop():
+    ''' The asyncio loop all the connections share, it runs in its own thread which is started by the first
+        connection and exits when the last one has disconnected '''
+
+    _default = None
+
+    def __init__(self):
+        self.log = logging.getLogger()  # .getChild('CommsLoop')
+        self.loop = None
+        self.thread = None
+        self._users = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls):
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def acquire(self):
+        ''' called from any thread to use the loop, starts it if need be, returns the thread it runs in '''
+        with self._lock:
+            self._users += 1
+            if self.thread is None:
+                self.log.info('CommsLoop: creating comms thread')
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self._run, args=(self.loop,))
+                self.thread.start()
+            return self.thread
+
+    def release(self):
+        ''' called in the loop when finished with it, the loop stops when nothing is using it '''
+        with self._lock:
+            self._users -= 1
+            if self._users == 0:
+                self.loop.stop()
+                self.loop = None
+                self.thread = None
+
+    def _run(self, loop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+
+            # we wait until all tasks are complete
+            pending = asyncio.Task.all_tasks(loop)
+            self.log.debug('CommsLoop: waiting for all tasks to complete: {}'.format(pending))
+            loop.run_until_complete(asyncio.gather(*pending))
+
+        finally:
+            loop.close()
+            self.log.info('CommsLoop: comms thread Exiting...')
+
+
 class Comms():
-    def __init__(self, app, reportrate=1):
+    # write priorities, the lower ones are sent first
+    REALTIME = 0  # realtime commands and kill, ? ! ~ and ctrl-X
+    JOG = 1  # $J
+    INTERACTIVE = 2  # anything else typed or clicked on
+    BULK = 3  # eg the lines of a macro file
+
+    def __init__(self, app, reportrate=1, comms_loop=None):
         self.app = app
+        self.comms_loop = CommsLoop.default() if comms_loop is None else comms_loop
+        self.loop = None  # the asyncio loop while connected
+        self._connection = None
+        self._closing = False  # set when we are disconnecting on purpose
+        self.auto_reconnect = False  # reconnect when the connection is lost
+        self.reconnect_delay = 1  # seconds to wait before the first attempt to reconnect
+        self.reconnect_max_delay = 30
+        self.reconnecting = False
+        self._interrupted = None  # (file, line) of a stream that was running when the connection was lost
         self.proto = None
         self.timer = None
-        self._fragment = None
         self.abort_stream = False
-        self.pause_stream = False  # asyncio.Event()
+        self.pause_stream = False
+        self._unpaused = None  # asyncio.Event, set while the stream is not paused
+        self._all_acked = None  # asyncio.Event, set when fast stream has all lines ok'd
+        self._ack_target = None
         self.okcnt = None
         self.ping_pong = True  # ping pong protocol for streaming
+        self.window_size = None  # (lines, bytes) to use windowed streaming instead of ping pong
+        self.window_autotune = False  # auto tune the window size from the ok latency
+        self.window = None
+        self.line_numbers = False  # send lines with line numbers and checksums, and resend them when requested
+        self.minify = False  # make the lines shorter before they are sent
+        self.minify_resolution = 0.001  # round coordinates to this when minifying (mm), 0 to not round them
+        self.resend = None
+        self.minifier = None  # GcodeMinifier of the current stream when minifying
+        self.line_timings = LineTimings()  # when each streamed line was sent and acked
+        self.acked_line = 0  # the number of lines counted by the stream that have been ok'd
+        self._sent_lines = collections.deque()  # what acked_line becomes as each line in flight is ok'd
+        self._unreplied = 0  # number of lines the stream has sent that have not had a reply yet
+        self._stream_fn = None
+        self.progress = None  # StreamProgress of the current stream, if it has a progress callback
+        self.progress_interval = 0.25  # how often the stream progress is reported (seconds)
         self.file_streamer = None
+        self.bulk_window = 4  # number of BULK lines sent ahead of their oks
+        self.bulk_timeout = 5  # if there has been no ok for this long send more BULK lines anyway (seconds)
+        self._writes = [collections.deque() for _ in range(4)]  # writes from other threads waiting to be sent, by priority
+        self._writes_lock = threading.Lock()
+        self._writes_scheduled = False
+        self._bulk_in_flight = 0  # BULK lines sent and not ok'd yet
+        self._lanes = collections.deque()  # the priority of each line written from the queue that has not been ok'd yet
+        self._bulk_timer = None
         self.report_rate = reportrate
+        self.report_rates = {}  # report rate for specific states, eg {'Run': 0.2}, report_rate is used otherwise
+        self.state_query_interval = 10  # always query the state ($I) at least this often (seconds)
+        self._reports_suspended = False
+        self._last_state = None
+        self._query_state = True  # set when the state ($I) may have changed since it was last queried
+        self._last_state_query = 0
         self._reroute_incoming_data_to = None
         self._restart_timer = False
         self.is_streaming = False
@@ -145,77 +749,258 @@ class Comms():
         self.is_suspend = False
         self.m0 = None
         self.log = logging.getLogger()  # .getChild('Comms')
+        self._handlers = {}  # incoming line handlers indexed by first character of the prefix
+        self._add_default_handlers()
         # logging.getLogger().setLevel(logging.DEBUG)
 
     def connect(self, port):
-        ''' called from UI to connect to given port, runs the asyncio mainloop in a separate thread '''
+        ''' called from UI to connect to given port, the connection runs in the comms thread, which is shared
+            with any other connections. Returns the comms thread, which exits when the last connection closes '''
+        if self.loop is not None:
+            self.log.error("Comms: Already connected cannot connect again")
+            self.app.main_window.async_display('>>> Already connected cannot connect again')
+            return None
+
         self.port = port
-        self.log.info('Comms: creating comms thread')
-        t = threading.Thread(target=self.run_async_loop)
-        t.start()
+        self._closing = False
+        t = self.comms_loop.acquire()
+        self.loop = self.comms_loop.loop
+        self.loop.call_soon_threadsafe(self._connect)
         return t
 
     def disconnect(self):
-        ''' called by ui thread to disconnect '''
+        ''' called by ui thread to disconnect, or to stop trying to reconnect '''
+        self._closing = True
         if self.proto:
-            async_main_loop.call_soon_threadsafe(self.proto.transport.close)
-
-    def write(self, data):
-        ''' Write to serial port, called from UI thread '''
-        if self.proto and async_main_loop:
-            async_main_loop.call_soon_threadsafe(self._write, data)
-            # asyncio.run_coroutine_threadsafe(self.proto.send_message, async_main_loop)
+            self.loop.call_soon_threadsafe(self.proto.transport.close)
+        elif self.reconnecting:
+            self.loop.call_soon_threadsafe(self._connection.cancel)
+
+    def write(self, data, priority=None):
+        ''' Write to serial port, called from UI thread.
+            Writes are queued by priority and sent together from the comms thread, so realtime commands and jogs
+            go ahead of anything still queued. BULK writes are only sent bulk_window lines ahead of their oks
+            so they never fill up the controller, and a ctrl-X throws away anything still queued.
+            priority is one of REALTIME, JOG, INTERACTIVE or BULK, by default it is worked out from the data '''
+        if self.proto and self.loop:
+            # anything the user sends may change the state so query it next time
+            self._query_state = True
+            if priority is None:
+                priority = Comms.write_priority(data)
+            self._writes[priority].append(data)
+            with self._writes_lock:
+                if self._writes_scheduled:
+                    # it has not run yet so will pick this up too
+                    return
+                self._writes_scheduled = True
+            self.loop.call_soon_threadsafe(self._send_writes)
         else:
             self.log.warning('Comms: Cannot write to closed connection: ' + data)
             # self.app.main_window.async_display("<<< {}".format(data))
 
-    def _write(self, data):
+    @staticmethod
+    def write_priority(data):
+        if data in ('?', '!', '~') or data.startswith('\x18'):
+            return Comms.REALTIME
+        if data.startswith('$J'):
+            return Comms.JOG
+        return Comms.INTERACTIVE
+
+    def _send_writes(self):
+        with self._writes_lock:
+            self._writes_scheduled = False
+
+        if not self.proto:
+            self._clear_writes()
+            return
+
+        q = self._writes[Comms.REALTIME]
+        while q:
+            data = q.popleft()
+            if data.startswith('\x18'):
+                # anything still queued would be run after the kill, so throw it away
+                n = sum(len(d) for d in self._writes[Comms.JOG:])
+                if n:
+                    self.log.info('Comms: kill discarded {} queued writes'.format(n))
+                self._clear_writes()
+            self._write(data)
+
+        # send everything else that is queued in one go
+        for lane in (Comms.JOG, Comms.INTERACTIVE):
+            q = self._writes[lane]
+            if q:
+                self._write(''.join([q.popleft() for _ in range(len(q))]), lane)
+
+        self._send_bulk()
+
+    def _send_bulk(self):
+        if self._bulk_timer:
+            self._bulk_timer.cancel()
+            self._bulk_timer = None
+
+        q = self._writes[Comms.BULK]
+        batch = []
+        while q and self._bulk_in_flight < self.bulk_window:
+            data = q.popleft()
+            batch.append(data)
+            self._bulk_in_flight += Comms.ok_lines(data)
+
+        if batch:
+            self._write(''.join(batch), Comms.BULK)
+
+        if q:
+            # in case something does not get an ok
+            self._bulk_timer = self.loop.call_later(self.bulk_timeout, self._bulk_timed_out)
+
+    def _bulk_timed_out(self):
+        self._bulk_timer = None
+        self.log.debug('Comms: no ok for {} BULK lines, sending more anyway'.format(self._bulk_in_flight))
+        self._bulk_in_flight = 0
+        self._lanes = collections.deque(l for l in self._lanes if l != Comms.BULK)
+        self._send_bulk()
+
+    def _bulk_replied(self):
+        self._bulk_in_flight -= 1
+        if self._writes[Comms.BULK]:
+            self._send_bulk()
+
+    def _clear_writes(self):
+        for q in self._writes:
+            q.clear()
+        self._bulk_in_flight = 0
+        self._lanes.clear()
+        if self._bulk_timer:
+            self._bulk_timer.cancel()
+            self._bulk_timer = None
+
+    @staticmethod
+    def ok_lines(data):
+        ''' the number of lines in data that will get an ok, blank lines don't get one '''
+        return sum(1 for l in data.split('\n')[:-1] if l.strip())
+
+    def _ok_lane(self):
+        ''' called for each ok that is not for the stream, returns the priority of the line it is for '''
+        return self._lanes.popleft() if self._lanes else None
+
+    def _write(self, data, lane=None):
         # calls the send_message in Serial Connection proto
         # print('Comms: _write {}'.format(data))
         if self.proto:
+            if lane is not None:
+                # the oks come back in the order the lines were sent, so this tells which lane each one is for
+                self._lanes.extend([lane] * Comms.ok_lines(data))
+                if self.minifier is not None:
+                    # this did not come from the stream and may have changed the motion or feedrate
+                    self.minifier.forget()
             self.proto.send_message(data)
 
+    def _schedule_reports(self, delay):
+        # there must only ever be one report timer outstanding
+        if self.timer:
+            self.timer.cancel()
+        self.timer = self.loop.call_later(delay, self._get_reports)
+
     def _get_reports(self):
         if self._restart_timer:
             return
 
-        queries = self.app.main_window.get_queries()
+        if self._reports_suspended:
+            # suspend_reports(False) will restart them
+            self.timer = None
+            return
+
+        # only query the state when it is likely to have changed, but refresh it every now and then anyway
+        now = time.time()
+        if now - self._last_state_query >= self.state_query_interval:
+            self._query_state = True
+
+        queries = self.app.main_window.get_queries(self._query_state)
         if queries:
-            self._write(queries)
+            self._write(queries, Comms.INTERACTIVE)
+            if self._query_state:
+                self._query_state = False
+                self._last_state_query = now
 
         self._write('?')
 
+    def suspend_reports(self, flag):
+        ''' called from UI thread to stop polling for status, eg when the screen is blanked '''
+        if self.proto and self.loop:
+            self.loop.call_soon_threadsafe(self._suspend_reports, flag)
+
+    def _suspend_reports(self, flag):
+        if flag == self._reports_suspended:
+            return
+
+        self._reports_suspended = flag
+        self.log.info('Comms: status reports {}'.format('suspended' if flag else 'resumed'))
+        if not flag and self.report_rate > 0 and not self._restart_timer:
+            self._query_state = True
+            self._schedule_reports(0)
+
     def stop(self):
         ''' called by ui thread when it is exiting '''
+        self._closing = True
+        if self.reconnecting:
+            self.loop.call_soon_threadsafe(self._connection.cancel)
+
         if self.proto:
             # abort any streaming immediately
             self._stream_pause(False, True)
             if self.file_streamer:
                 self.file_streamer.cancel()
 
-            # we need to close the transport, this will cause mainloop to stop and thread to exit as well
-            async_main_loop.call_soon_threadsafe(self.proto.transport.close)
-
-        # else:
-        #     if async_main_loop and async_main_loop.is_running():
-        #         async_main_loop.call_soon_threadsafe(async_main_loop.stop)
+            # we need to close the transport, once the last connection has closed the comms thread will exit as well
+            self.loop.call_soon_threadsafe(self.proto.transport.close)
 
     def get_ports(self):
         return [port for port in serial.tools.list_ports.comports() if port[2] != 'n/a']
 
-    def run_async_loop(self):
-        ''' called by connect in a new thread to setup and start the asyncio loop '''
-        global async_main_loop
+    def _connect(self):
+        self._connection = asyncio.async(self._run_connection())
 
-        if async_main_loop:
-            self.log.error("Comms: Already running cannot connect again")
-            self.app.main_window.async_display('>>> Already running cannot connect again')
-            return
+    @asyncio.coroutine
+    def _run_connection(self):
+        ''' connects to the port and runs until it is disconnected, in the comms thread.
+            If auto_reconnect is set and the connection is lost it keeps trying to reconnect, the wait between
+            attempts starts at reconnect_delay and doubles each time up to reconnect_max_delay '''
+        attempt = 0
+        was_connected = False
+        try:
+            while True:
+                ok = yield from self._open_connection()
+                if ok is None:
+                    # not a port we can connect to
+                    break
 
-        newloop = asyncio.new_event_loop()
-        asyncio.set_event_loop(newloop)
-        loop = asyncio.get_event_loop()
-        async_main_loop = loop
+                was_connected = was_connected or ok
+                if self._closing or not self.auto_reconnect or not was_connected:
+                    break
+
+                if ok:
+                    attempt = 0
+                delay = min(self.reconnect_delay * 2 ** attempt, self.reconnect_max_delay)
+                attempt += 1
+                self.reconnecting = True
+                self.log.info('Comms: reconnecting in {} seconds'.format(delay))
+                self.app.main_window.async_display('>>> {}, reconnecting in {:g} seconds'.format('Connection lost' if ok else 'Not connected', delay))
+                yield from asyncio.sleep(delay)
+
+        except asyncio.CancelledError:
+            pass
+
+        finally:
+            self.reconnecting = False
+            self._interrupted = None
+            self.loop = None
+            self.comms_loop.release()
+            self.log.info('Comms: connection closed')
+
+    @asyncio.coroutine
+    def _open_connection(self):
+        ''' returns True once it was connected and has disconnected, False if it could not connect,
+            or None if the port is not valid '''
+        loop = self.loop
         f = asyncio.Future()
 
         # if tcp connection port will be net://ipaddress[:port]
@@ -225,53 +1010,67 @@ class Comms():
             self.net_connection = True
             ip = self.port[6:]
             ip = ip.split(':')
-            if len(ip) == 1:
-                self.port = 23
-            else:
-                self.port = ip[1]
-
+            port = 23 if len(ip) == 1 else ip[1]
             self.ipaddress = ip[0]
-            self.log.info('Comms: Connecting to Network at {} port {}'.format(self.ipaddress, self.port))
-            serial_conn = loop.create_connection(sc_factory, self.ipaddress, self.port)
+            self.log.info('Comms: Connecting to Network at {} port {}'.format(self.ipaddress, port))
+            serial_conn = loop.create_connection(sc_factory, self.ipaddress, port)
             if self.app.fast_stream:  # optional do not use ping pong for network connections
                 self.ping_pong = False
 
         elif self.port.startswith('serial://'):
             sc_factory = functools.partial(SerialConnection, cb=self, f=f)  # uses partial so we can pass a parameter
             self.net_connection = False
-            self.port = self.port[9:]
-            serial_conn = serial_asyncio.create_serial_connection(loop, sc_factory, self.port, baudrate=115200)
+            serial_conn = serial_asyncio.create_serial_connection(loop, sc_factory, self.port[9:], baudrate=115200)
 
         else:
-            loop.close()
             self.log.error('Comms: Not a valid connection port: {}'.format(self.port))
             self.app.main_window.async_display('>>> Connect failed: unknown connection type, use "serial://" or "net://"'.format(self.port))
             self.app.main_window.disconnected()
-            loop.close()
-            async_main_loop = None
-            return
+            return None
 
         try:
-            transport, self.proto = loop.run_until_complete(serial_conn)  # sets up connection returning transport and protocol handler
+            transport, self.proto = yield from serial_conn  # sets up connection returning transport and protocol handler
             self.log.debug('Comms: serial connection task completed')
 
-            # this is when we are really setup and ready to go, notify upstream
-            self.app.main_window.connected()
+        except Exception as err:
+            # self.log.error('Comms: {}'.format(traceback.format_exc()))
+            self.log.error("Comms: Got serial error opening port: {0}".format(err))
+            self.app.main_window.async_display(">>> Connect failed: {0}".format(err))
+            self.app.main_window.disconnected()
+            return False
+
+        self.reconnecting = False
 
-            # issue a M115 command to get things started
-            self._write('\n')
-            self._write('M115\n')
+        # this is when we are really setup and ready to go, notify upstream
+        self.app.main_window.connected()
 
-            if self.report_rate > 0:
-                # start a timer to get the reports
-                self.timer = loop.call_later(self.report_rate, self._get_reports)
+        # issue a M115 command to get things started
+        self._query_state = True
+        self._write('\n')
+        self._write('M115\n', Comms.INTERACTIVE)
 
+        if self._interrupted:
+            # the connection was lost in the middle of a stream, offer to carry on from the last line that was ok'd
+            fn, line = self._interrupted
+            self._interrupted = None
+            self.app.main_window.stream_interrupted(fn, line)
+
+        if self.report_rate > 0:
+            # start a timer to get the reports
+            self.timer = loop.call_later(self.report_rate, self._get_reports)
+
+        try:
             # wait until we are disconnected
             self.log.debug('Comms: waiting until disconnection')
-            loop.run_until_complete(f)
+            yield from f
 
+        finally:
             # clean up and notify upstream we have been disconnected
             self.proto = None  # no proto now
+            self._clear_writes()
+            if self.file_streamer and not self._closing:
+                # remember how far it got so it can be continued
+                self._interrupted = (self._stream_fn, self.acked_line)
             self._stream_pause(False, True)  # abort the stream if one is running
             if self.timer:  # stop the timer if we have one
                 self.timer.cancel()
@@ -279,25 +1078,11 @@ class Comms():
 
             self.app.main_window.disconnected()  # tell upstream we disconnected
 
-            # we wait until all tasks are complete
-            pending = asyncio.Task.all_tasks()
-            self.log.debug('Comms: waiting for all tasks to complete: {}'.format(pending))
-            loop.run_until_complete(asyncio.gather(*pending))
-            # loop.run_forever()
-
-        except asyncio.CancelledError:
-            pass
-
-        except Exception as err:
-            # self.log.error('Comms: {}'.format(traceback.format_exc()))
-            self.log.error("Comms: Got serial error opening port: {0}".format(err))
-            self.app.main_window.async_display(">>> Connect failed: {0}".format(err))
-            self.app.main_window.disconnected()
+        # we wait until the stream has finished
+        if self.file_streamer:
+            yield from asyncio.wait([self.file_streamer])
 
-        finally:
-            loop.close()
-            async_main_loop = None
-            self.log.info('Comms: comms thread Exiting...')
+        return True
 
     def _parse_m115(self, s):
         # split fields
@@ -318,8 +1103,8 @@ class Comms():
     def list_sdcard(self, done_cb):
         ''' Issue a ls /sd and send results back to done_cb '''
         self.log.debug('Comms: list_sdcard')
-        if self.proto and async_main_loop:
-            async_main_loop.call_soon_threadsafe(self._list_sdcard, done_cb)
+        if self.proto and self.loop:
+            self.loop.call_soon_threadsafe(self._list_sdcard, done_cb)
         else:
             self.log.warning('Comms: Cannot list sd on a closed connection')
             return False
@@ -368,10 +1153,10 @@ class Comms():
 
         else:
             # accumulate the incoming lines
-            files.append(l)
+            files.append(ll)
 
     def redirect_incoming(self, l):
-        async_main_loop.call_soon_threadsafe(self._redirect_incoming, l)
+        self.loop.call_soon_threadsafe(self._redirect_incoming, l)
 
     def _redirect_incoming(self, l):
         if l:
@@ -390,114 +1175,201 @@ class Comms():
             self._reroute_incoming_data_to = None
 
             if self._restart_timer:
-                self.timer = async_main_loop.call_later(0.1, self._get_reports)
+                self._schedule_reports(0.1)
                 self._restart_timer = False
 
-    # Handle incoming data, see if it is a report and parse it otherwise just display it on the console log
-    # Note the data could be a line fragment and we need to only process complete lines terminated with \n
-    def incoming_data(self, data):
-        ''' called by Serial connection when incoming data is received '''
-        ll = data.splitlines(1)
-        self.log.debug('Comms: incoming_data: {}'.format(ll))
-
-        # process incoming data
-        for s in ll:
-            if self._fragment:
-                # handle line fragment
-                s = ''.join((self._fragment, s))
-                self._fragment = None
-
-            if not s.endswith('\n'):
-                # this is the last line and is a fragment
-                self._fragment = s
-                break
-
-            s = s.rstrip()  # strip off \n
+    def add_handler(self, prefix, handler):
+        ''' register handler(line) to be called for each incoming line that starts with prefix.
+            The longest matching prefix wins, and it replaces any handler already registered for that prefix.
+            Can be called from any thread '''
+        k = prefix[0]
+        hl = [x for x in self._handlers.get(k, []) if x[0] != prefix]
+        hl.append((prefix, handler))
+        hl.sort(key=lambda x: len(x[0]), reverse=True)
+        # we replace the list rather than modify it so it is safe to do while the comms thread is dispatching
+        self._handlers[k] = hl
+
+    def remove_handler(self, prefix):
+        ''' remove the handler registered for prefix '''
+        k = prefix[0]
+        hl = [x for x in self._handlers.get(k, []) if x[0] != prefix]
+        if hl:
+            self._handlers[k] = hl
+        else:
+            self._handlers.pop(k, None)
+
+    def _add_default_handlers(self):
+        self.add_handler('ok', self.handle_ok)
+        self.add_handler('<', self.handle_status)
+        self.add_handler('[PRB:', self.handle_probe)
+        self.add_handler('[', self.handle_bracket)
+        self.add_handler('!!', self.handle_alarm_reply)
+        self.add_handler('error:Alarm lock', self.handle_alarm_reply)
+        self.add_handler('ALARM', self.handle_alarm)
+        self.add_handler('ERROR', self.handle_alarm)
+        self.add_handler('HALTED', self.handle_alarm)
+        self.add_handler('//', self.handle_comment)
+        self.add_handler('switch ', self.handle_switch)
+        self.add_handler('done', lambda s: None)  # ignore these sent after a command on V2
+        self.add_handler('rs ', self.handle_resend)
+        self.add_handler('Resend:', self.handle_resend)
+
+    # Handle incoming lines, see if it is a report and parse it otherwise just display it on the console log
+    def incoming_line(self, s):
+        ''' called by Serial connection with each complete, non empty line received, stripped of the line ending '''
+        # send the line to the requested destination for processing
+        if self._reroute_incoming_data_to is not None:
+            self._reroute_incoming_data_to(s)
+            return
 
-            if len(s) == 0:
-                continue
+        # dispatch on the first character, then the longest prefix that matches
+        hl = self._handlers.get(s[0])
+        if hl is not None:
+            for p, h in hl:
+                if s.startswith(p):
+                    try:
+                        h(s)
+                    except Exception:
+                        self.log.error("Comms: error handling incoming line: {} - {}".format(s, traceback.format_exc()))
+                    return
 
-            # send the line to the requested destination for processing
-            if self._reroute_incoming_data_to is not None:
-                self._reroute_incoming_data_to(s)
-                continue
+        if "FIRMWARE_NAME:" in s:
+            # process the response to M115
+            self._parse_m115(s)
 
-            # process a complete line
-            if s.startswith('ok'):
-                if self.okcnt is not None:
-                    if self.ping_pong:
-                        self.okcnt.set()
-                    else:
-                        self.okcnt += 1
+        else:
+            self.app.main_window.async_display('{}'.format(s))
 
-                # if there is anything after the ok display it
-                if len(s) > 2:
-                    self.app.main_window.async_display('ok {}'.format(s[3:]))
+    def _stream_replied(self):
+        ''' called for each ok, or reply sent instead of one, returns True if it is for a line the stream sent.
+            the replies come back in order so anything after the lines in flight is for a command sent while paused '''
+        if not self.is_streaming or self._unreplied == 0:
+            return False
 
-            elif s.startswith('<'):
-                try:
-                    self.handle_status(s)
-                except Exception:
-                    self.log.error("Comms: error parsing status")
-
-            elif s.startswith('[PRB:'):
-                # Handle PRB reply
-                self.handle_probe(s)
-
-            elif s.startswith('[') and ':' in s:
-                # Handle $# reply
-                self.app.main_window.async_display(s)
-
-            elif s.startswith('['):
-                self.handle_state(s)
-
-            elif s.startswith("!!") or s.startswith("error:Alarm lock"):
-                self.handle_alarm(s)
-                # we should now be paused
-                if self.okcnt is not None and self.ping_pong:
-                    # we need to unblock waiting for ok if we get this
-                    self.okcnt.set()
-
-            elif s.startswith("ALARM") or s.startswith("ERROR") or s.startswith("HALTED"):
-                self.handle_alarm(s)
-
-            elif s.startswith('//'):
-                # ignore comments but display them
-                # handle // action:pause etc
-                pos = s.find('action:')
-                if pos >= 0:
-                    act = s[pos + 7:].strip()  # extract action command
-                    if act in 'pause':
-                        self.app.main_window.async_display('>>> Smoothie requested Pause')
-                        self.is_suspend = True  # this currently only happens if we suspend (M600)
-                        self._stream_pause(True, False)
-                    elif act in 'resume':
-                        self.app.main_window.async_display('>>> Smoothie requested Resume')
-                        self._stream_pause(False, False)
-                    elif act in 'disconnect':
-                        self.app.main_window.async_display('>>> Smoothie requested Disconnect')
-                        self.disconnect()
-                    else:
-                        self.log.warning('Comms: unknown action command: {}'.format(act))
+        self._unreplied -= 1
+        self.line_timings.acked()
+        return True
 
-                else:
-                    self.app.main_window.async_display('{}'.format(s))
+    def handle_ok(self, s):
+        streamed = self._stream_replied()
+        if streamed:
+            if self._sent_lines:
+                self.acked_line = self._sent_lines.popleft()
+            if self.progress:
+                self.progress.oks += 1
+
+            if self.resend is not None:
+                self.resend.replied()
+
+        # an ok for a command sent while the stream is paused, eg a jog or MDI, is not counted as a streamed line
+        if streamed and self.okcnt is not None:
+            if self.window is not None:
+                self.window.release()
+                self.okcnt += 1
+            elif self.ping_pong:
+                self.okcnt.set()
+            else:
+                self.okcnt += 1
+                if self.progress:
+                    # fast stream shows the number of lines ok'd
+                    self.progress.line = self.okcnt
+                if self._ack_target is not None and self.okcnt >= self._ack_target:
+                    self._all_acked.set()
+
+        elif not streamed and self._ok_lane() == Comms.BULK:
+            self._bulk_replied()
+
+        # if there is anything after the ok display it
+        if len(s) > 2:
+            self.app.main_window.async_display('ok {}'.format(s[3:]))
+
+    def handle_bracket(self, s):
+        if ':' in s:
+            # Handle $# reply
+            self.app.main_window.async_display(s)
+        else:
+            self.handle_state(s)
+
+    def handle_alarm_reply(self, s):
+        ''' handle !! or error:Alarm lock sent instead of an ok when in alarm state '''
+        self.handle_alarm(s)
+        streamed = self._stream_replied()
+        if streamed:
+            if self._sent_lines:
+                self.acked_line = self._sent_lines.popleft()
+            if self.resend is not None:
+                self.resend.replied()
+
+        # we should now be paused
+        if streamed and self.window is not None:
+            # this is sent instead of the ok so release the line
+            self.window.release()
+        elif streamed and self.okcnt is not None and self.ping_pong:
+            # we need to unblock waiting for ok if we get this
+            self.okcnt.set()
+        elif not streamed and self._ok_lane() == Comms.BULK:
+            self._bulk_replied()
+
+    def handle_resend(self, s):
+        ''' handle rs N123 or Resend: 123, sent instead of an ok when a line numbered line was rejected '''
+        if self.resend is None:
+            self.app.main_window.async_display(s)
+            return
 
-            elif "FIRMWARE_NAME:" in s:
-                # process the response to M115
-                self._parse_m115(s)
+        # acked_line does not move on as the line will be resent
+        if not self._stream_replied():
+            # not a reply to a line the stream sent
+            if self._ok_lane() == Comms.BULK:
+                self._bulk_replied()
+            self.app.main_window.async_display(s)
+            return
 
-            elif s.startswith("switch "):
-                # switch fan is 0
-                n, x, v = s[7:].split(' ')
-                self.app.main_window.ids.macros.switch_response(n, v)
+        m = re.search(r'(\d+)', s)
+        if m is None:
+            self.resend.replied()
+            self.log.error('Comms: no line number in resend request: {}'.format(s))
+            self.app.main_window.async_display('>>> Cannot tell which line to resend, pausing stream: {}'.format(s))
+            self._stream_pause(True, False)
+        else:
+            k = int(m.group(1))
+            self.log.info('Comms: resend requested from line {}'.format(k))
+            if not self.resend.resend_request(k):
+                self.log.error('Comms: cannot resend line {}, it is no longer available'.format(k))
+                self.app.main_window.async_display('>>> Cannot resend line {}, pausing stream'.format(k))
+                self._stream_pause(True, False)
+
+        # this is sent instead of the ok so release the line
+        if self.window is not None:
+            self.window.release()
+        elif self.okcnt is not None and self.ping_pong:
+            self.okcnt.set()
+
+    def handle_comment(self, s):
+        # ignore comments but display them
+        # handle // action:pause etc
+        pos = s.find('action:')
+        if pos >= 0:
+            act = s[pos + 7:].strip()  # extract action command
+            if act in 'pause':
+                self.app.main_window.async_display('>>> Smoothie requested Pause')
+                self.is_suspend = True  # this currently only happens if we suspend (M600)
+                self._stream_pause(True, False)
+            elif act in 'resume':
+                self.app.main_window.async_display('>>> Smoothie requested Resume')
+                self._stream_pause(False, False)
+            elif act in 'disconnect':
+                self.app.main_window.async_display('>>> Smoothie requested Disconnect')
+                self.disconnect()
+            else:
+                self.log.warning('Comms: unknown action command: {}'.format(act))
 
-            elif s.startswith("done"):
-                # ignore these sent after a command on V2
-                pass
+        else:
+            self.app.main_window.async_display('{}'.format(s))
 
-            else:
-                self.app.main_window.async_display('{}'.format(s))
+    def handle_switch(self, s):
+        # switch fan is 0
+        n, x, v = s[7:].split(' ')
+        self.app.main_window.switch_response(n, v)
 
     def handle_state(self, s):
         # [G0 G55 G17 G21 G90 G94 M0 M5 M9 T1 F4000.0000 S0.8000]
@@ -513,30 +1385,25 @@ class Comms():
         self.app.main_window.update_state(ll)
 
     def handle_status(self, s):
-        # <Idle|MPos:68.9980,-49.9240,40.0000,12.3456|WPos:68.9980,-49.9240,40.0000|F:12345.12|S:1.2>
-        # if temp readings are enabled then also returns T:25.0,0.0|B:25.2,0.0
-        s = s[1:-1]  # strip off < .. >
-
-        # split fields
-        ll = s.split('|')
-        self.log.debug("Comms: Got status: {}".format(ll))
-        if len(ll) < 3:
+        sr = StatusReport.parse(s)
+        if sr is None:
             self.log.warning('Comms: old status report - set new_status_format')
-            self.app.main_window.update_status("ERROR", "set new_status_format true")
+            self.app.main_window.update_status(StatusReport("ERROR"))
             return
 
-        # strip off status
-        status = ll[0]
-
-        # strip of rest into a dict of name: [values,...,]
-        d = {a: [float(y) for y in b.split(',')] for a, b in [x.split(':') for x in ll[1:]]}
+        self.app.main_window.update_status(sr)
 
-        self.log.debug('Comms: got status:{} - rest: {}'.format(status, d))
+        if sr.state != self._last_state:
+            if self.is_streaming and sr.state == 'Idle' and self._last_state == 'Run' and not self.pause_stream:
+                # the planner ran dry in the middle of a stream
+                self.line_timings.starved('idle')
 
-        self.app.main_window.update_status(status, d)
+            # the state changed (eg Run to Idle), so the modal state may have too
+            self._last_state = sr.state
+            self._query_state = True
 
-        # schedule next report
-        self.timer = async_main_loop.call_later(self.report_rate, self._get_reports)
+        # schedule next report at the rate for this state
+        self._schedule_reports(self.report_rates.get(sr.state, self.report_rate))
 
     def handle_probe(self, s):
         # [PRB:1.000,80.137,10.000:0]
@@ -558,117 +1425,200 @@ class Comms():
         #    self.proto.flush_queue()
 
         # call upstream after we have allowed stream to stop
-        async_main_loop.call_soon(self.app.main_window.alarm_state, s)
-
-    def stream_gcode(self, fn, progress=None):
-        ''' called from external thread to start streaming a file '''
-        self.progress = progress
-        if self.proto and async_main_loop:
-            async_main_loop.call_soon_threadsafe(self._stream_file, fn)
+        self.loop.call_soon(self.app.main_window.alarm_state, s)
+
+    def stream_gcode(self, fn, progress=None, start_line=None, start_layer=None):
+        ''' called from external thread to start streaming a file.
+            progress is called from the comms thread with a StreamProgress.Report every progress_interval seconds.
+            To start part way through the file give either start_line, the line number as reported to progress,
+            or start_layer, the Z height of the layer to start at '''
+        self.progress = None if progress is None else StreamProgress(progress, self.progress_interval)
+        if self.proto and self.loop:
+            self.loop.call_soon_threadsafe(self._stream_file, fn, start_line, start_layer)
             return True
         else:
             self.log.warning('Comms: Cannot print to a closed connection')
             return False
 
-    def _stream_file(self, fn):
-        self.file_streamer = asyncio.async(self.stream_file(fn))
+    def _stream_file(self, fn, start_line=None, start_layer=None):
+        self.file_streamer = asyncio.async(self.stream_file(fn, start_line, start_layer))
 
     def stream_pause(self, pause, do_abort=False):
         ''' called from external thread to pause or kill in process streaming '''
-        async_main_loop.call_soon_threadsafe(self._stream_pause, pause, do_abort)
+        self.loop.call_soon_threadsafe(self._stream_pause, pause, do_abort)
+
+    def _set_paused(self, pause):
+        self.pause_stream = pause
+        if pause and self.minifier is not None:
+            # anything could be sent while paused
+            self.minifier.forget()
+        if self._unpaused is not None:
+            if pause:
+                self._unpaused.clear()
+            else:
+                self._unpaused.set()
 
     def _stream_pause(self, pause, do_abort):
         if self.file_streamer:
             if do_abort:
-                self.pause_stream = False
                 self.abort_stream = True  # aborts stream
-                if self.ping_pong and self.okcnt is not None:
+                # wake up the streamer from whatever it is waiting on so it sees the abort right away
+                self._set_paused(False)
+                if self.window is not None:
+                    self.window.cancel()  # release it in case it is waiting for room so it can abort
+                elif self.ping_pong and self.okcnt is not None:
                     self.okcnt.set()  # release it in case it is waiting for ok so it can abort
+                if self._all_acked is not None:
+                    self._all_acked.set()
+                self._release_m0()
                 self.log.info('Comms: Aborting Stream')
 
             elif pause:
-                self.pause_stream = True  # .clear() # pauses stream
+                self._set_paused(True)  # pauses stream
                 # tell UI we paused (and if it was due to a suspend)
                 self.app.main_window.action_paused(True, self.is_suspend)
                 self.is_suspend = False  # always clear this
                 self.log.info('Comms: Pausing Stream')
 
             else:
-                self.pause_stream = False  # .set() # releases pause on stream
+                self._set_paused(False)  # releases pause on stream
                 self.app.main_window.action_paused(False)
                 self.log.info('Comms: Resuming Stream')
 
     @asyncio.coroutine
-    def stream_file(self, fn):
+    def stream_file(self, fn, start_line=None, start_layer=None):
         self.log.info('Comms: Streaming file {} to port'.format(fn))
         self.is_streaming = True
         self.abort_stream = False
-        self.pause_stream = False  # .set() # start out not paused
+        self._unpaused = asyncio.Event()
+        self._set_paused(False)  # start out not paused
         self.last_tool = None
-
-        if self.ping_pong:
+        self.line_timings.reset()
+        self._stream_fn = fn
+        self._sent_lines.clear()
+        self._unreplied = 0
+        self.acked_line = 0
+
+        if self.window_size:
+            # windowed stream, keeps a number of lines in flight and counts the oks
+            self.window = StreamWindow(self.window_size[0], self.window_size[1], autotune=self.window_autotune)
+            self.okcnt = 0
+        elif self.ping_pong:
             self.okcnt = asyncio.Event()
         else:
             self.okcnt = 0
 
+        if self.line_numbers:
+            if self.window is None and not self.ping_pong:
+                self.log.warning('Comms: line numbers are not supported with fast stream')
+            else:
+                self.resend = ResendBuffer()
+
         f = None
         success = False
         linecnt = 0
         tool_change_state = 0
+        resume = None  # ModalState when starting part way through the file, until the motion mode is restored
 
         try:
-            f = yield from aiofiles.open(fn, mode='r')
+            offset = 0
+            preamble = []
+            if start_line is not None or start_layer is not None:
+                # find the line to start at and the modal state up to it, this can take a while on a big file
+                loop = asyncio.get_event_loop()
+                index = yield from loop.run_in_executor(None, GcodeIndex.load, fn)
+                try:
+                    linecnt, state = yield from loop.run_in_executor(None, index.scan, None if start_line is None else start_line - 1, start_layer)
+                except ValueError as err:
+                    self.app.main_window.async_display('>>> Unable to start part way through the file: {}'.format(err))
+                    raise
+
+                offset = index.offset(linecnt)
+                self.acked_line = linecnt
+                preamble = state.preamble()
+                resume = state
+                self.last_tool = state.tool
+                if self.window is None and not self.ping_pong:
+                    # okcnt is compared with linecnt
+                    self.okcnt = linecnt
+                self.app.main_window.async_display('>>> Starting at line {} after {}'.format(linecnt + 1, ', '.join(preamble)))
+
+            if self.progress:
+                self.progress.line = linecnt
+                self.progress.start()
+
+            if self.minify:
+                self.minifier = GcodeMinifier(self.minify_resolution)
+                # the preamble sets the modal state the rest of the file is minified against, so it has to go
+                # through the minifier before the reader starts on the file
+                preamble = [self.minifier.minify(l) for l in preamble]
+            f = LineReader(fn, offset=offset, transform=self.minifier.minify if self.minifier else None)
+            yield from f.open()
+
+            if self.resend is not None:
+                # start the line numbers at 1
+                n, line = self.resend.reset(0)
+                if not (yield from self._send_line(line, n, linecnt)):
+                    self.abort_stream = True
+
+            # restore the modal state when starting part way through the file
+            for l in preamble:
+                if self.abort_stream:
+                    break
+                line = (l + '\n').encode('utf-8')
+                if not (yield from self._send_line(line, acked_line=linecnt)):
+                    self.abort_stream = True
+
             while True:
 
                 if tool_change_state == 0:
-                    # yield from self.pause_stream.wait() # wait for pause to be released
-                    # needed to do it this way as the Event did not seem to work it would pause but not unpause
-                    # TODO maybe use Future here to wait for unpause
-                    # create future when pause then yield from it here then delete it
                     if self.pause_stream:
-                        if self.ping_pong:
+                        if self.ping_pong and self.window is None:
                             # we need to ignore any ok from command while we are paused
                             self.okcnt = None
 
-                        # wait until pause is released
-                        while self.pause_stream:
-                            yield from asyncio.sleep(1)
-                            if self.progress:
-                                self.progress(linecnt)
-                            if self.abort_stream:
-                                break
+                        # wait until pause is released (or the stream is aborted)
+                        yield from self._unpaused.wait()
+                        self.line_timings.expect_gap()
 
                         # recreate okcnt
-                        if self.ping_pong:
+                        if self.ping_pong and self.window is None:
                             self.okcnt = asyncio.Event()
 
-                    # read next line
-                    line = yield from f.readline()
+                    # read next line, blank lines and comments have already been stripped out by the reader
+                    r = yield from f.readline()
 
-                    if not line:
+                    if r is None:
                         # EOF
                         break
 
                     if self.abort_stream:
                         break
 
-                    l = line.strip()
-                    if len(l) == 0 or l.startswith(';'):
+                    t, line = r
+                    if t == LineReader.MSG:
+                        self.app.main_window.async_display(line)
                         continue
 
-                    if l.startswith('(MSG'):
-                        self.app.main_window.async_display(l)
+                    if t == LineReader.NOTIFY:
+                        Notify.send(line)
                         continue
 
-                    if l.startswith('(NOTIFY'):
-                        Notify.send(l)
-                        continue
+                    if resume is not None:
+                        l = resume.with_motion(str(line, 'utf-8').strip())
+                        if l is not None:
+                            line = (l + '\n').encode('utf-8')
+                            resume = None
 
-                    if l.startswith('('):
-                        continue
+                    # line is bytes, we only count lines that start with GMXY
+                    counted = line[0] in b'GMXY'
 
-                    if l.startswith('T'):
-                        self.last_tool = l
+                    if line[0] == 0x54:  # T
+                        self.last_tool = str(line, 'utf-8').strip()
+
+                    if self.app.manual_tool_change or self.app.wait_on_m0:
+                        # only decode the line when something needs to look at it
+                        l = str(line, 'utf-8').strip()
 
                     if self.app.manual_tool_change:
                         # handle tool change M6 or M06
@@ -683,6 +1633,9 @@ class Comms():
                             self.m0 = asyncio.Event()
                             yield from self.m0.wait()
                             self.m0 = None
+                            if self.abort_stream:
+                                break
+                            self.line_timings.expect_gap()
                             continue
 
                 if self.abort_stream:
@@ -692,66 +1645,50 @@ class Comms():
                 if self.app.manual_tool_change and tool_change_state > 0:
                     if tool_change_state == 1:
                         # we insert an M400 so we can wait for last command to actually execute and complete
-                        line = "M400\n"
+                        line = b"M400\n"
                         tool_change_state = 2
 
                     elif tool_change_state == 2:
                         # we got the M400 so queue is empty so we send a suspend and tell upstream
-                        line = "M600\n"
+                        line = b"M600\n"
+                        if self.window is not None:
+                            # wait for the M400 to be ok'd so the queue really is empty
+                            if not (yield from self.window.drain()):
+                                break
+
                         # we need to pause the stream here immediately, but the real _stream_pause will be called by suspend
-                        self.pause_stream = True  # we don't normally set this directly
+                        self._set_paused(True)  # we don't normally set this directly
                         self.app.main_window.tool_change_prompt("{} - {}".format(l, self.last_tool))
                         tool_change_state = 0
 
-                # s= time.time()
-                # print("{} - {}".format(s, line))
-                # send the line
-                if self.ping_pong and self.okcnt is not None:
-                    # clear the event, which will be set by an incoming ok
-                    self.okcnt.clear()
-
-                self._write(line)
-
-                # wait for ok from that command (I'd prefer to interleave with the file read but it is too complex)
-                if self.ping_pong and self.okcnt is not None:
-                    try:
-                        yield from self.okcnt.wait()
-                        # e= time.time()
-                        # print("{} ({}) ok".format(e, (e-s)*1000, ))
-                    except Exception:
-                        self.log.debug('Comms: okcnt wait cancelled')
+                if self.resend is not None:
+                    # first resend any lines the controller asked for
+                    if not (yield from self._send_resends()):
                         break
 
-                # when streaming we need to yield until the flow control is dealt with
-                if self.proto._connection_lost:
-                    # Yield to the event loop so connection_lost() may be
-                    # called.  Without this, _drain_helper() would return
-                    # immediately, and code that calls
-                    #     write(...); yield from drain()
-                    # in a loop would never call connection_lost(), so it
-                    # would not see an error when the socket is closed.
-                    yield
-
-                if self.abort_stream:
+                # send the line
+                if not (yield from self._send_line(line, acked_line=linecnt + 1 if counted else linecnt)):
                     break
 
-                # if the buffers are full then wait until we can send some more
-                yield from self.proto._drain_helper()
+                if counted:
+                    linecnt += 1
 
-                if self.abort_stream:
-                    break
+                    if self.progress and (self.ping_pong or self.window is not None):
+                        # number of lines sent, fast stream counts the lines ok'd in handle_ok
+                        self.progress.line = linecnt
 
-                # we only count lines that start with GMXY
-                if l[0] in "GMXY":
-                    linecnt += 1
+            if self.resend is not None and not self.abort_stream:
+                # wait for all the replies and resend anything that is rejected on the way
+                while True:
+                    if not (yield from self._send_resends()):
+                        break
+                    if self.window is not None and not (yield from self.window.drain()):
+                        break
+                    if not self.resend.pending:
+                        break
 
-                if self.progress and linecnt % 10 == 0:  # update every 10 lines
-                    if self.ping_pong:
-                        # number of lines sent
-                        self.progress(linecnt)
-                    else:
-                        # number of lines ok'd
-                        self.progress(self.okcnt)
+                if self.resend.resends:
+                    self.log.info('Comms: {} resends were requested'.format(self.resend.resends))
 
             success = not self.abort_stream
 
@@ -762,29 +1699,51 @@ class Comms():
             if f:
                 yield from f.close()
 
+            if self.minifier and self.minifier.bytes_in:
+                msg = 'Minified {} bytes to {}, {:.1%} saved'.format(self.minifier.bytes_in, self.minifier.bytes_out, self.minifier.saved())
+                self.log.info('Comms: {}'.format(msg))
+                self.app.main_window.async_display('>>> {}'.format(msg))
+
             if self.abort_stream:
                 if self.proto:
                     self.proto.flush_queue()
 
                 self._write('\x18')
 
-            if success and not self.ping_pong:
-                self.log.debug('Comms: Waiting for okcnt to catch up: {} vs {}'.format(self.okcnt, linecnt))
-                # we have to wait for all lines to be ack'd
-                while self.okcnt < linecnt:
-                    if self.progress:
-                        self.progress(self.okcnt)
-                    if self.abort_stream:
-                        success = False
-                        break
+            if success and self.window is not None:
+                # we have to wait for all lines in the window to be ack'd
+                self.log.debug('Comms: Waiting for {} lines in flight to be ok\'d'.format(len(self.window)))
+                if not (yield from self.window.drain()):
+                    success = False
 
-                    yield from asyncio.sleep(1)
+            elif success and not self.ping_pong:
+                self.log.debug('Comms: Waiting for okcnt to catch up: {} vs {}'.format(self.okcnt, linecnt))
+                # we have to wait for all lines to be ack'd, handle_ok sets _all_acked when the last one comes in
+                self._all_acked = asyncio.Event()
+                self._ack_target = linecnt
+                if self.okcnt >= linecnt:
+                    self._all_acked.set()
+                try:
+                    yield from self._all_acked.wait()
+                finally:
+                    self._all_acked = None
+                    self._ack_target = None
+                if self.abort_stream:
+                    success = False
 
+            if self.progress:
+                self.progress.stop()
             self.file_streamer = None
             self.progress = None
             self.okcnt = None
+            self._unpaused = None
+            self.window = None
+            self.resend = None
+            self.minifier = None
             self.is_streaming = False
             self.do_query = False
+            # lines that were never ok'd (eg the stream was aborted) must not take the oks of the next stream
+            self.line_timings.reset(keep=True)
 
             # notify upstream that we are done
             self.app.main_window.stream_finished(success)
@@ -793,21 +1752,111 @@ class Comms():
 
         return success
 
+    @asyncio.coroutine
+    def _send_line(self, line, n=None, acked_line=None):
+        ''' send a line to the controller with whatever flow control the stream uses, n is its line number if it is
+            already numbered (a resend), new lines are minified and numbered here when the stream does that.
+            acked_line is what acked_line becomes when it is ok'd, None for a line being resent.
+            returns False if the stream should stop '''
+        new = n is None
+        if new and self.minifier is not None and self.minifier.redundant(str(line, 'utf-8')):
+            # nothing to send, eg a feedrate that is already in effect
+            return not self.abort_stream
+
+        i = self.line_timings.queued()
+        room = len(line)
+        if new and self.resend is not None:
+            # number it after the wait, as the minified line is only known then
+            n = self.resend.lineno + 1
+            room += ResendBuffer.overhead(n)
+        if n is not None:
+            # this has to be counted as sent before we wait for room, so if a resend is requested while
+            # we are waiting the reply to this line is known to be covered by that resend
+            self.resend.sent(n)
+
+        if self.window is not None:
+            # wait until there is room in the window for this line
+            if not (yield from self.window.acquire(room)):
+                return False
+
+        elif self.ping_pong and self.okcnt is not None:
+            # clear the event, which will be set by an incoming ok
+            self.okcnt.clear()
+
+        if new:
+            if self.minifier is not None:
+                # the motion and feedrate in effect may have changed while we were waiting, so this is decided now
+                line = (self.minifier.modal(str(line, 'utf-8')) + '\n').encode('utf-8')
+            if self.resend is not None:
+                n, line = self.resend.number(line)
+
+        self._write(line)
+        self._unreplied += 1
+        self.line_timings.written(i)
+        if acked_line is not None:
+            self._sent_lines.append(acked_line)
+        if self.progress:
+            self.progress.bytes += len(line)
+
+        # wait for ok from that command (I'd prefer to interleave with the file read but it is too complex)
+        if self.window is None and self.ping_pong and self.okcnt is not None:
+            try:
+                yield from self.okcnt.wait()
+            except Exception:
+                self.log.debug('Comms: okcnt wait cancelled')
+                return False
+
+        if self.proto is None:
+            # we got disconnected while waiting
+            return False
+
+        # when streaming we need to yield until the flow control is dealt with
+        if self.proto._connection_lost:
+            # Yield to the event loop so connection_lost() may be
+            # called.  Without this, _drain_helper() would return
+            # immediately, and code that calls
+            #     write(...); yield from drain()
+            # in a loop would never call connection_lost(), so it
+            # would not see an error when the socket is closed.
+            yield
+
+        if self.abort_stream:
+            return False
+
+        # if the buffers are full then wait until we can send some more
+        yield from self.proto._drain_helper()
+
+        return not self.abort_stream
+
+    @asyncio.coroutine
+    def _send_resends(self):
+        ''' send any lines the controller asked to be resent, returns False if the stream should stop '''
+        while self.resend.pending:
+            if self.abort_stream:
+                return False
+            n, line = self.resend.pending.popleft()
+            if not (yield from self._send_line(line, n)):
+                return False
+
+        return True
+
     def release_m0(self):
+        ''' called from external thread when the M0 dialog is dismissed '''
+        loop = self.loop
+        if loop is not None:
+            # the connection may have dropped while the dialog was up, in which case the stream has gone anyway
+            loop.call_soon_threadsafe(self._release_m0)
+
+    def _release_m0(self):
         if self.m0:
             self.m0.set()
 
     @staticmethod
     def file_len(fname):
-        ''' use external process to quickly find total number of G/M lines in file '''
+        ''' find total number of G/M lines in file, from the cached line index if the file has not changed '''
         # NOTE some laser raster formats have lines that start with X and no G/M
         # and some CAM programs just output X or Y lines
-        # TODO if windows use a slow python method
-        p = subprocess.Popen(['grep', '-c', "^[GMXY]", fname], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        result, err = p.communicate()
-        if p.returncode != 0:
-            raise IOError(err)
-        return int(result.strip().split()[0])
+        return len(GcodeIndex.load(fname))
 
 
 if __name__ == "__main__":
@@ -855,21 +1904,26 @@ if __name__ == "__main__":
             # in this case we do want to disconnect
             comms.proto.transport.close()
 
-        def update_status(self, stat, d):
+        def update_status(self, sr):
             pass
 
         def manual_tool_change(self, l):
             print("tool change: {}\n".format(l))
 
     if len(sys.argv) < 3:
-        print("Usage: {} port file".format(sys.argv[0]))
+        print("Usage: {} port file [fast|window]".format(sys.argv[0]))
         exit(0)
 
     app = CommsApp()
     comms = Comms(app, 10)
     if len(sys.argv) > 3:
-        comms.ping_pong = False
-        print('Fast Stream')
+        if sys.argv[3] == 'window':
+            comms.window_size = (8, 256)
+            comms.window_autotune = True
+            print('Windowed Stream')
+        else:
+            comms.ping_pong = False
+            print('Fast Stream')
 
     try:
         nlines = Comms.file_len(sys.argv[2])  # get number of lines so we can do progress and ETA
@@ -880,8 +1934,9 @@ if __name__ == "__main__":
 
     start = None
 
-    def display_progress(n):
+    def display_progress(p):
         global start, nlines
+        n = p.line
         if not start:
             start = datetime.datetime.now()
             print("Print started at: {}".format(start.strftime('%x %X')))
@@ -896,7 +1951,7 @@ if __name__ == "__main__":
             else:
                 eta = 0
             et = datetime.timedelta(seconds=int(eta))
-            print("progress: {}/{} {:.1%} ETA {}".format(n, nlines, n / nlines, et))
+            print("progress: {}/{} {:.1%} ETA {}, {} bytes sent, {} oks".format(n, nlines, n / nlines, et, p.bytes, p.oks))
 
     try:
         t = comms.connect(sys.argv[1])
@@ -905,7 +1960,7 @@ if __name__ == "__main__":
                 # wait for startup to clear up any incoming oks
                 sleep(5)  # Time in seconds.
 
-                comms.stream_gcode(sys.argv[2], progress=lambda x: display_progress(x))
+                comms.stream_gcode(sys.argv[2], progress=display_progress)
                 app.end_event.wait()  # wait for streaming to complete
 
                 print("File sent: {}".format('Ok' if app.ok else 'Failed'))
@@ -0,0 +1,329 @@
+''' Arc fitting, converts runs of short G1 moves that lie on a circle into G2/G3 arcs.
+    run from the top level directory: python3 gcode_arcs.py [-t tolerance] file.g [out.g]
+'''
+import re
+import os
+import math
+import argparse
+from gcode_toolpath import Toolpath
+
+COMMENT = re.compile(r'\(.*?\)|;.*')
+
+
+class ArcFitter():
+    ''' Fits arcs to runs of G1 moves in the XY plane. A run is only turned into an arc if every point is within
+        tolerance of the circle and every segment is within tolerance of the arc, they all turn the same way,
+        and for a 3d printer the extrusion per mm stays the same.
+        Only plain G1 moves in absolute mode with G17, that don't change Z or the feedrate part way through,
+        are fitted, anything else is copied as it is '''
+
+    def __init__(self, tolerance=0.01, min_segments=3, max_segments=500, max_radius=1000.0, extrusion_tolerance=0.05):
+        self.tolerance = tolerance
+        self.min_segments = min_segments
+        self.max_segments = max_segments
+        self.max_radius = max_radius
+        self.extrusion_tolerance = extrusion_tolerance
+        self.lines_in = 0
+        self.lines_out = 0
+        self.arcs = 0
+
+        # modal state
+        self._pos = [None, None, None]
+        self._e = 0.0
+        self._relative = False
+        self._relative_e = False
+        self._plane = 17
+        self._motion = None  # motion mode in effect in the original file
+        self._arc_modal = False  # set when an arc has been written and the file still expects self._motion
+
+        # the run of segments being fitted, each is (x, y, e, f, line, total) where e is the amount extruded and
+        # total is the E at the end of the segment
+        self._start = None  # (x, y) the run starts from
+        self._run = []
+        self._feed = None  # F given on the first line of the run
+        self._fit = None  # (xc, yc, direction) for the whole run, None if it does not fit yet
+
+    def fit_file(self, fn, out_fn):
+        with open(fn) as f, open(out_fn, 'w') as o:
+            for l in self.fit_lines(f):
+                o.write(l)
+                o.write('\n')
+
+    def fit_lines(self, lines):
+        ''' yields the fitted lines (without line endings) for the given lines '''
+        for l in lines:
+            self.lines_in += 1
+            l = l.rstrip('\r\n')
+            seg = self._segment(l)
+            if seg is None:
+                yield from self._flush()
+                self._update(l)
+                yield self._out(l)
+            else:
+                yield from self._add(seg)
+
+        yield from self._flush()
+
+    def _out(self, l):
+        self.lines_out += 1
+        if self._arc_modal:
+            # the file relies on the motion mode the arc changed, so put it back
+            code = COMMENT.sub('', l).strip().upper()
+            gs = [float(v) for c, v in Toolpath.WORDS.findall(code) if c == 'G' and v.strip('.')]
+            if any(g in (0, 1, 2, 3) for g in gs):
+                self._arc_modal = False
+            elif code[:1] in ('X', 'Y', 'Z', 'E') and not gs:
+                self._arc_modal = False
+                return 'G{:g} {}'.format(self._motion, l)
+        return l
+
+    def _segment(self, l):
+        ''' returns (x, y, e, f, line) if the line is a move that can be part of an arc, otherwise None '''
+        code = COMMENT.sub('', l).strip()
+        if not code or self._relative or self._plane != 17 or self._pos[0] is None or self._pos[1] is None:
+            return None
+
+        words = Toolpath.WORDS.findall(code)
+        if Toolpath.WORDS.sub('', code).strip():
+            # there is something else on the line, eg an M code
+            return None
+
+        try:
+            d = {c: float(v) for c, v in words}
+        except ValueError:
+            return None
+        if len(d) != len(words):
+            # a word is repeated
+            return None
+
+        g = d.pop('G', None)
+        if (self._motion if g is None else g) != 1:
+            return None
+        if 'X' not in d and 'Y' not in d:
+            return None
+        if any(c in d for c in 'IJKRS'):
+            return None
+        if 'Z' in d and d['Z'] != self._pos[2]:
+            return None
+
+        x = d.get('X', self._pos[0])
+        y = d.get('Y', self._pos[1])
+        if 'E' in d:
+            e = d['E'] if self._relative_e else d['E'] - self._e
+        else:
+            e = None
+        if g is not None:
+            self._motion = g
+        return x, y, e, d.get('F'), l
+
+    def _update(self, l):
+        ''' update the modal state for a line that is not part of a run '''
+        code = COMMENT.sub('', l).upper()
+        if re.search(r'M83\b', code):
+            self._relative_e = True
+        elif re.search(r'M82\b', code):
+            self._relative_e = False
+
+        d = {}
+        gs = []
+        for c, v in Toolpath.WORDS.findall(code):
+            try:
+                v = float(v)
+            except ValueError:
+                continue
+            if c == 'G':
+                gs.append(v)
+            else:
+                d[c] = v
+
+        for g in gs:
+            if g in (0, 1, 2, 3):
+                self._motion = g
+            elif g in (17, 18, 19):
+                self._plane = g
+            elif g in (90, 91):
+                self._relative = g == 91
+            elif g in (10, 92):
+                if 'E' in d:
+                    self._e = d['E']
+                for i, a in enumerate('XYZ'):
+                    if a in d:
+                        self._pos[i] = d[a]
+                return
+            elif g in (28, 30, 38.2, 38.3, 38.4, 38.5, 53) or 80 <= g <= 89:
+                # we don't know where this ends up
+                self._pos = [None, None, None]
+                if 80 <= g <= 89:
+                    self._motion = None
+                return
+
+        if not gs and not code.lstrip().startswith(('X', 'Y', 'Z', 'E')):
+            # not a move, eg an M code with parameters
+            return
+
+        if 'E' in d and not self._relative_e:
+            self._e = d['E']
+        for i, a in enumerate('XYZ'):
+            if a in d:
+                if self._relative:
+                    if self._pos[i] is not None:
+                        self._pos[i] += d[a]
+                else:
+                    self._pos[i] = d[a]
+
+    def _add(self, seg):
+        x, y, e, f, l = seg
+        if self._run:
+            # it has to extrude (or not) like the rest of the run, and keep the same feedrate
+            if (e is None) != (self._run[0][2] is None) or (f is not None and f != self._feed):
+                yield from self._flush()
+
+        if not self._run:
+            self._start = (self._pos[0], self._pos[1])
+            self._feed = f
+
+        self._pos[0] = x
+        self._pos[1] = y
+        if e is not None:
+            self._e += e
+        self._run.append((x, y, e, f, l, self._e))
+
+        if len(self._run) < self.min_segments:
+            return
+
+        fit = self._fit_run()
+        if fit is not None:
+            self._fit = fit
+            if len(self._run) >= self.max_segments:
+                yield from self._flush()
+            return
+
+        if self._fit is not None:
+            # the last segment does not fit so the arc is the run up to it, and that segment starts a new run
+            last = self._run.pop()
+            yield self._arc()
+            self._start = (self._run[-1][0], self._run[-1][1])
+            self._run = [last]
+            self._feed = f
+            self._fit = None
+        else:
+            # the first segment is not on an arc with the next ones
+            yield self._out(self._run[0][4])
+            self._start = (self._run[0][0], self._run[0][1])
+            self._run.pop(0)
+            self._feed = self._run[0][3]
+
+    def _flush(self):
+        if self._run:
+            if self._fit is not None:
+                yield self._arc()
+            else:
+                for s in self._run:
+                    yield self._out(s[4])
+        self._run = []
+        self._fit = None
+        self._feed = None
+
+    def _fit_run(self):
+        ''' returns (xc, yc, direction) if the run fits on an arc, direction is 1 for CCW and -1 for CW '''
+        pts = [self._start] + [(s[0], s[1]) for s in self._run]
+        c = _circle(pts[0], pts[len(pts) // 2], pts[-1])
+        if c is None:
+            return None
+
+        xc, yc = c
+        r = math.hypot(pts[0][0] - xc, pts[0][1] - yc)
+        if r > self.max_radius or r < self.tolerance:
+            return None
+
+        tol = self.tolerance
+        direction = 0
+        sweep = 0.0
+        for (x0, y0), (x1, y1) in zip(pts, pts[1:]):
+            if abs(math.hypot(x1 - xc, y1 - yc) - r) > tol:
+                return None
+            # how far the middle of the segment is from the arc
+            if r - math.hypot((x0 + x1) / 2 - xc, (y0 + y1) / 2 - yc) > tol:
+                return None
+            a = math.atan2((x0 - xc) * (y1 - yc) - (y0 - yc) * (x1 - xc), (x0 - xc) * (x1 - xc) + (y0 - yc) * (y1 - yc))
+            d = 1 if a > 0 else -1
+            if a == 0 or (direction and d != direction):
+                return None
+            direction = d
+            sweep += abs(a)
+
+        if sweep >= 2 * math.pi - 0.01:
+            # a full circle can't be written as one arc
+            return None
+
+        if self._run[0][2] is not None:
+            # the extrusion per mm has to be about the same for every segment
+            rates = []
+            for (x0, y0), s in zip(pts, self._run):
+                n = math.hypot(s[0] - x0, s[1] - y0)
+                if n == 0:
+                    return None
+                rates.append(s[2] / n)
+            mean = sum(rates) / len(rates)
+            if any(abs(q - mean) > abs(mean) * self.extrusion_tolerance for q in rates):
+                return None
+
+        return xc, yc, direction
+
+    def _arc(self):
+        xc, yc, direction = self._fit
+        x0, y0 = self._start
+        x, y, e, f, l, total = self._run[-1]
+        words = ['G3' if direction > 0 else 'G2', 'X' + _fmt(x), 'Y' + _fmt(y), 'I' + _fmt(xc - x0), 'J' + _fmt(yc - y0)]
+        if e is not None:
+            words.append('E' + _fmt(sum(s[2] for s in self._run) if self._relative_e else total, 5))
+        if self._feed is not None:
+            words.append('F' + _fmt(self._feed))
+
+        self.arcs += 1
+        self.lines_out += 1
+        # the arc leaves the motion mode as G2 or G3
+        self._arc_modal = True
+        return ' '.join(words)
+
+
+def _circle(a, b, c):
+    ''' the center of the circle through the three points, None if they are in a line '''
+    ax, ay = a
+    bx, by = b
+    cx, cy = c
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if abs(d) < 1e-12:
+        return None
+    a2 = ax * ax + ay * ay
+    b2 = bx * bx + by * by
+    c2 = cx * cx + cy * cy
+    return (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d, (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d
+
+
+def _fmt(v, places=4):
+    return '{:.{}f}'.format(v, places).rstrip('0').rstrip('.')
+
+
+def arcs_file_name(fn):
+    ''' where the fitted version of fn goes '''
+    base, ext = os.path.splitext(fn)
+    return '{}-arcs{}'.format(base, ext)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert runs of short G1 moves into G2/G3 arcs')
+    parser.add_argument('file', help='gcode file to fit arcs in')
+    parser.add_argument('output', nargs='?', help='where to write the result, default is <file>-arcs')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.01, help='how far the arc may be from the moves (mm)')
+    parser.add_argument('--min-segments', type=int, default=3, help='fewest moves to turn into an arc')
+    args = parser.parse_args()
+
+    out = args.output or arcs_file_name(args.file)
+    fitter = ArcFitter(args.tolerance, args.min_segments)
+    fitter.fit_file(args.file, out)
+    print('{} lines to {} lines with {} arcs, written to {}'.format(fitter.lines_in, fitter.lines_out, fitter.arcs, out))
+
+
+if __name__ == "__main__":
+    main()
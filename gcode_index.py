@@ -0,0 +1,296 @@
+import os
+import re
+import mmap
+import struct
+import logging
+from array import array
+
+
+class GcodeIndex():
+    ''' Index of the streamable lines in a gcode file, the byte offset of each line that starts with G, M, X or Y
+        (the same lines the streamer counts for progress) is kept in an array('Q').
+        The file is scanned through an mmap, and the index is cached next to the file in .<name>.idx
+        keyed by the files mtime and size, so it only gets rebuilt when the file changes '''
+
+    MAGIC = b'SMOOIDX1'
+    HEADER = struct.Struct('<8sqQQ')  # magic, mtime_ns, size, number of lines
+    LINE_START = re.compile(rb'^[ \t]*[GMXY]', re.MULTILINE)
+
+    def __init__(self, fn):
+        self.log = logging.getLogger()  # .getChild('GcodeIndex')
+        self.fn = fn
+        self.mtime = None
+        self.size = None
+        self.offsets = array('Q')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def load(cls, fn, cache=True):
+        ''' returns the index for the file, from the cache if it is still valid otherwise it is rebuilt '''
+        idx = cls(fn)
+        st = os.stat(fn)
+        if cache and idx._read_cache(st):
+            return idx
+
+        idx.build(st)
+        if cache:
+            idx._write_cache()
+        return idx
+
+    def offset(self, n):
+        ''' the byte offset of the n'th counted line, where the first line is 0 '''
+        return self.offsets[n]
+
+    def build(self, st=None):
+        if st is None:
+            st = os.stat(self.fn)
+        self.mtime = st.st_mtime_ns
+        self.size = st.st_size
+        self.offsets = array('Q')
+        if self.size == 0:
+            # can't mmap an empty file
+            return
+
+        with open(self.fn, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            self.offsets.extend(m.start() for m in GcodeIndex.LINE_START.finditer(mm))
+
+        self.log.debug('GcodeIndex: indexed {} lines in {}'.format(len(self.offsets), self.fn))
+
+    def scan(self, line=None, z=None):
+        ''' pre-pass to start part way through the file, returns (n, state) where n is the counted line to start at,
+            either line or the first line that moves to the Z height z, and state is the ModalState in effect before it '''
+        if line is not None:
+            if not 0 <= line < len(self.offsets):
+                raise ValueError('line {} is not in the file which has {} lines'.format(line + 1, len(self.offsets)))
+            end = self.offsets[line]
+        elif z is not None:
+            end = self.size
+        else:
+            raise ValueError('need a line or Z height to start at')
+
+        state = ModalState()
+        n = 0
+        found = False
+        if end == 0:
+            return n, state
+
+        with open(self.fn, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            while mm.tell() < end:
+                l = mm.readline().decode('utf-8', 'replace').strip()
+                if not l:
+                    continue
+                counted = l[0] in 'GMXY'
+                if counted and found:
+                    # the move to the layer was on a line that is not streamed on its own, so start at the next one
+                    return n, state
+
+                words = ModalState.words(l)
+                if z is not None and words:
+                    nz = state.target('Z', words)
+                    if nz is not None and abs(nz - z) < 0.0005 and (state.pos['Z'] is None or abs(state.pos['Z'] - z) >= 0.0005):
+                        if counted:
+                            return n, state
+                        found = True
+
+                state.apply(words)
+                if counted:
+                    n += 1
+
+        if z is not None:
+            if found and n < len(self.offsets):
+                return n, state
+            raise ValueError('no move to Z{} was found'.format(z))
+
+        return n, state
+
+    def cache_path(self):
+        d, n = os.path.split(self.fn)
+        return os.path.join(d, '.{}.idx'.format(n))
+
+    def _read_cache(self, st):
+        try:
+            with open(self.cache_path(), 'rb') as f:
+                magic, mtime, size, n = GcodeIndex.HEADER.unpack(f.read(GcodeIndex.HEADER.size))
+                if magic != GcodeIndex.MAGIC or mtime != st.st_mtime_ns or size != st.st_size:
+                    return False
+                offsets = array('Q')
+                offsets.fromfile(f, n)
+
+        except (OSError, EOFError, struct.error):
+            return False
+
+        self.mtime = mtime
+        self.size = size
+        self.offsets = offsets
+        return True
+
+    def _write_cache(self):
+        # write to a temporary file and rename it, so a reader never sees a partial index
+        fn = self.cache_path()
+        tmp = fn + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(GcodeIndex.HEADER.pack(GcodeIndex.MAGIC, self.mtime, self.size, len(self.offsets)))
+                self.offsets.tofile(f)
+            os.replace(tmp, fn)
+
+        except OSError as err:
+            # the directory may be read only, we just don't get the cache
+            self.log.debug('GcodeIndex: unable to write index cache {}: {}'.format(fn, err))
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+class ModalState():
+    ''' The modal state of the gcode up to some point in a file, and the preamble needed to restore it
+        when starting from that point '''
+
+    WORD = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+    COMMENT = re.compile(r'\(.*?\)|;.*')
+
+    def __init__(self):
+        self.motion = 'G0'
+        self.plane = 'G17'
+        self.units = 'G21'
+        self.distance = 'G90'
+        self.wcs = 'G54'
+        self.spindle = 'M5'
+        self.extrude = 'M82'
+        self.s = None
+        self.feed = None
+        self.tool = None
+        self.max_z = None
+        self.pos = {'X': None, 'Y': None, 'Z': None, 'E': None}
+
+    @staticmethod
+    def words(line):
+        ''' the (letter, value) words in a line of gcode, without any comments '''
+        return [(c, float(v)) for c, v in ModalState.WORD.findall(ModalState.COMMENT.sub('', line.upper()))]
+
+    def target(self, axis, words):
+        ''' where the words will move the axis to, or None if they do not move it '''
+        v = None
+        for c, x in words:
+            if c == 'G' and x in (53, 92):
+                return None
+            if c == axis:
+                v = x
+        if v is None:
+            return None
+        if self._is_relative(axis):
+            return None if self.pos[axis] is None else self.pos[axis] + v
+        return v
+
+    def apply(self, words):
+        moves = {}
+        machine = False
+        set_pos = False
+        for c, v in words:
+            if c == 'G':
+                if v in (0, 1, 2, 3):
+                    self.motion = 'G{:g}'.format(v)
+                elif v in (17, 18, 19):
+                    self.plane = 'G{:g}'.format(v)
+                elif v in (20, 21):
+                    self.units = 'G{:g}'.format(v)
+                elif v in (90, 91):
+                    self.distance = 'G{:g}'.format(v)
+                elif 54 <= v <= 59.3:
+                    self.wcs = 'G{:g}'.format(v)
+                elif v == 53:
+                    machine = True
+                elif v == 92:
+                    set_pos = True
+
+            elif c == 'M':
+                if v in (3, 4, 5):
+                    self.spindle = 'M{:g}'.format(v)
+                elif v in (82, 83):
+                    self.extrude = 'M{:g}'.format(v)
+
+            elif c == 'S':
+                self.s = v
+            elif c == 'F':
+                self.feed = v
+            elif c == 'T':
+                self.tool = 'T{:g}'.format(v)
+            elif c in self.pos:
+                moves[c] = v
+
+        if machine:
+            # a move in machine coordinates, we don't know where that is in work coordinates
+            for a in moves:
+                self.pos[a] = None
+            return
+
+        for a, v in moves.items():
+            if not set_pos and self._is_relative(a):
+                if self.pos[a] is not None:
+                    self.pos[a] += v
+            else:
+                self.pos[a] = v
+
+        z = self.pos['Z']
+        if z is not None and (self.max_z is None or z > self.max_z):
+            self.max_z = z
+
+    def preamble(self):
+        ''' the lines to send to restore this state, selects the tool, moves up to the highest Z seen so far, over
+            to the last XY position, starts the spindle, then goes down to the last Z '''
+        lines = [self.units, self.plane, self.wcs, 'G90']
+        if self.tool is not None:
+            lines.append(self.tool)
+        x, y, z = self.pos['X'], self.pos['Y'], self.pos['Z']
+        if self.max_z is not None:
+            lines.append('G0 Z{}'.format(_fmt(self.max_z)))
+        xy = ' '.join('{}{}'.format(a, _fmt(v)) for a, v in (('X', x), ('Y', y)) if v is not None)
+        if xy:
+            lines.append('G0 {}'.format(xy))
+        g1 = []
+        if self.spindle != 'M5':
+            lines.append('{} S{}'.format(self.spindle, _fmt(self.s)) if self.s is not None else self.spindle)
+        elif self.s is not None:
+            # a laser just has its power set by S on the moves
+            g1.append('S{}'.format(_fmt(self.s)))
+        if self.feed is not None:
+            g1.insert(0, 'F{}'.format(_fmt(self.feed)))
+        if z is not None and z != self.max_z:
+            if g1:
+                lines.append('G1 Z{} {}'.format(_fmt(z), ' '.join(g1)))
+            else:
+                lines.append('G0 Z{}'.format(_fmt(z)))
+        elif g1:
+            lines.append('G1 {}'.format(' '.join(g1)))
+        if self.pos['E'] is not None and self.extrude == 'M82':
+            lines.append('G92 E{}'.format(_fmt(self.pos['E'])))
+        if self.extrude == 'M83':
+            lines.append('M83')
+        if self.distance == 'G91':
+            lines.append('G91')
+        return lines
+
+    def with_motion(self, line):
+        ''' the moves in the preamble leave G0 or G1 in effect, so the first move after the resume point has to get
+            the motion mode back. returns line with the motion mode in front of it if it moves without a motion word
+            of its own, or None if it does not move so the next line has to be checked '''
+        words = ModalState.words(line)
+        gs = [v for c, v in words if c == 'G']
+        if any(v in (0, 1, 2, 3) for v in gs):
+            return line
+        if any(v in (4, 10, 28, 30, 53, 92) for v in gs) or not any(c in 'XYZEIJKR' for c, v in words):
+            # not a move, or one that does not use the motion mode
+            return None
+        return '{} {}'.format(self.motion, line)
+
+    def _is_relative(self, axis):
+        if axis == 'E':
+            return self.extrude == 'M83'
+        return self.distance == 'G91'
+
+
+def _fmt(v):
+    return '{:.4f}'.format(v).rstrip('0').rstrip('.')
@@ -0,0 +1,164 @@
+import re
+import math
+
+
+class GcodeMinifier():
+    ''' Makes gcode lines shorter to send, in two stages.
+        minify() is called on each line as it is read, it removes inline comments and extra whitespace, rounds
+        coordinates to the machine resolution and drops redundant zeros. It keeps track of G20/G21 and G90/G91 in the
+        file so it has to be given every line in order, starting with any lines sent ahead of the file to restore its
+        modal state.
+        modal() is called on each minified line just before it is sent, and drops the motion word and feedrate when
+        they are already in effect. That can only be decided at send time, as anything else sent to the controller
+        (a jog, a tool change script...) can change them, forget() is called when that may have happened so the next
+        move goes out with its motion word and feedrate again.
+        A line that would have nothing left, eg just a feedrate already in effect, is redundant() and is not sent.
+        Lines that are not just gcode words (eg M117 messages, $ and console commands) are sent as they are.
+        Only lines the streamer does not count can be redundant, and a minified line starts with one of GMXY if
+        the original did, so the streamer counts the same lines either way '''
+
+    WORDS = re.compile(r'(?:[A-Z][-+]?(?:\d+\.?\d*|\.\d+))+')
+    WORD = re.compile(r'([A-Z])([-+]?(?:\d+\.?\d*|\.\d+))')
+    COMMENT = re.compile(r'\(.*?\)|;.*')
+    SPACE = re.compile(r'\s+')
+    TEXT_MCODES = ('M23', 'M28', 'M29', 'M30', 'M32', 'M117', 'M118')  # these take a filename or message
+    ROUNDED = 'XYZABCIJKR'
+    MOTION_WORDS = 'XYZABCEIJKRFS'  # words that can be on a line where the motion word may be dropped
+
+    def __init__(self, resolution=0.001):
+        self.resolution = resolution  # in mm, None or 0 to not round the coordinates
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # used by minify() in the thread reading the file
+        self._relative = False
+        self._inches = False
+        # used by modal() as the lines are sent
+        self._motion = None  # G0, G1, G2 or G3 in effect, None when it is not known
+        self._feed = {}  # F in effect for G0 and for G1 to G3, Smoothie keeps a separate seek rate for G0
+        self._inverse_time = False
+
+    def minify(self, line):
+        ''' returns the line shortened, line has already been stripped '''
+        out = self._minify(line)
+        self.bytes_in += len(line) + 1
+        return out
+
+    def modal(self, line):
+        ''' returns the minified line to send now, without the motion word and feedrate if they are in effect '''
+        out = self._modal(line.strip())
+        self.bytes_out += len(out) + 1
+        return out
+
+    def redundant(self, line):
+        ''' True if the minified line has nothing to send, it is a feedrate that is in effect '''
+        words = GcodeMinifier._words(line.strip())
+        if not words or any(c != 'F' for c, v in words) or self._motion is None or self._inverse_time:
+            return False
+        return all(self._feed.get(self._group()) == float(v) for c, v in words)
+
+    def forget(self):
+        ''' something else was sent to the controller so the motion and feedrate in effect are no longer known '''
+        self._motion = None
+        self._feed = {}
+
+    def saved(self):
+        ''' fraction of the bytes saved so far '''
+        return 1 - self.bytes_out / self.bytes_in if self.bytes_in else 0
+
+    @staticmethod
+    def _words(line):
+        ''' the (letter, value) words of the line, None if it is not just gcode words '''
+        if not line or line.split(None, 1)[0].startswith(GcodeMinifier.TEXT_MCODES):
+            return None
+
+        code = GcodeMinifier.SPACE.sub('', GcodeMinifier.COMMENT.sub('', line))
+        if not code or not GcodeMinifier.WORDS.fullmatch(code):
+            return None
+
+        return GcodeMinifier.WORD.findall(code)
+
+    def _group(self):
+        return 'G0' if self._motion == 'G0' else 'G1'
+
+    def _minify(self, line):
+        words = GcodeMinifier._words(line)
+        if words is None:
+            return line
+
+        for c, v in words:
+            if c == 'G':
+                g = float(v)
+                if g in (20, 21):
+                    self._inches = g == 20
+                elif g in (90, 91):
+                    self._relative = g == 91
+
+        out = []
+        for c, v in words:
+            if c in GcodeMinifier.ROUNDED and self.resolution and not self._relative:
+                # rounding relative moves would add up
+                out.append(c + self._round(v))
+            else:
+                out.append(c + _num(v))
+
+        return ' '.join(out)
+
+    def _modal(self, line):
+        words = GcodeMinifier._words(line)
+        if words is None:
+            return line
+
+        gs = [float(v) for c, v in words if c == 'G']
+        motion = None
+        for g in gs:
+            if g in (0, 1, 2, 3):
+                motion = 'G{:g}'.format(g)
+            elif 80 <= g <= 89:
+                # canned cycles are modal too, so stop dropping anything until the next motion word
+                self._motion = None
+            elif g in (20, 21):
+                self._feed = {}
+            elif g in (93, 94):
+                self._inverse_time = g == 93
+
+        only_motion = len(gs) == (motion is not None) and all(c in GcodeMinifier.MOTION_WORDS for c, v in words if c != 'G')
+        current = self._motion
+        if motion is not None:
+            self._motion = motion
+        if not only_motion and any(c == 'F' for c, v in words):
+            # we don't know what this F applies to
+            self._feed = {}
+
+        out = []
+        for i, (c, v) in enumerate(words):
+            if c == 'G' and only_motion and motion == current and i + 1 < len(words) and words[i + 1][0] in 'XY':
+                # the motion is already in effect, and the line still starts with X or Y without it
+                continue
+
+            if c == 'F' and only_motion and self._motion is not None and not self._inverse_time:
+                group = self._group()
+                f = float(v)
+                if self._feed.get(group) == f:
+                    continue
+                self._feed[group] = f
+
+            out.append(c + v)
+
+        return ' '.join(out)
+
+    def _round(self, v):
+        r = self.resolution / 25.4 if self._inches else self.resolution
+        d = max(0, math.ceil(-math.log10(r)))
+        return _num('{:.{}f}'.format(round(float(v) / r) * r, d))
+
+
+def _num(s):
+    ''' the shortest way of writing the number s '''
+    neg = s[0] == '-'
+    i, _, f = s.lstrip('+-').partition('.')
+    i = i.lstrip('0')
+    f = f.rstrip('0')
+    if not i and not f:
+        return '0'
+    n = i + '.' + f if f else i
+    return '-' + n if neg else n
@@ -0,0 +1,575 @@
+import os
+import re
+import math
+import bisect
+import logging
+import threading
+from array import array
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+XY = 0
+XZ = 1
+YZ = 2
+CNC_accuracy = 0.001
+BATCH = 10000  # moves queued before they are added to the table when numpy is used
+
+
+class Toolpath():
+    ''' The moves in a gcode file parsed once into a table of line segments, kept as columns in arrays.
+        Each segment has its start and end in XY, the Z it ends at, what kind of move it is and the line
+        of the file it came from. Arcs are broken up into segments that are CNC_accuracy from the arc.
+        Segments are in file order, and a new layer starts whenever Z changes, so a layer is the slice
+        layer_starts[n]:layer_starts[n + 1] of the table. Layer 0 is anything before the first Z is known.
+        If numpy is installed arcs, and the moves after them, are queued up and the arcs are broken into
+        segments a batch at a time.
+        Parsed toolpaths are cached by file name, and reused until the file's mtime or size changes '''
+
+    CUT = 0  # a cutting or extruding move
+    RAPID = 1  # G0
+    TRAVEL = 2  # a G1 that does not extrude in a 3d print
+    LASER_OFF = 3  # a G1 with S0, which a laser does not burn
+
+    WORDS = re.compile(r"(G|X|Y|Z|I|J|K|R|E|S|F)(-?\d*\.?\d*\.?)")
+
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, fn):
+        self.log = logging.getLogger()  # .getChild('Toolpath')
+        self.fn = fn
+        self.mtime = None
+        self.size = None
+        self.x0 = array('f')
+        self.y0 = array('f')
+        self.x1 = array('f')
+        self.y1 = array('f')
+        self.z = array('f')
+        self.kind = array('B')
+        self.line = array('L')
+        self.layer_starts = array('L', [0])  # index of the first segment of each layer
+        self.layer_z = array('f', [float('nan')])  # Z of each layer
+        self.has_e = False
+        self._moves = []  # moves waiting to be added to the table, see _queue
+        self._grid = (None, None)  # the last index made by grid()
+        self._layer_rows = []  # the queued move each layer waiting to be added starts at
+
+    def __len__(self):
+        return len(self.kind)
+
+    @classmethod
+    def load(cls, fn):
+        ''' returns the parsed toolpath for the file, only the last file loaded is kept '''
+        st = os.stat(fn)
+        with cls._cache_lock:
+            tp = cls._cache.get(fn)
+        if tp is not None and tp.mtime == st.st_mtime_ns and tp.size == st.st_size:
+            return tp
+
+        tp = cls(fn)
+        tp.parse(st)
+        with cls._cache_lock:
+            cls._cache = {fn: tp}
+        return tp
+
+    def is_current(self, fn):
+        ''' True if this is the toolpath of fn and the file has not changed since it was parsed '''
+        if fn != self.fn:
+            return False
+        try:
+            st = os.stat(fn)
+        except OSError:
+            return False
+        return self.mtime == st.st_mtime_ns and self.size == st.st_size
+
+    def layers(self):
+        ''' number of layers, not counting layer 0 '''
+        return len(self.layer_starts) - 1
+
+    def layer(self, n):
+        ''' (start, end) of the segments in layer n '''
+        end = self.layer_starts[n + 1] if n + 1 < len(self.layer_starts) else len(self.kind)
+        return self.layer_starts[n], end
+
+    def layer_of(self, i):
+        ''' the layer segment i is in '''
+        return bisect.bisect_right(self.layer_starts, i) - 1
+
+    def bounds(self, start=0, end=None):
+        ''' (min_x, min_y, max_x, max_y) of the segments from start to end, None if there are none '''
+        if end is None:
+            end = len(self.kind)
+        if start >= end:
+            return None
+        if np is not None:
+            x0, y0 = np.frombuffer(self.x0, np.float32)[start:end], np.frombuffer(self.y0, np.float32)[start:end]
+            x1, y1 = np.frombuffer(self.x1, np.float32)[start:end], np.frombuffer(self.y1, np.float32)[start:end]
+            return (float(min(x0.min(), x1.min())), float(min(y0.min(), y1.min())),
+                    float(max(x0.max(), x1.max())), float(max(y0.max(), y1.max())))
+        return (min(min(self.x0[start:end]), min(self.x1[start:end])), min(min(self.y0[start:end]), min(self.y1[start:end])),
+                max(max(self.x0[start:end]), max(self.x1[start:end])), max(max(self.y0[start:end]), max(self.y1[start:end])))
+
+    def grid(self, start=0, end=None, kinds=None):
+        ''' a SegmentGrid of the segments from start to end, only those of the given kinds if kinds is set.
+            The grid's segment numbers are indices into ids, which has the index into the table for each one.
+            Returns (grid, ids), or (None, None) if there is nothing to index or numpy is not installed '''
+        if end is None:
+            end = len(self.kind)
+        key = (start, end, kinds)
+        if self._grid[0] == key:
+            return self._grid[1]
+        if np is None or start >= end:
+            return None, None
+
+        ids = np.arange(start, end)
+        if kinds is not None:
+            ids = ids[np.isin(np.frombuffer(self.kind, np.uint8)[start:end], kinds)]
+        if len(ids) == 0:
+            return None, None
+        x0, y0 = np.frombuffer(self.x0, np.float32)[ids], np.frombuffer(self.y0, np.float32)[ids]
+        x1, y1 = np.frombuffer(self.x1, np.float32)[ids], np.frombuffer(self.y1, np.float32)[ids]
+
+        # cells big enough to hold a few segments each
+        w = float(max(x0.max(), x1.max()) - min(x0.min(), x1.min()))
+        h = float(max(y0.max(), y1.max()) - min(y0.min(), y1.min()))
+        if w > 0 and h > 0:
+            cell = math.sqrt(w * h * 4 / len(ids))
+        else:
+            cell = max(w, h) * 4 / len(ids)
+        grid = SegmentGrid(x0, y0, x1, y1, max(cell, CNC_accuracy))
+        self._grid = (key, (grid, ids))
+        return grid, ids
+
+    def _add(self, x0, y0, x1, y1, z, kind, line):
+        self.x0.append(x0)
+        self.y0.append(y0)
+        self.x1.append(x1)
+        self.y1.append(y1)
+        self.z.append(z)
+        self.kind.append(kind)
+        self.line.append(line)
+
+    def parse(self, st=None):
+        if st is None:
+            st = os.stat(self.fn)
+        self.mtime = st.st_mtime_ns
+        self.size = st.st_size
+
+        nan = float('nan')
+        x = y = z = nan  # we don't know where the tool starts
+        lastz = None
+        laste = 0
+        lasts = 1
+        plane = XY
+        rel_move = False
+        modal_g = 0
+        cnt = 0
+        if np is not None:
+            add, add_arc = self._queue, self._queue_arc
+        else:
+            add, add_arc = self._add, self._add_arc
+
+        with open(self.fn) as f:
+            for ln in f:
+                cnt += 1
+                ln = ln.strip()
+                if not ln or ln[0] in ';(':
+                    continue
+                p = ln.find(';')
+                if p >= 0:
+                    ln = ln[:p]
+
+                # this handles multiple G codes on one line
+                gcodes = []
+                d = {}
+                for c, v in Toolpath.WORDS.findall(ln):
+                    if c == 'G' and 'G' in d:
+                        # we have another G code on the same line
+                        gcodes.append(d)
+                        d = {}
+                    try:
+                        d[c] = float(v)
+                    except ValueError:
+                        pass
+                gcodes.append(d)
+
+                for d in gcodes:
+                    # handle modal commands
+                    if 'G' not in d:
+                        if 'X' in d or 'Y' in d or 'Z' in d or 'S' in d:
+                            d['G'] = modal_g
+                        else:
+                            continue
+
+                    gcode = int(d['G'])
+
+                    # G92 E0 resets E
+                    if gcode == 92 and 'E' in d:
+                        laste = d['E']
+                        self.has_e = True
+
+                    if gcode == 91 or gcode == 90:
+                        rel_move = gcode == 91
+                    elif gcode in (17, 18, 19):
+                        plane = gcode - 17
+
+                    # only deal with G0/1/2/3
+                    if gcode > 3:
+                        continue
+
+                    modal_g = gcode
+
+                    # see if it is 3d printing (ie has an E axis on a G1)
+                    if not self.has_e and 'E' in d and gcode == 1:
+                        self.has_e = True
+
+                    lastx, lasty, lastz_pos = x, y, z
+                    if rel_move:
+                        x += d.get('X', 0)
+                        y += d.get('Y', 0)
+                        z += d.get('Z', 0)
+                    else:
+                        x = d.get('X', x)
+                        y = d.get('Y', y)
+                        z = d.get('Z', z)
+
+                    e = d.get('E', laste)
+                    s = d.get('S', lasts)
+                    laste = e
+                    lasts = s
+
+                    if z == z and z != lastz:
+                        # a new layer starts when Z changes
+                        lastz = z
+                        if self._moves:
+                            # the segments are not in the table yet, so _flush works out where the layer starts
+                            self._layer_rows.append(len(self._moves))
+                        else:
+                            self.layer_starts.append(len(self.kind))
+                        self.layer_z.append(z)
+
+                    if lastx != lastx or lasty != lasty:
+                        # we don't know where this move started from
+                        continue
+
+                    if gcode == 0:
+                        if x != lastx or y != lasty:
+                            add(lastx, lasty, x, y, z, Toolpath.RAPID, cnt)
+
+                    elif gcode == 1:
+                        if 'X' in d or 'Y' in d:
+                            if self.has_e and 'E' not in d:
+                                # a G1 with no E, treat as a move
+                                kind = Toolpath.TRAVEL
+                            elif s <= 0.01:
+                                kind = Toolpath.LASER_OFF
+                            else:
+                                kind = Toolpath.CUT
+                            add(lastx, lasty, x, y, z, kind, cnt)
+
+                    else:
+                        add_arc(gcode, plane, (lastx, lasty, lastz_pos), (x, y, z), d, cnt)
+
+        if self._moves:
+            self._flush()
+        self.log.debug('Toolpath: parsed {} segments in {} layers from {}'.format(len(self.kind), self.layers(), self.fn))
+
+    def _add_arc(self, gcode, plane, start, end, d, cnt):
+        # code cribbed from bCNC
+        x, y, z = end
+        if plane == XY:
+            u0, v0, w0 = start[0], start[1], start[2]
+            u1, v1, w1 = x, y, z
+            i, j = d.get('I', 0.0), d.get('J', 0.0)
+        elif plane == XZ:
+            u0, v0, w0 = start[0], start[2], start[1]
+            u1, v1, w1 = x, z, y
+            i, j = d.get('I', 0.0), d.get('K', 0.0)
+            gcode = 5 - gcode  # flip 2-3 when XZ plane is used
+        else:
+            u0, v0, w0 = start[1], start[2], start[0]
+            u1, v1, w1 = y, z, x
+            i, j = d.get('J', 0.0), d.get('K', 0.0)
+
+        uc, vc, r = arc_center(gcode == 2, u0, v0, u1, v1, i, j, d.get('R', 0.0))
+        phi0 = math.atan2(v0 - vc, u0 - uc)
+        phi1 = math.atan2(v1 - vc, u1 - uc)
+        try:
+            sagitta = 1.0 - CNC_accuracy / r
+        except ZeroDivisionError:
+            sagitta = 0.0
+        if sagitta > 0.0:
+            df = 2.0 * math.acos(sagitta)
+            df = min(df, math.pi / 4.0)
+        else:
+            df = math.pi / 4.0
+
+        if w0 != w0:
+            w0 = w1
+        uvw = []
+        if gcode == 2:
+            if phi1 >= phi0 - 1e-10:
+                phi1 -= 2.0 * math.pi
+            ws = (w1 - w0) / (phi1 - phi0)
+            phi = phi0 - df
+            while phi > phi1:
+                uvw.append((uc + r * math.cos(phi), vc + r * math.sin(phi), w0 + (phi - phi0) * ws))
+                phi -= df
+        else:
+            if phi1 <= phi0 + 1e-10:
+                phi1 += 2.0 * math.pi
+            ws = (w1 - w0) / (phi1 - phi0)
+            phi = phi0 + df
+            while phi < phi1:
+                uvw.append((uc + r * math.cos(phi), vc + r * math.sin(phi), w0 + (phi - phi0) * ws))
+                phi += df
+
+        lx, ly = start[0], start[1]
+        for u, v, w in uvw:
+            if plane == XY:
+                px, py, pz = u, v, w
+            elif plane == XZ:
+                px, py, pz = u, w, v
+            else:
+                px, py, pz = w, u, v
+            self._add(lx, ly, px, py, pz, Toolpath.CUT, cnt)
+            lx, ly = px, py
+        self._add(lx, ly, x, y, z, Toolpath.CUT, cnt)
+
+    def _queue(self, x0, y0, x1, y1, z, kind, line):
+        # a row is the move in its plane, from u0, v0, w0 to u1, v1, w1 where w is the axis across the plane,
+        # then i, j, r, cw, plane, line, kind and whether it is an arc. A straight move is in XY
+        if not self._moves:
+            # no arcs are waiting so it can go straight into the table
+            self._add(x0, y0, x1, y1, z, kind, line)
+            return
+        self._moves.append((x0, y0, z, x1, y1, z, 0.0, 0.0, 0.0, 0, XY, line, kind, 0))
+        if len(self._moves) >= BATCH:
+            self._flush()
+
+    def _queue_arc(self, gcode, plane, start, end, d, cnt):
+        if plane == XY:
+            uvw0, uvw1 = (start[0], start[1], start[2]), end
+            i, j = d.get('I', 0.0), d.get('J', 0.0)
+        elif plane == XZ:
+            uvw0, uvw1 = (start[0], start[2], start[1]), (end[0], end[2], end[1])
+            i, j = d.get('I', 0.0), d.get('K', 0.0)
+            gcode = 5 - gcode
+        else:
+            uvw0, uvw1 = (start[1], start[2], start[0]), (end[1], end[2], end[0])
+            i, j = d.get('J', 0.0), d.get('K', 0.0)
+        self._moves.append(uvw0 + uvw1 + (i, j, d.get('R', 0.0), gcode == 2, plane, cnt, Toolpath.CUT, 1))
+        if len(self._moves) >= BATCH:
+            self._flush()
+
+    def _flush(self):
+        ''' adds the queued moves to the table, breaking all the arcs into segments at once '''
+        a = np.array(self._moves, np.float64)
+        self._moves = []
+        u0, v0, w0, u1, v1, w1, i, j, r, cw, plane, line, kind, is_arc = a.T
+        cw = cw != 0
+        w0 = np.where(np.isnan(w0), w1, w0)
+
+        # the center, from the I J K offsets or from R, a negative R is the long way round
+        uc, vc = u0 + i, v0 + j
+        rad = np.hypot(i, j)
+        has_r = r != 0.0
+        if has_r.any():
+            abu, abv = u1 - u0, v1 - v0
+            ab = np.hypot(abu, abv)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                oc = np.sqrt(np.maximum(r**2 - ab**2 / 4.0, 0.0))
+                oc = np.where(cw != (r < 0), -oc, oc)
+                ok = has_r & (ab != 0.0)
+                uc = np.where(ok, (u0 + u1) / 2 - oc * abv / ab, np.where(has_r, u0, uc))
+                vc = np.where(ok, (v0 + v1) / 2 + oc * abu / ab, np.where(has_r, v0, vc))
+            rad = np.where(has_r, np.abs(r), rad)
+
+        phi0 = np.arctan2(v0 - vc, u0 - uc)
+        phi1 = np.arctan2(v1 - vc, u1 - uc)
+        phi1 = np.where(cw & (phi1 >= phi0 - 1e-10), phi1 - 2.0 * math.pi, phi1)
+        phi1 = np.where(~cw & (phi1 <= phi0 + 1e-10), phi1 + 2.0 * math.pi, phi1)
+
+        # the angle of each step, so the segments are within CNC_accuracy of the arc
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sagitta = 1.0 - CNC_accuracy / rad
+            df = np.where(sagitta > 0.0, np.minimum(2.0 * np.arccos(np.clip(sagitta, -1.0, 1.0)), math.pi / 4.0), math.pi / 4.0)
+        sweep = np.abs(phi1 - phi0)
+        n = np.where(is_arc != 0, np.maximum(np.ceil(sweep / df - 1e-9), 1), 1).astype(np.intp)
+
+        # one row for each segment, k is the step along its arc, the last step ends exactly at the end of the arc
+        arc = np.repeat(np.arange(len(n)), n)
+        first = np.cumsum(n) - n
+        if self._layer_rows:
+            starts = len(self.kind) + np.append(first, n.sum())[self._layer_rows]
+            self.layer_starts.extend(starts.astype(self.layer_starts.typecode))
+            self._layer_rows = []
+        k = np.arange(n.sum()) - first[arc] + 1
+        last = k == n[arc]
+        phi = phi0[arc] + np.where(cw[arc], -df[arc], df[arc]) * k
+        u = np.where(last, u1[arc], uc[arc] + rad[arc] * np.cos(phi))
+        v = np.where(last, v1[arc], vc[arc] + rad[arc] * np.sin(phi))
+        w = np.where(last, w1[arc], w0[arc] + (w1[arc] - w0[arc]) * (phi - phi0[arc]) / (phi1[arc] - phi0[arc]))
+
+        # back to x, y, z
+        p = plane[arc]
+        x = np.where(p == YZ, w, u)
+        y = np.where(p == XY, v, np.where(p == XZ, w, u))
+        z = np.where(p == XY, w, v)
+        sx = np.where(plane == YZ, w0, u0)
+        sy = np.where(plane == XY, v0, np.where(plane == XZ, w0, u0))
+        x0 = np.empty_like(x)
+        y0 = np.empty_like(y)
+        x0[1:] = x[:-1]
+        y0[1:] = y[:-1]
+        x0[first] = sx
+        y0[first] = sy
+
+        self.x0.frombytes(x0.astype(np.float32).tobytes())
+        self.y0.frombytes(y0.astype(np.float32).tobytes())
+        self.x1.frombytes(x.astype(np.float32).tobytes())
+        self.y1.frombytes(y.astype(np.float32).tobytes())
+        self.z.frombytes(z.astype(np.float32).tobytes())
+        self.kind.frombytes(kind[arc].astype(self.kind.typecode).tobytes())
+        self.line.frombytes(line[arc].astype(self.line.typecode).tobytes())
+
+
+class SegmentGrid():
+    ''' A uniform grid over line segments, to find the ones in a rectangle or near a point without looking at them
+        all. Each segment is filed under the cell its middle is in, so a segment is never more than half a cell outside
+        its cell. Segments longer than a cell go in a cell of their own that is always looked at, if there are a lot
+        of them they are also put in a coarser grid that nearest() looks in instead.
+        The cells that have segments are numbered 0 to len(grid) - 1, and boxes has the bounds of each one's segments
+        as min x, min y, max x, max y. Needs numpy '''
+
+    def __init__(self, x0, y0, x1, y1, cell):
+        self.x0, self.y0, self.x1, self.y1 = (np.asarray(a, np.float64) for a in (x0, y0, x1, y1))
+        self.cell = cell
+        self.ox = float(min(self.x0.min(), self.x1.min()))
+        self.oy = float(min(self.y0.min(), self.y1.min()))
+
+        cx = ((self.x0 + self.x1) / 2 - self.ox) // cell
+        cy = ((self.y0 + self.y1) / 2 - self.oy) // cell
+        self.nx = int(cx.max()) + 1
+        key = (cy * self.nx + cx).astype(np.int64)
+        long = np.hypot(self.x1 - self.x0, self.y1 - self.y0) > cell
+        key[long] = -1
+        self.coarse = None
+        if np.count_nonzero(long) > 256:
+            ids = np.nonzero(long)[0]
+            self.coarse = (SegmentGrid(self.x0[ids], self.y0[ids], self.x1[ids], self.y1[ids], cell * 8), ids)
+
+        self.order = np.argsort(key, kind='stable')
+        self.keys, first = np.unique(key[self.order], return_index=True)
+        self.first = np.append(first, len(key))
+
+        xmin, xmax = np.minimum(self.x0, self.x1)[self.order], np.maximum(self.x0, self.x1)[self.order]
+        ymin, ymax = np.minimum(self.y0, self.y1)[self.order], np.maximum(self.y0, self.y1)[self.order]
+        self.boxes = np.stack((np.minimum.reduceat(xmin, first), np.minimum.reduceat(ymin, first),
+                               np.maximum.reduceat(xmax, first), np.maximum.reduceat(ymax, first)), axis=1)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def segments(self, c):
+        ''' the segments in cell c '''
+        return self.order[self.first[c]:self.first[c + 1]]
+
+    def in_rect(self, x0, y0, x1, y1):
+        ''' the cells that have segments in the rectangle '''
+        b = self.boxes
+        return np.nonzero((b[:, 0] <= x1) & (b[:, 2] >= x0) & (b[:, 1] <= y1) & (b[:, 3] >= y0))[0]
+
+    def nearest(self, x, y, radius):
+        ''' (i, d) the segment closest to x, y and how far it is from it, None if there is none within radius '''
+        # look close by first, the nearest segment within a smaller radius is the nearest one
+        r = min(radius, self.cell)
+        while True:
+            hit = self._nearest(x, y, r)
+            if hit is not None or r >= radius:
+                return hit
+            r = min(r * 4, radius)
+
+    def _nearest(self, x, y, radius):
+        # the cells near enough to have a segment within radius, and the long segments
+        n = int(math.ceil(radius / self.cell + 0.5))
+        cx = int((x - self.ox) // self.cell)
+        cy = int((y - self.oy) // self.cell)
+        if (2 * n + 1) ** 2 >= len(self.keys):
+            # it is quicker to look at the bounds of every cell
+            b = self.boxes
+            cells = np.nonzero((b[:, 0] - radius <= x) & (b[:, 2] + radius >= x) & (b[:, 1] - radius <= y) & (b[:, 3] + radius >= y))[0]
+        else:
+            xs = np.arange(max(cx - n, 0), min(cx + n, self.nx - 1) + 1)
+            ys = np.arange(max(cy - n, 0), cy + n + 1)
+            want = (ys[:, None] * self.nx + xs[None, :]).ravel()
+            if self.keys[0] == -1 and self.coarse is None:
+                want = np.append(want, -1)
+            cells = np.minimum(np.searchsorted(self.keys, want), len(self.keys) - 1)
+            cells = cells[self.keys[cells] == want]
+
+        best = None
+        if self.coarse is not None:
+            cells = cells[self.keys[cells] != -1]
+            hit = self.coarse[0].nearest(x, y, radius)
+            if hit is not None:
+                best = int(self.coarse[1][hit[0]]), hit[1]
+        if len(cells) == 0:
+            return best
+
+        # how close each cell's segments could be, the closest few cells give a distance that rules out most of the others
+        if len(cells) <= 8:
+            hit = self._closest(cells, x, y)
+        else:
+            b = self.boxes[cells]
+            near = np.hypot(np.maximum(np.maximum(b[:, 0] - x, x - b[:, 2]), 0), np.maximum(np.maximum(b[:, 1] - y, y - b[:, 3]), 0))
+            hit = self._closest(cells[np.argsort(near)[:8]], x, y)
+            cells = cells[near <= min(hit[1], radius)]
+            if len(cells):
+                hit = min(hit, self._closest(cells, x, y), key=lambda h: h[1])
+
+        if hit[1] > radius or (best is not None and best[1] <= hit[1]):
+            return best
+        return hit
+
+    def _closest(self, cells, x, y):
+        # (i, d) the segment in the cells closest to x, y
+        starts = self.first[cells]
+        counts = self.first[cells + 1] - starts
+        idx = self.order[np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)]
+        x0, y0, x1, y1 = self.x0[idx], self.y0[idx], self.x1[idx], self.y1[idx]
+        dx, dy = x1 - x0, y1 - y0
+        ll = dx * dx + dy * dy
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.clip(np.where(ll > 0, ((x - x0) * dx + (y - y0) * dy) / ll, 0.0), 0.0, 1.0)
+        d = np.hypot(x0 + t * dx - x, y0 + t * dy - y)
+        k = int(np.argmin(d))
+        return int(idx[k]), float(d[k])
+
+
+def arc_center(cw, x, y, xv, yv, i, j, r=0.0):
+    ''' returns the center and radius (uc, vc, r) of an arc in its plane, from x, y to xv, yv, given either
+        the offsets i, j to the center or the radius r, which is negative for an arc of more than 180 degrees '''
+    if r != 0.0:
+        ABx = xv - x
+        ABy = yv - y
+        Cx = 0.5 * (x + xv)
+        Cy = 0.5 * (y + yv)
+        AB = math.sqrt(ABx**2 + ABy**2)
+        try:
+            OC = math.sqrt(r**2 - AB**2 / 4.0)
+        except ValueError:
+            OC = 0.0
+
+        # a negative R goes the long way round
+        if cw != (r < 0):
+            OC = -OC
+        r = abs(r)
+        if AB != 0.0:
+            return Cx - OC * ABy / AB, Cy + OC * ABx / AB, r
+        # Error!!!
+        return x, y, r
+
+    return x + i, y + j, math.sqrt(i**2 + j**2)
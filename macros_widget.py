@@ -172,7 +172,7 @@ class MacrosWidget(StackLayout):
         try:
             with open(fn) as f:
                 for line in f:
-                    self.app.comms.write('{}'.format(line))
+                    self.app.comms.write('{}'.format(line), self.app.comms.BULK)
 
         except Exception:
             self.app.main_window.async_display("ERROR: File not found: {}".format(fn))
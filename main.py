@@ -43,9 +43,11 @@ from config_editor import ConfigEditor
 from gcode_help import GcodeHelp
 from text_editor import TextEditor
 from tool_scripts import ToolScripts
+from gcode_arcs import ArcFitter, arcs_file_name
 
 import subprocess
 import traceback
+import threading
 import queue
 import math
 import os
@@ -292,7 +294,121 @@ class KbdWidget(GridLayout):
         self.display.text = ''
 
 
+class Machine():
+    ''' One of the controllers the app drives, each one has its own Comms on the shared comms loop.
+        Comms uses this as its app, so only the machine being shown updates the main window. The others keep
+        their log, state and any dialogs they wanted to show until they are switched to '''
+
+    def __init__(self, app, name, port=None):
+        self.app = app
+        self.name = name
+        self.port = port  # None to use the configured port
+        self.comms = None
+        self.state = dict(MainWindow.MACHINE_STATE)  # the main window state while this machine is not shown
+        self.log = collections.deque(maxlen=200)  # log window lines while not shown
+        self.is_connected = False
+        self.last_status = None
+        self.last_state = None
+        self.progress = None
+        self.prompts = collections.deque()  # (method name, args) of dialogs to show when switched to
+
+    def get_port(self):
+        if self.port is not None:
+            return self.port
+        return self.app.use_com_port or self.app.config.get('General', 'serial_port')
+
+    def is_shown(self):
+        return self.app.machine is self
+
+    @property
+    def main_window(self):
+        # the callbacks from comms go to the main window only while this machine is shown
+        return self.app.main_window if self.is_shown() else self
+
+    # what comms reads from the app
+    @property
+    def manual_tool_change(self):
+        return self.app.manual_tool_change
+
+    @property
+    def wait_on_m0(self):
+        return self.app.wait_on_m0
+
+    @property
+    def fast_stream(self):
+        return self.app.fast_stream
+
+    @property
+    def last_probe(self):
+        return self.app.last_probe
+
+    @last_probe.setter
+    def last_probe(self, v):
+        if self.is_shown():
+            self.app.last_probe = v
+
+    def display_progress(self, p):
+        # the stream progress callback, the latest report is kept to show when switched to
+        if self.is_shown():
+            self.app.main_window.display_progress(p)
+        else:
+            self.progress = p
+
+    # the main window callbacks while this machine is not shown, called from the comms thread
+    def async_display(self, data):
+        self.log.append(data.rstrip('\r'))
+
+    def connected(self):
+        self.is_connected = True
+        self.async_display('...Connected')
+
+    def disconnected(self):
+        self.is_connected = False
+        self.state['is_printing'] = False
+        self.async_display('...Disconnected')
+
+    def update_status(self, sr):
+        self.last_status = sr
+
+    def update_state(self, a):
+        self.last_state = a
+
+    def alarm_state(self, s):
+        self.async_display('! Alarm state: {}'.format(s))
+
+    def action_paused(self, paused, suspended=False):
+        self.state['paused'] = paused
+        self.state['is_suspended'] = suspended
+        self.async_display('>>> Streaming {}'.format('Paused' if paused else 'Resumed'))
+
+    def stream_finished(self, ok):
+        self.state['is_printing'] = False
+        self.state['eta'] = '--:--:--'
+        self.async_display('>>> Run finished {} at {}'.format('ok' if ok else 'abnormally', datetime.datetime.now().strftime('%x %X')))
+
+    def stream_interrupted(self, file_path, line):
+        self.prompts.append(('stream_interrupted', (file_path, line)))
+
+    def tool_change_prompt(self, l):
+        self.prompts.append(('tool_change_prompt', (l,)))
+
+    def m0_dlg(self):
+        self.prompts.append(('m0_dlg', ()))
+
+    def switch_response(self, n, v):
+        pass
+
+    def get_queries(self, query_state=True):
+        return ''
+
+
 class MainWindow(BoxLayout):
+    # the state kept for each machine, and what a new machine starts with
+    MACHINE_STATE = {
+        'status': 'Idle', 'wpos': [0, 0, 0], 'eta': '--:--:--', 'is_printing': False, 'is_suspended': False, 'paused': False,
+        'last_line': 0, 'first_line': None, 'nlines': None, 'start_print_time': None
+    }
+
     status = StringProperty('Idle')
     wpos = ListProperty([0, 0, 0])
     eta = StringProperty('--:--:--')
@@ -307,7 +423,13 @@ class MainWindow(BoxLayout):
         self.config = self.app.config
         self.last_path = self.config.get('General', 'last_gcode_path')
         self.paused = False
+        self.starting = False  # set while the file to run is being indexed
         self.last_line = 0
+        self.first_line = None
+        self.nlines = None
+        self.start_print_time = None
+        self._progress = None  # latest progress report from comms that has not been displayed yet
+        self._progress_lock = threading.Lock()
 
         # print('font size: {}'.format(self.ids.log_window.font_size))
         # Clock.schedule_once(self.my_callback, 2) # hack to overcome the page layout not laying out initially
@@ -343,11 +465,86 @@ class MainWindow(BoxLayout):
             else:
                 self._disconnect()
 
+        elif self.app.comms.reconnecting:
+            self.add_line_to_log("Stopped trying to reconnect")
+            self.app.comms.disconnect()
+
         else:
-            port = self.config.get('General', 'serial_port') if not self.app.use_com_port else self.app.use_com_port
+            port = self.app.machine.get_port()
             self.add_line_to_log("Connecting to {}...".format(port))
             self.app.comms.connect(port)
 
+    def select_machine(self):
+        # the machine being shown is first in the list
+        machines = [self.app.machine] + [m for m in self.app.machines if m is not self.app.machine]
+        values = ['{} - {}'.format(m.name, m.get_port()) for m in machines]
+        sb = SelectionBox(title='Select machine', text='Select the machine to show, or add another one', values=values + ['new...'],
+                          cb=partial(self._select_machine, dict(zip(values, machines))))
+        sb.open()
+
+    def _select_machine(self, machines, s):
+        if not s:
+            return
+
+        if s == 'new...':
+            ports = ['serial://{}'.format(p.device) for p in self.app.comms.get_ports()] + ['network...']
+            sb = SelectionBox(title='Select port', text='Select the port of the new machine', values=ports, cb=self._new_machine_port)
+            sb.open()
+
+        elif machines[s] is not self.app.machine:
+            self.switch_machine(machines[s])
+
+    def _new_machine_port(self, s):
+        if not s:
+            return
+
+        if s.startswith('network'):
+            mb = InputBox(title='Network address', text='Enter network address as "ipaddress[:port]"',
+                          cb=lambda a: self.switch_machine(self.app.add_machine('net://{}'.format(a))) if a else None)
+            mb.open()
+        else:
+            self.switch_machine(self.app.add_machine(s))
+
+    def switch_machine(self, machine):
+        ''' show machine in the main window, the one that was shown carries on in the background '''
+        old = self.app.machine
+        old.state = {k: getattr(self, k) for k in MainWindow.MACHINE_STATE}
+        old.log.clear()
+        old.log.extend(d['text'] for d in self.ids.log_window.data)
+        old.is_connected = self.app.is_connected
+        old.progress = None
+        with self._progress_lock:
+            self._progress = None
+
+        # from here on callbacks from the old machine are kept by it, and the new machine's come here
+        self.app.set_machine(machine)
+
+        for k, v in machine.state.items():
+            setattr(self, k, v)
+        self.ids.log_window.data = [{'text': l} for l in machine.log]
+        machine.log.clear()
+        self.add_line_to_log('>>> Showing {} - {}'.format(machine.name, machine.get_port()))
+
+        self.app.is_connected = machine.is_connected
+        self.ids.connect_button.state = 'down' if machine.is_connected else 'normal'
+        self.ids.connect_button.text = 'Disconnect' if machine.is_connected else 'Connect'
+        if not self.is_printing:
+            self.ids.print_but.text = 'Run'
+        else:
+            self.ids.print_but.text = 'Resume' if self.paused else 'Pause'
+
+        # catch up with what happened while it was not shown
+        if machine.last_status is not None:
+            self.update_status(machine.last_status)
+        if machine.last_state is not None:
+            self.update_state(machine.last_state)
+        if machine.progress is not None:
+            self.display_progress(machine.progress)
+            machine.progress = None
+        while machine.prompts:
+            name, args = machine.prompts.popleft()
+            getattr(self, name)(*args)
+
     def _disconnect(self, b=True):
         if b:
             self.add_line_to_log("Disconnect...")
@@ -394,44 +591,39 @@ class MainWindow(BoxLayout):
         self.add_line_to_log("...Disconnected")
 
     @mainthread
-    def update_status(self, stat, d):
-        self.status = stat
-        self.app.status = stat
-        if 'WPos' in d:
-            self.wpos = d['WPos']
+    def update_status(self, sr):
+        ''' sr is the StatusReport parsed by comms '''
+        self.status = sr.state
+        self.app.status = sr.state
+        if sr.wpos is not None:
+            self.wpos = sr.wpos
             self.app.wpos = self.wpos
 
-        if 'MPos' in d:
-            self.app.mpos = d['MPos']
+        if sr.mpos is not None:
+            self.app.mpos = sr.mpos
 
-        if 'F' in d:
-            self.app.fr = d['F'][0]
-            if len(d['F']) == 2:
-                self.app.fro = d['F'][1]
-                self.app.frr = d['F'][0]
-            elif len(d['F']) == 3:
-                self.app.frr = d['F'][1]
-                self.app.fro = d['F'][2]
+        if sr.feed is not None:
+            self.app.fr = sr.feed
+            if sr.feed_req is not None:
+                self.app.frr = sr.feed_req
+            if sr.feed_ovr is not None:
+                self.app.fro = sr.feed_ovr
 
-        if 'S' in d:
-            self.app.sr = d['S'][0]
+        if sr.spindle is not None:
+            self.app.sr = sr.spindle
 
-        if 'L' in d:
-            self.app.lp = d['L'][0]
+        if sr.laser is not None:
+            self.app.lp = sr.laser
 
-        if not self.app.is_cnc:
+        if not self.app.is_cnc and sr.temperatures:
             # extract temperature readings and update the extruder property
             # We only want to update once per query
             t = {}
-            if 'T' in d:
-                t['hotend0'] = (d['T'][0], d['T'][1])
-            if 'T1' in d:
-                t['hotend1'] = (d['T1'][0], d['T1'][1])
-            if 'B' in d:
-                t['bed'] = (d['B'][0], d['B'][1])
+            names = {'T': 'hotend0', 'T1': 'hotend1', 'B': 'bed'}
+            for k, v in sr.temperatures.items():
+                t[names[k]] = v
 
-            if t:
-                self.ids.extruder.update_temp(t)
+            self.ids.extruder.update_temp(t)
 
     @mainthread
     def update_state(self, a):
@@ -476,7 +668,7 @@ class MainWindow(BoxLayout):
 
     def change_port(self):
         ll = self.app.comms.get_ports()
-        ports = [self.config.get('General', 'serial_port')]  # current port is first in list
+        ports = [self.app.machine.get_port()]  # current port is first in list
         for p in ll:
             ports.append('serial://{}'.format(p.device))
 
@@ -494,13 +686,11 @@ class MainWindow(BoxLayout):
                 mb.open()
 
             else:
-                self.config.set('General', 'serial_port', s)
-                self.config.write()
+                self.app.set_port(s)
 
     def _new_network_port(self, s):
         if s:
-            self.config.set('General', 'serial_port', 'net://{}'.format(s))
-            self.config.write()
+            self.app.set_port('net://{}'.format(s))
 
     def abort_print(self):
         # are you sure?
@@ -544,27 +734,48 @@ class MainWindow(BoxLayout):
             f = Factory.filechooser()
             f.open(self.last_path, cb=self._start_print)
 
-    def _start_print(self, file_path=None, directory=None):
+    def _start_print(self, file_path=None, directory=None, start_line=None, start_layer=None):
         # start comms thread to stream the file
         # set comms.ping_pong to False for fast stream mode
+        # start_line or start_layer starts part way through the file
         if file_path is None:
             file_path = self.app.gcode_file
         if directory is None:
             directory = self.last_path
+        if self.starting:
+            return
 
         Logger.info('MainWindow: printing file: {}'.format(file_path))
 
+        # indexing a big file the first time it is run takes a while, so it is done in a thread
+        self.starting = True
+        t = threading.Thread(target=self._index_file_thread, daemon=True, args=(self.app.machine, file_path, directory, start_line, start_layer))
+        t.start()
+
+    def _index_file_thread(self, machine, file_path, directory, start_line, start_layer):
         try:
-            self.nlines = Comms.file_len(file_path)  # get number of lines so we can do progress and ETA
-            Logger.debug('MainWindow: number of lines: {}'.format(self.nlines))
+            nlines = Comms.file_len(file_path)  # get number of lines so we can do progress and ETA
+            Logger.debug('MainWindow: number of lines: {}'.format(nlines))
         except Exception:
             Logger.warning('MainWindow: exception in file_len: {}'.format(traceback.format_exc()))
-            self.nlines = None
+            nlines = None
 
+        self._file_indexed(machine, file_path, directory, start_line, start_layer, nlines)
+
+    @mainthread
+    def _file_indexed(self, machine, file_path, directory, start_line, start_layer, nlines):
+        self.starting = False
+        if machine is not self.app.machine:
+            self.display('WARNING Not started as the machine was changed while the file was being indexed')
+            return
+        self.nlines = nlines
         self.start_print_time = datetime.datetime.now()
+        self.first_line = None
         self.display('>>> Running file: {}, {} lines'.format(file_path, self.nlines))
 
-        if self.app.comms.stream_gcode(file_path, progress=lambda x: self.display_progress(x)):
+        with self._progress_lock:
+            self._progress = None
+        if self.app.comms.stream_gcode(file_path, progress=self.app.machine.display_progress, start_line=start_line, start_layer=start_layer):
             self.display('>>> Run started at: {}'.format(self.start_print_time.strftime('%x %X')))
         else:
             self.display('WARNING Unable to start print')
@@ -594,6 +805,36 @@ class MainWindow(BoxLayout):
         if ok:
             self._start_print()
 
+    def resume_print(self):
+        mb = InputBox(title='Resume {}'.format(os.path.basename(self.app.gcode_file)),
+                      text='Start at line number, or at a layer as Z<height>', value=str(self.last_line), cb=self._resume_print)
+        mb.open()
+
+    def _resume_print(self, s):
+        if not s:
+            return
+        s = s.strip().upper()
+        try:
+            if s.startswith('Z'):
+                self._start_print(start_layer=float(s[1:]))
+            else:
+                self._start_print(start_line=max(int(s), 1))
+        except ValueError:
+            self.display('ERROR: {} is not a line number or Z<height>'.format(s))
+
+    @mainthread
+    def stream_interrupted(self, file_path, line):
+        ''' called by comms when it has reconnected after losing the connection in the middle of a run,
+            line is the number of lines that were ok'd '''
+        self.display('>>> Connection was lost during the run of {} after line {}'.format(file_path, line))
+        mb = MessageBox(text='Continue {} from line {}?'.format(os.path.basename(file_path), line + 1),
+                        cb=partial(self._stream_interrupted, file_path, line))
+        mb.open()
+
+    def _stream_interrupted(self, file_path, line, ok):
+        if ok:
+            self._start_print(file_path, os.path.dirname(file_path), start_line=line + 1)
+
     @mainthread
     def start_last_file(self):
         if self.app.gcode_file:
@@ -602,6 +843,35 @@ class MainWindow(BoxLayout):
     def review(self):
         self._show_viewer(self.app.gcode_file, self.last_path)
 
+    def fit_arcs(self):
+        # write a copy of the last file with runs of short moves turned into arcs, it becomes the last file
+        # so it can be viewed and run like any other
+        fn = self.app.gcode_file
+        out = arcs_file_name(fn)
+        tolerance = self.config.getfloat('General', 'arc_tolerance')
+        self.display('>>> Fitting arcs to {} within {}mm'.format(fn, tolerance))
+        t = threading.Thread(target=self._fit_arcs_thread, daemon=True, args=(fn, out, tolerance))
+        t.start()
+
+    def _fit_arcs_thread(self, fn, out, tolerance):
+        fitter = ArcFitter(tolerance)
+        try:
+            fitter.fit_file(fn, out)
+        except Exception as e:
+            Logger.warning('MainWindow: exception fitting arcs: {}'.format(traceback.format_exc()))
+            self._fit_arcs_done(fitter, None, e)
+        else:
+            self._fit_arcs_done(fitter, out, None)
+
+    @mainthread
+    def _fit_arcs_done(self, fitter, out, err):
+        if err is not None:
+            self.display('ERROR: Fitting arcs failed: {}'.format(err))
+            return
+
+        self.display('>>> {} lines became {} lines with {} arcs, written to {}'.format(fitter.lines_in, fitter.lines_out, fitter.arcs, out))
+        self.set_last_file(os.path.dirname(out), out)
+
     @mainthread
     def stream_finished(self, ok):
         ''' called when streaming gcode has finished, ok is True if it completed '''
@@ -614,14 +884,29 @@ class MainWindow(BoxLayout):
         self.display(">>> Elapsed time: {}".format(et))
         self.eta = '--:--:--'
 
-    @mainthread
-    def display_progress(self, n):
+    def display_progress(self, p):
+        # called from the comms thread, if the UI has fallen behind only the latest report gets displayed
+        with self._progress_lock:
+            pending = self._progress is not None
+            self._progress = p
+        if not pending:
+            Clock.schedule_once(self._display_progress)
+
+    def _display_progress(self, *args):
+        with self._progress_lock:
+            p, self._progress = self._progress, None
+        if p is None:
+            return
+        n = p.line
         if self.nlines and n <= self.nlines:
             now = datetime.datetime.now()
             d = (now - self.start_print_time).seconds
-            if n > 10 and d > 10:
+            if self.first_line is None:
+                # when started part way through the file the rate is from the first line we were told about
+                self.first_line = n
+            if n - self.first_line > 10 and d > 10:
                 # we have to wait a bit to get reasonable estimates
-                lps = n / d
+                lps = (n - self.first_line) / d
                 eta = (self.nlines - n) / lps
             else:
                 eta = 0
@@ -708,6 +993,9 @@ class MainWindow(BoxLayout):
         # Print is paused by gcode command M6, prompt for tool change
         self.display("ACTION NEEDED: Manual Tool Change:\n Tool: {}\nWait for machine to stop, then you can jog around to change the tool.\n tap resume to continue".format(l))
 
+    def switch_response(self, n, v):
+        self.ids.macros.switch_response(n, v)
+
     @mainthread
     def m0_dlg(self):
         MessageBox(text='M0 Pause, click OK to continue', cb=self._m0_dlg).open()
@@ -716,7 +1004,8 @@ class MainWindow(BoxLayout):
         self.app.comms.release_m0()
 
     # called by query timer in comms context, return strings for queries to send
-    def get_queries(self):
+    # query_state is set when the state ($I) may have changed since it was last queried
+    def get_queries(self, query_state=True):
         if not self.app.is_connected or self.is_printing:
             return ""
 
@@ -731,13 +1020,15 @@ class MainWindow(BoxLayout):
             if current_tab == 'Macros':  # macros screen
                 cmd += self.ids.macros.update_buttons()
 
-            # always need the $I
-            cmd += self.ids.dro_widget.update_buttons()
+            # always need the $I if it may have changed
+            if query_state:
+                cmd += self.ids.dro_widget.update_buttons()
 
         else:
             # in desktop mode we need to poll for state changes for macros and DRO
             cmd += self.ids.macros.update_buttons()
-            cmd += self.ids.dro_widget.update_buttons()
+            if query_state:
+                cmd += self.ids.dro_widget.update_buttons()
 
         return cmd
 
@@ -812,10 +1103,21 @@ class SmoothieHost(App):
             'last_print_file': '',
             'serial_port': 'serial:///dev/ttyACM0',
             'report_rate': '1.0',
+            'run_report_rate': '0.2',
             'blank_timeout': '0',
             'manual_tool_change': 'false',
             'wait_on_m0': 'false',
             'fast_stream': 'false',
+            'windowed_stream': 'false',
+            'window_lines': '8',
+            'window_bytes': '256',
+            'window_autotune': 'false',
+            'line_numbers': 'false',
+            'auto_reconnect': 'false',
+            'minify': 'false',
+            'minify_resolution': '0.001',
+            'machines': '',
+            'arc_tolerance': '0.01',
             'v2': 'false',
             'is_spindle_camera': 'false'
         })
@@ -890,6 +1192,12 @@ class SmoothieHost(App):
                   "section": "General",
                   "key": "report_rate" },
 
+                { "type": "numeric",
+                  "title": "Run Report rate",
+                  "desc": "Rate in seconds to query for status from Smoothie when running or jogging",
+                  "section": "General",
+                  "key": "run_report_rate" },
+
                 { "type": "numeric",
                   "title": "Blank Timeout",
                   "desc": "Inactive timeout in seconds before screen will blank",
@@ -931,6 +1239,67 @@ class SmoothieHost(App):
                   "key": "fast_stream"
                 },
 
+                { "type": "bool",
+                  "title": "Windowed Stream",
+                  "desc": "Keep a window of lines in flight when streaming instead of waiting for each ok",
+                  "section": "General",
+                  "key": "windowed_stream"
+                },
+
+                { "type": "numeric",
+                  "title": "Window Lines",
+                  "desc": "Maximum number of lines in flight for windowed stream",
+                  "section": "General",
+                  "key": "window_lines" },
+
+                { "type": "numeric",
+                  "title": "Window Bytes",
+                  "desc": "Maximum number of bytes in flight for windowed stream, should not exceed the Smoothie receive buffer",
+                  "section": "General",
+                  "key": "window_bytes" },
+
+                { "type": "bool",
+                  "title": "Window Auto Tune",
+                  "desc": "Adjust the number of lines in flight from the measured ok latency",
+                  "section": "General",
+                  "key": "window_autotune"
+                },
+
+                { "type": "bool",
+                  "title": "Line Numbers",
+                  "desc": "Send line numbers and checksums when streaming and resend lines the controller rejects",
+                  "section": "General",
+                  "key": "line_numbers"
+                },
+
+                { "type": "bool",
+                  "title": "Minify",
+                  "desc": "Make lines shorter when streaming, removes comments and repeated words and rounds coordinates",
+                  "section": "General",
+                  "key": "minify"
+                },
+
+                { "type": "numeric",
+                  "title": "Minify Resolution",
+                  "desc": "Coordinates are rounded to this (mm) when minifying, 0 to not round them",
+                  "section": "General",
+                  "key": "minify_resolution"
+                },
+
+                { "type": "numeric",
+                  "title": "Arc Tolerance",
+                  "desc": "How far (mm) an arc made by Fit Arcs may be from the moves it replaces",
+                  "section": "General",
+                  "key": "arc_tolerance"
+                },
+
+                { "type": "bool",
+                  "title": "Auto Reconnect",
+                  "desc": "Reconnect when the connection is lost, and offer to continue a run it interrupted",
+                  "section": "General",
+                  "key": "auto_reconnect"
+                },
+
                 { "type": "title",
                   "title": "Web Settings" },
 
@@ -997,6 +1366,8 @@ class SmoothieHost(App):
             self.manual_tool_change = value == '1'
         elif token == ('General', 'wait_on_m0'):
             self.wait_on_m0 = value == '1'
+        elif token == ('General', 'arc_tolerance'):
+            pass  # read each time arcs are fitted
         elif token == ('General', 'v2'):
             self.is_v2 = value == '1'
         elif token == ('Web', 'camera_url'):
@@ -1004,9 +1375,54 @@ class SmoothieHost(App):
         else:
             self.main_window.display("NOTICE: Restart is needed")
 
+    def _new_machine(self, port):
+        machine = Machine(self, 'Machine {}'.format(len(self.machines) + 1), port)
+        # all the machines share the one comms thread
+        comms = Comms(machine, self.config.getfloat('General', 'report_rate'))
+        rr = self.config.getfloat('General', 'run_report_rate')
+        if rr > 0:
+            comms.report_rates = {'Run': rr, 'Jog': rr, 'Home': rr}
+        if self.config.getboolean('General', 'windowed_stream'):
+            comms.window_size = (self.config.getint('General', 'window_lines'), self.config.getint('General', 'window_bytes'))
+            comms.window_autotune = self.config.getboolean('General', 'window_autotune')
+        comms.line_numbers = self.config.getboolean('General', 'line_numbers')
+        comms.auto_reconnect = self.config.getboolean('General', 'auto_reconnect')
+        comms.minify = self.config.getboolean('General', 'minify')
+        comms.minify_resolution = self.config.getfloat('General', 'minify_resolution')
+        machine.comms = comms
+        self.machines.append(machine)
+        return machine
+
+    def add_machine(self, port):
+        ''' add a machine on port, it is remembered for next time '''
+        machine = self._new_machine(port)
+        self._write_machines()
+        return machine
+
+    def set_port(self, port):
+        ''' change the port of the machine being shown '''
+        if self.machine.port is None:
+            self.config.set('General', 'serial_port', port)
+        else:
+            self.machine.port = port
+            self._write_machines()
+            return
+        self.config.write()
+
+    def _write_machines(self):
+        self.config.set('General', 'machines', ','.join(m.port for m in self.machines if m.port is not None))
+        self.config.write()
+
+    def set_machine(self, machine):
+        ''' everything that talks to the machine goes through app.comms, so this switches it all over '''
+        self.machine = machine
+        self.comms = machine.comms
+        self.sm.get_screen('viewer').comms = machine.comms
+
     def on_stop(self):
         # The Kivy event loop is about to stop, stop the async main loop
-        self.comms.stop()   # stop the aysnc loop
+        for m in self.machines:
+            m.comms.stop()   # stop the aysnc loop
         if self.is_webserver:
             self.webserver.stop()
         if self.blank_timeout > 0:
@@ -1085,7 +1501,13 @@ class SmoothieHost(App):
         self.wait_on_m0 = self.config.getboolean('General', 'wait_on_m0')
         self.is_v2 = self.config.getboolean('General', 'v2')
 
-        self.comms = Comms(App.get_running_app(), self.config.getfloat('General', 'report_rate'))
+        # the first machine uses the configured port, any others were added with Select Machine
+        self.machines = []
+        self.machine = self._new_machine(None)
+        for port in self.config.get('General', 'machines').split(','):
+            if port.strip():
+                self._new_machine(port.strip())
+        self.comms = self.machine.comms
         self.gcode_file = self.config.get('General', 'last_print_file')
         self.sm = ScreenManager()
         ms = MainScreen(name='main')
@@ -1240,6 +1662,11 @@ class SmoothieHost(App):
             self.gcode_help.populate()
             self.sm.current = 'gcode_help'
 
+        elif s == '?timings':
+            # show the streaming line timings
+            for l in self.comms.line_timings.summary():
+                self.main_window.display(l)
+
         else:
             self.main_window.display('<< {}'.format(s))
             self.comms.write('{}\n'.format(s))
@@ -1283,6 +1710,8 @@ class SmoothieHost(App):
             with open('/sys/class/backlight/rpi_backlight/bl_power', 'w') as f:
                 f.write('1\n')
             self._blanked = True
+            # no point polling for status when nobody can see it
+            self.comms.suspend_reports(True)
         except Exception:
             Logger.warning("SmoothieHost: unable to blank screen")
 
@@ -1298,6 +1727,7 @@ class SmoothieHost(App):
         if self._blanked:
             self._blanked = False
             self.unblank_screen()
+            self.comms.suspend_reports(False)
             return True
 
         return False
@@ -0,0 +1,223 @@
+''' micro benchmarks for the per line hot paths in comms.py
+    run from the top level directory: python3 tests/comms-bench.py
+'''
+import sys
+import os
+import io
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from comms import Comms, StatusReport, LineReader, SerialConnection
+
+
+class BenchLoop():
+    ''' stands in for the asyncio loop, the status handler schedules the next query on it '''
+    def call_later(self, t, cb, *args):
+        return None
+
+    def call_soon(self, cb, *args):
+        return None
+
+
+class BenchApp():
+    ''' the minimum of the app and main window the incoming line handlers call '''
+    def __init__(self):
+        self.main_window = self
+        self.last_probe = None
+
+    def async_display(self, s):
+        pass
+
+    def update_status(self, sr):
+        pass
+
+    def update_state(self, a):
+        pass
+
+    def alarm_state(self, s):
+        pass
+
+
+# a typical mix of what comes back while streaming, mostly oks with a status report now and then
+STREAM_LINES = ['ok'] * 20 + ['<Run|MPos:68.9980,-49.9240,40.0000|WPos:68.9980,-49.9240,40.0000|F:1200.0,100.0|S:0.0>']
+IDLE_LINES = [
+    '<Idle|MPos:68.9980,-49.9240,40.0000,12.3456|WPos:68.9980,-49.9240,40.0000|F:4000.0,100.0|S:0.0|T:25.0,0.0|B:25.2,0.0>',
+    '[G0 G55 G17 G21 G90 G94 M0 M5 M9 T1 F4000.0000 S0.8000]',
+    'ok',
+    '[PRB:1.000,80.137,10.000:0]',
+    '// echo: some comment',
+    'Some other message'
+]
+
+
+def bench(name, fn, lines, n):
+    cnt = 0
+    start = time.perf_counter()
+    while cnt < n:
+        for l in lines:
+            fn(l)
+        cnt += len(lines)
+    elapsed = time.perf_counter() - start
+    print('{:<24} {:>12,.0f} lines/sec'.format(name, cnt / elapsed))
+
+
+class BenchHost():
+    ''' the properties the main window sets from a status report '''
+    status = wpos = mpos = fr = frr = fro = sr = lp = None
+
+
+def legacy_status(s, host):
+    # the old dict based parse in Comms.handle_status plus the lookups in MainWindow.update_status
+    # including the debug log messages, which were formatted even when debug logging was off
+    s = s[1:-1]
+    ll = s.split('|')
+    "Comms: Got status: {}".format(ll)
+    status = ll[0]
+    d = {a: [float(y) for y in b.split(',')] for a, b in [x.split(':') for x in ll[1:]]}
+    'Comms: got status:{} - rest: {}'.format(status, d)
+    host.status = status
+    if 'WPos' in d:
+        host.wpos = d['WPos']
+    if 'MPos' in d:
+        host.mpos = d['MPos']
+    if 'F' in d:
+        host.fr = d['F'][0]
+        if len(d['F']) == 2:
+            host.fro = d['F'][1]
+            host.frr = d['F'][0]
+        elif len(d['F']) == 3:
+            host.frr = d['F'][1]
+            host.fro = d['F'][2]
+    if 'S' in d:
+        host.sr = d['S'][0]
+    if 'L' in d:
+        host.lp = d['L'][0]
+    t = {}
+    if 'T' in d:
+        t['hotend0'] = (d['T'][0], d['T'][1])
+    if 'B' in d:
+        t['bed'] = (d['B'][0], d['B'][1])
+
+
+def new_status(s, host):
+    sr = StatusReport.parse(s)
+    host.status = sr.state
+    if sr.wpos is not None:
+        host.wpos = sr.wpos
+    if sr.mpos is not None:
+        host.mpos = sr.mpos
+    if sr.feed is not None:
+        host.fr = sr.feed
+        if sr.feed_req is not None:
+            host.frr = sr.feed_req
+        if sr.feed_ovr is not None:
+            host.fro = sr.feed_ovr
+    if sr.spindle is not None:
+        host.sr = sr.spindle
+    if sr.laser is not None:
+        host.lp = sr.laser
+    if sr.temperatures:
+        t = dict(sr.temperatures)
+
+
+def bench_status(n):
+    host = BenchHost()
+    for name, lines in (('cnc', STREAM_LINES[-1:]), ('3d printer', IDLE_LINES[:1])):
+        bench('status legacy ' + name, lambda s: legacy_status(s, host), lines, n)
+        bench('status parse ' + name, lambda s: new_status(s, host), lines, n)
+
+
+def bench_dispatch(n):
+    c = Comms(BenchApp(), 1)
+    c.loop = BenchLoop()
+    c.okcnt = 0
+    c.ping_pong = False
+    bench('dispatch ok', c.incoming_line, ['ok'], n)
+    bench('dispatch streaming mix', c.incoming_line, STREAM_LINES, n)
+    bench('dispatch idle mix', c.incoming_line, IDLE_LINES, n)
+
+
+class NullTransport():
+    def write(self, data):
+        pass
+
+
+# a chunk of typical cam output, a few comments and a lot of short moves
+GCODE_CHUNK = ''.join(['; layer\n', 'G1 Z0.2 F3000\n'] + ['G1 X{:.3f} Y{:.3f} E{:.5f}\n'.format(i * 0.1, i * 0.2, i * 0.01) for i in range(2000)])
+
+
+class LegacyLineReader(LineReader):
+    ''' the old text mode LineReader, the file was opened with open(fn, 'r') '''
+    def _read_chunk(self):
+        # runs in the executor thread, returns a list of (type, line) or None at EOF
+        data = self._f.read(self.chunk_size)
+        if not data:
+            if not self._fragment:
+                return None
+            # last line had no terminating newline
+            data = '\n'
+        lines = (self._fragment + data).split('\n')
+        self._fragment = lines.pop()
+
+        result = []
+        for l in lines:
+            l = l.strip()
+            if not l or l[0] == ';':
+                continue
+            if l[0] == '(':
+                if l.startswith('(MSG'):
+                    result.append((LineReader.MSG, l))
+                elif l.startswith('(NOTIFY'):
+                    result.append((LineReader.NOTIFY, l))
+                continue
+            if self.transform is not None:
+                l = self.transform(l)
+            result.append((LineReader.GCODE, l))
+
+        return result
+
+
+def legacy_send_message(proto, data):
+    # the old SerialConnection.send_message, which formatted and logged every line even with debug logging off
+    proto.log.debug('SerialConnection: send_message: {}'.format(data))
+    proto.transport.write(data.encode('utf-8'))
+
+
+def legacy_send(data, proto):
+    r = LegacyLineReader(None)
+    r._f = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+    r._fragment = ''
+    for t, l in r._read_chunk():
+        legacy_send_message(proto, l + '\n')
+
+
+def bytes_send(data, proto):
+    r = LineReader(None)
+    r._f = io.BytesIO(data)
+    for t, line in r._read_chunk():
+        proto.send_message(line)
+
+
+def bench_send(n):
+    # read, classify and write the lines of a chunk, as the streamer does for each line of a file
+    proto = SerialConnection(None, None)
+    proto.transport = NullTransport()
+    lines = GCODE_CHUNK.count('\n')
+    chunk = GCODE_CHUNK.encode('utf-8')
+    for name, fn in (('send text lines', legacy_send), ('send bytes lines', bytes_send)):
+        cnt = 0
+        start = time.perf_counter()
+        while cnt < n:
+            fn(chunk, proto)
+            cnt += lines
+        elapsed = time.perf_counter() - start
+        print('{:<24} {:>12,.0f} lines/sec'.format(name, cnt / elapsed))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.WARNING)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    bench_dispatch(n)
+    bench_status(n // 4)
+    bench_send(n)
@@ -0,0 +1,688 @@
+''' Emulates enough of a Smoothie v1 to test and benchmark comms.py without any hardware.
+    run from the top level directory: python3 tests/smoothie_emulator.py [--pty] [--port 2323] ...
+    then connect to serial:///dev/pts/N (the pty name is printed) or net://localhost:2323
+
+    Replies ok to each line, and <...> to ?, [G0 G54 ...] to $I or $G, [PRB:...] to G38.x and G30,
+    M115 and M20 as Smoothie does. Lines may have line numbers and checksums, a bad line gets rs N<line>.
+    Moves are queued in a planner queue of a fixed depth, a line is only ok'd when there is room for it in
+    the queue, and each move takes its distance at the feedrate (or a fixed time per move) to execute.
+    $J jogs relative to where it is. ! is feed hold and ~ resumes, ctrl-X aborts, M112 halts and then every line gets !!, $X or M999 clears it.
+    M600 suspends with // action:pause and M601 resumes with // action:resume.
+'''
+import os
+import asyncio
+import argparse
+import logging
+import functools
+import math
+import random
+import re
+import time
+import collections
+
+
+class Move():
+    __slots__ = ('start', 'end', 'feed', 'duration', 'dwell')
+
+    def __init__(self, start, end, feed, duration, dwell=False):
+        self.start = start
+        self.end = end
+        self.feed = feed
+        self.duration = duration
+        self.dwell = dwell
+
+
+class SmoothieEmulator():
+    ''' the firmware side, data received is passed to feed() and the replies go to the write callback
+        of whichever connection was made last '''
+
+    WORD = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+    WCS = ('G54', 'G55', 'G56', 'G57', 'G58', 'G59')
+
+    def __init__(self, queue_size=32, time_scale=1.0, move_time=None, line_time=0.0, rapid_rate=3000.0,
+                 rx_buffer=256, error_rate=0.0, probe_z=0.0, files=None):
+        self.log = logging.getLogger()  # .getChild('SmoothieEmulator')
+        self.queue_size = queue_size  # depth of the planner queue
+        self.time_scale = time_scale  # multiplies the time each move takes, 0 executes moves instantly
+        self.move_time = move_time  # if set every move takes this long (seconds) instead of distance/feedrate
+        self.line_time = line_time  # time taken to parse each line before it is ok'd
+        self.rapid_rate = rapid_rate  # mm/min for G0
+        self.rx_buffer = rx_buffer  # bytes we buffer before we stop reading, 0 for no limit
+        self.error_rate = error_rate  # fraction of line numbered lines that are corrupted on the way in
+        self.probe_z = probe_z  # Z where the probe triggers
+        self.files = files if files is not None else ['test.g', 'part1.nc', 'laser.gcode']
+
+        self.conn = None
+        self._backlog = bytearray()  # received but not yet in the receive buffer
+        self._rx = bytearray()  # partial line in the receive buffer
+        self._lines = collections.deque()
+        self._rx_bytes = 0  # bytes in the receive buffer
+        self._paused_reading = False
+        self._line_ready = None
+        self._queue_changed = None
+        self._queue = collections.deque()
+        self._current = None
+        self._move_started = 0
+        self._move_elapsed = 0
+
+        self.state = 'Idle'
+        self.halted = False
+        self.hold = False
+        self.suspended = False
+        self.pos = [0.0, 0.0, 0.0]  # planned position, where the last queued move ends
+        self.mpos = [0.0, 0.0, 0.0]  # where the last executed move ended
+        self.wcs = 0
+        self.wcs_offsets = [[0.0, 0.0, 0.0] for i in range(len(SmoothieEmulator.WCS))]
+        self.g92_offset = [0.0, 0.0, 0.0]
+        self.motion = 'G0'
+        self.absolute = True
+        self.inches = False
+        self.feedrate = 1000.0
+        self.feed_ovr = 100.0
+        self.spindle = 'M5'
+        self.s = 0.0
+        self.tool = 0
+        self.currentline = 0
+
+        # counts of what happened, for benchmarks
+        self.stats = collections.Counter()
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        self._line_ready = asyncio.Event()
+        self._queue_changed = asyncio.Event()
+        self._tasks = [loop.create_task(self._process()), loop.create_task(self._execute())]
+
+    def stop(self):
+        for t in self._tasks:
+            t.cancel()
+
+    def connect(self, conn):
+        ''' conn has write(bytes), pause_reading() and resume_reading() '''
+        self.conn = conn
+        self._backlog.clear()
+        self._rx.clear()
+        self._lines.clear()
+        self._rx_bytes = 0
+        self._paused_reading = False
+
+    def disconnect(self, conn):
+        if self.conn is conn:
+            self.conn = None
+
+    def send(self, s):
+        if self.conn is not None:
+            self.conn.write('{}\n'.format(s).encode('utf-8'))
+
+    # ----------------------------------------------------------------------
+    # input
+
+    def feed(self, data):
+        ''' called with the data received. It only goes into the receive buffer as there is room, which is when the
+            realtime characters are handled, so like the real thing they get stuck behind a full buffer '''
+        self.stats['bytes'] += len(data)
+        self._backlog.extend(data)
+        self._fill()
+        if self._backlog and not self._paused_reading and self.conn:
+            # we model the flow control by not reading any more until there is room
+            self._paused_reading = True
+            self.conn.pause_reading()
+
+    def _fill(self):
+        n = len(self._backlog)
+        if self.rx_buffer:
+            n = min(n, self.rx_buffer - self._rx_bytes)
+        if n <= 0:
+            return
+
+        data = bytes(self._backlog[:n])
+        del self._backlog[:n]
+        i = data.rfind(b'\x18')
+        if i >= 0:
+            # everything up to the ctrl-X is thrown away
+            self._realtime(data[:i])
+            self._abort()
+            data = data[i + 1:]
+        data = self._realtime(data)
+
+        self._rx_bytes += len(data)
+        self._rx.extend(data)
+        n = self._rx.rfind(b'\n')
+        if n < 0:
+            return
+
+        for b in self._rx[:n].split(b'\n'):
+            l = b.decode('utf-8', 'replace').strip()
+            if l:
+                self._lines.append((l, len(b) + 1))
+            else:
+                self._rx_bytes -= len(b) + 1
+        del self._rx[:n + 1]
+        self._line_ready.set()
+
+    def _realtime(self, data):
+        # handle and remove the realtime characters
+        for c in (b'?', b'!', b'~'):
+            n = data.count(c)
+            if n == 0:
+                continue
+            for i in range(n):
+                if c == b'?':
+                    self.stats['status'] += 1
+                    self.send(self.status())
+                elif c == b'!':
+                    self.hold = True
+                elif self.hold or self.suspended:
+                    self.hold = False
+                    if self.suspended:
+                        self._resume()
+            data = data.replace(c, b'')
+        return data
+
+    def _next_line(self):
+        l, n = self._lines.popleft()
+        self._rx_bytes -= n
+        self._fill()
+        if self._paused_reading and not self._backlog:
+            self._paused_reading = False
+            if self.conn:
+                self.conn.resume_reading()
+        return l
+
+    @asyncio.coroutine
+    def _process(self):
+        while True:
+            if not self._lines:
+                self._line_ready.clear()
+                yield from self._line_ready.wait()
+                continue
+
+            l = self._next_line()
+            if self.line_time > 0:
+                yield from asyncio.sleep(self.line_time)
+            try:
+                yield from self._handle_line(l)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.log.error('SmoothieEmulator: error handling {}: {}'.format(l, err))
+                self.send('error:{}'.format(err))
+
+    @asyncio.coroutine
+    def _handle_line(self, l):
+        self.stats['lines'] += 1
+        if l[0] == 'N':
+            # line numbered, Smoothie only accepts the next line in sequence with a good checksum
+            if self.error_rate and random.random() < self.error_rate:
+                self.stats['corrupted'] += 1
+                l = l.replace('X', 'Y', 1) if 'X' in l else l.replace('G', 'M', 1)
+            l = self._check_line(l)
+            if l is None:
+                self.stats['rejected'] += 1
+                self.send('rs N{}'.format(self.currentline + 1))
+                return
+            if l.startswith('M110'):
+                self.send('ok')
+                return
+        else:
+            self.currentline += 1
+
+        if self.halted:
+            if l in ('$X', 'M999'):
+                self.halted = False
+                self.state = 'Idle'
+                self.send('[Caution: Unlocked]')
+                self.send('ok')
+            else:
+                self.send('!!')
+            return
+
+        c = l[0]
+        if c in 'GMTXYZSF':
+            yield from self._gcode(l)
+        elif l in ('$I', '$G'):
+            self.send(self.modal_state())
+            self.send('ok')
+        elif l == '$H':
+            yield from self._home()
+            self.send('ok')
+        elif l.startswith('$J'):
+            yield from self._jog(l)
+            self.send('ok')
+        elif l == '$X':
+            self.send('ok')
+        elif l == 'version':
+            self.send('Build version: emulator, Build date: {}, MCU: LPC1769, System Clock: 100MHz'.format(time.strftime('%b %d %Y')))
+            self.send('  CNC Build')
+        else:
+            self.send('error:Unsupported command - {}'.format(l))
+
+    def _check_line(self, l):
+        # returns the line without the number and checksum, or None if it is not the next line or is corrupted
+        l, star, cs = l.partition('*')
+        if not star:
+            return None
+        x = 0
+        for b in l.encode('utf-8'):
+            x ^= b
+        try:
+            if x != int(cs):
+                return None
+        except ValueError:
+            return None
+
+        n, _, rest = l[1:].partition(' ')
+        n = int(n)
+        if rest.startswith('M110'):
+            self.currentline = n
+            return rest
+        if n != self.currentline + 1:
+            return None
+        self.currentline = n
+        return rest
+
+    # ----------------------------------------------------------------------
+    # gcode
+
+    @asyncio.coroutine
+    def _gcode(self, l):
+        words = [(c, float(v)) for c, v in SmoothieEmulator.WORD.findall(l.upper().split(';')[0])]
+        g = [v for c, v in words if c == 'G']
+        m = [v for c, v in words if c == 'M']
+        axes = {c: v for c, v in words if c in 'XYZ'}
+        params = {c: v for c, v in words if c not in 'GM'}
+
+        if 'F' in params:
+            self.feedrate = params['F'] * (25.4 if self.inches else 1)
+        if 'S' in params and not m:
+            self.s = params['S']
+        if 'T' in params:
+            self.tool = int(params['T'])
+
+        move = None
+        for v in g:
+            if v in (0, 1, 2, 3):
+                self.motion = 'G{:g}'.format(v)
+                move = self.motion
+            elif v == 4:
+                yield from self._queue_move(Move(self.pos, self.pos, 0, params.get('P', 0) / 1000.0 + params.get('S', 0), dwell=True))
+            elif v in (20, 21):
+                self.inches = v == 20
+            elif v in (90, 91):
+                self.absolute = v == 90
+            elif 54 <= v <= 59:
+                self.wcs = int(v) - 54
+            elif v == 92:
+                wp = self._wpos(self.pos)
+                for i, a in enumerate('XYZ'):
+                    if a in axes:
+                        self.g92_offset[i] += wp[i] - self._units(axes[a])
+            elif v == 10 and params.get('L') in (2, 20):
+                p = int(params.get('P', 1))
+                if p == 0:
+                    p = self.wcs + 1
+                o = self.wcs_offsets[p - 1]
+                for i, a in enumerate('XYZ'):
+                    if a in axes:
+                        if params['L'] == 2:
+                            o[i] = self._units(axes[a])
+                        else:
+                            o[i] = self.pos[i] - self.g92_offset[i] - self._units(axes[a])
+            elif v in (38.2, 38.3, 30):
+                yield from self._probe(axes, v)
+                self.send('ok')
+                return
+            elif v == 28.2:
+                yield from self._home()
+
+        for v in m:
+            if v in (3, 4, 5):
+                self.spindle = 'M{:g}'.format(v)
+                if 'S' in params:
+                    self.s = params['S']
+            elif v == 20:
+                self.send('Begin file list')
+                for f in self.files:
+                    self.send(f)
+                self.send('End file list')
+            elif v == 112:
+                self._stop()
+                self.halted = True
+                self.state = 'Alarm'
+                self.send('ALARM: Kill button pressed - reset or M999 to clear')
+                return
+            elif v == 115:
+                self.send('FIRMWARE_NAME:Smoothieware, FIRMWARE_URL:http%3A//smoothieware.org, '
+                          'X-SOURCE_CODE_URL:https://github.com/Smoothieware/Smoothieware, FIRMWARE_VERSION:emulator, '
+                          'X-FIRMWARE_BUILD_DATE:{}, X-SYSTEM_CLOCK:100MHz, X-AXES:3, X-GRBL_MODE:1, X-CNC:1'.format(time.strftime('%b %d %Y')))
+            elif v == 220 and 'S' in params:
+                self.feed_ovr = params['S']
+            elif v == 400:
+                yield from self._wait_empty()
+            elif v == 600:
+                yield from self._wait_empty()
+                self.suspended = True
+                self.state = 'Hold'
+                self.send('// action:pause')
+            elif v == 601:
+                if self.suspended:
+                    self._resume()
+
+        if move is None and axes and not g and not m:
+            # modal motion
+            move = self.motion
+
+        if move is not None and axes:
+            target = list(self.pos)
+            for i, a in enumerate('XYZ'):
+                if a in axes:
+                    v = self._units(axes[a])
+                    target[i] = self._mpos(i, v) if self.absolute else target[i] + v
+            feed = self.rapid_rate if move == 'G0' else self.feedrate
+            d = math.sqrt(sum((a - b) ** 2 for a, b in zip(target, self.pos)))
+            if move in ('G2', 'G3'):
+                # near enough, the arc is a bit longer than the chord
+                d *= 1.2
+            yield from self._queue_move(Move(self.pos, target, feed, self._duration(d, feed)))
+            self.pos = target
+
+        self.send('ok')
+
+    @asyncio.coroutine
+    def _jog(self, l):
+        # $J X1 F100 is a relative move that does not change the modal state
+        words = [(c, float(v)) for c, v in SmoothieEmulator.WORD.findall(l[2:].upper())]
+        feed = dict(words).get('F', self.rapid_rate)
+        target = list(self.pos)
+        for c, v in words:
+            if c in 'XYZ':
+                target['XYZ'.index(c)] += self._units(v)
+        d = math.sqrt(sum((a - b) ** 2 for a, b in zip(target, self.pos)))
+        yield from self._queue_move(Move(self.pos, target, feed, self._duration(d, feed)))
+        self.pos = target
+
+    def _units(self, v):
+        return v * 25.4 if self.inches else v
+
+    def _mpos(self, i, v):
+        return v + self.wcs_offsets[self.wcs][i] + self.g92_offset[i]
+
+    def _wpos(self, p):
+        return [p[i] - self.wcs_offsets[self.wcs][i] - self.g92_offset[i] for i in range(3)]
+
+    def _duration(self, d, feed):
+        if self.move_time is not None:
+            return self.move_time
+        f = feed * self.feed_ovr / 100.0
+        return self.time_scale * d * 60.0 / f if f > 0 else 0
+
+    @asyncio.coroutine
+    def _queue_move(self, mv):
+        # the ok is not sent until the move fits in the queue
+        aborts = self.stats['aborts']
+        while len(self._queue) >= self.queue_size:
+            self.stats['queue_full'] += 1
+            self._queue_changed.clear()
+            yield from self._queue_changed.wait()
+        if aborts != self.stats['aborts']:
+            # aborted while we were waiting
+            return
+        self._queue.append(mv)
+        self.stats['moves'] += 1
+        self._queue_changed.set()
+
+    @asyncio.coroutine
+    def _wait_empty(self):
+        while self._queue or self._current is not None:
+            self._queue_changed.clear()
+            yield from self._queue_changed.wait()
+
+    @asyncio.coroutine
+    def _probe(self, axes, g):
+        yield from self._wait_empty()
+        target = list(self.pos)
+        z = self._mpos(2, self.probe_z)
+        if 'Z' in axes:
+            target[2] = self._mpos(2, self._units(axes['Z'])) if self.absolute or g == 30 else target[2] + self._units(axes['Z'])
+        hit = target[2] <= z <= self.pos[2]
+        if hit:
+            target[2] = z
+        yield from self._queue_move(Move(self.pos, target, self.feedrate, self._duration(abs(target[2] - self.pos[2]), self.feedrate)))
+        yield from self._wait_empty()
+        self.pos = target
+        self.send('[PRB:{:1.3f},{:1.3f},{:1.3f}:{}]'.format(target[0], target[1], target[2], 1 if hit else 0))
+        if not hit and g != 38.3:
+            self.halted = True
+            self.state = 'Alarm'
+            self.send('ALARM: Probe fail')
+
+    @asyncio.coroutine
+    def _home(self):
+        yield from self._wait_empty()
+        self.state = 'Home'
+        yield from asyncio.sleep(self.time_scale)
+        self.pos = [0.0, 0.0, 0.0]
+        self.mpos = [0.0, 0.0, 0.0]
+        self.state = 'Idle'
+
+    def _abort(self):
+        # ctrl-X, stops everything and throws away whatever has not been processed
+        if self._queue or self._current is not None:
+            self.halted = True
+            self.state = 'Alarm'
+            self.send('ALARM: Abort during cycle')
+        self._stop()
+        self._lines.clear()
+        self._rx.clear()
+        self._rx_bytes = 0
+
+    def _stop(self):
+        self.stats['aborts'] += 1
+        self.mpos = self._current_pos()
+        self.pos = list(self.mpos)
+        self._queue.clear()
+        self._current = None
+        self.hold = False
+        if self._queue_changed is not None:
+            self._queue_changed.set()
+
+    def _resume(self):
+        self.suspended = False
+        if self.state == 'Hold':
+            self.state = 'Idle'
+        self.send('// action:resume')
+
+    # ----------------------------------------------------------------------
+    # execution
+
+    @asyncio.coroutine
+    def _execute(self):
+        while True:
+            if self.hold or self.halted:
+                if not self.halted:
+                    self.state = 'Hold'
+                yield from asyncio.sleep(0.01)
+                continue
+
+            if not self._queue:
+                if not self.suspended:
+                    self.state = 'Idle'
+                self._queue_changed.clear()
+                yield from self._queue_changed.wait()
+                continue
+
+            mv = self._queue.popleft()
+            self._current = mv
+            self._queue_changed.set()
+            self.state = 'Run'
+            self._move_elapsed = 0
+            while self._current is mv and self._move_elapsed < mv.duration:
+                if self.hold:
+                    self.state = 'Hold'
+                    yield from asyncio.sleep(0.01)
+                    continue
+                self.state = 'Run'
+                self._move_started = time.perf_counter()
+                yield from asyncio.sleep(min(mv.duration - self._move_elapsed, 0.1))
+                self._move_elapsed += time.perf_counter() - self._move_started
+                self._move_started = 0
+
+            if self._current is mv:
+                # not aborted
+                self.mpos = mv.end
+                self._current = None
+            self._queue_changed.set()
+            if mv.duration <= 0:
+                # let the lines get processed
+                yield
+
+    def _current_pos(self):
+        mv = self._current
+        if mv is None or mv.duration <= 0:
+            return list(self.mpos)
+        t = self._move_elapsed
+        if self._move_started:
+            t += time.perf_counter() - self._move_started
+        f = min(t / mv.duration, 1.0)
+        return [a + (b - a) * f for a, b in zip(mv.start, mv.end)]
+
+    # ----------------------------------------------------------------------
+    # reports
+
+    def status(self):
+        mp = self._current_pos()
+        wp = self._wpos(mp)
+        mv = self._current
+        if mv is not None and not mv.dwell and not self.hold:
+            f = 'F:{:1.1f},{:1.1f},{:1.1f}'.format(mv.feed * self.feed_ovr / 100.0, mv.feed, self.feed_ovr)
+        else:
+            f = 'F:{:1.1f},{:1.1f}'.format(self.feedrate, self.feed_ovr)
+        return '<{}|MPos:{:1.4f},{:1.4f},{:1.4f}|WPos:{:1.4f},{:1.4f},{:1.4f}|{}|S:{:1.4f},100.0>'.format(
+            self.state, mp[0], mp[1], mp[2], wp[0], wp[1], wp[2], f, self.s if self.spindle != 'M5' else 0.0)
+
+    def modal_state(self):
+        return '[{} {} G17 {} {} G94 M0 {} M9 T{} F{:1.4f} S{:1.4f}]'.format(
+            self.motion, SmoothieEmulator.WCS[self.wcs], 'G20' if self.inches else 'G21', 'G90' if self.absolute else 'G91',
+            self.spindle, self.tool, self.feedrate, self.s)
+
+
+class TcpConnection(asyncio.Protocol):
+    ''' a telnet like connection as Smoothie has on port 23 '''
+
+    def __init__(self, emulator):
+        super().__init__()
+        self.emulator = emulator
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.emulator.connect(self)
+
+    def data_received(self, data):
+        self.emulator.feed(data)
+
+    def connection_lost(self, exc):
+        self.emulator.disconnect(self)
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def pause_reading(self):
+        self.transport.pause_reading()
+
+    def resume_reading(self):
+        self.transport.resume_reading()
+
+
+class PtyConnection():
+    ''' the master side of a pty, the slave side looks like a serial port to comms.py '''
+
+    def __init__(self, emulator):
+        import tty
+        self.emulator = emulator
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.name = os.ttyname(self.slave)
+        self.loop = asyncio.get_event_loop()
+        self.loop.add_reader(self.master, self._read)
+        self.emulator.connect(self)
+
+    def _read(self):
+        try:
+            data = os.read(self.master, 4096)
+        except OSError:
+            # nothing has the slave open
+            return
+        if data:
+            if self.emulator.conn is not self:
+                # take over from the last TCP connection
+                self.emulator.connect(self)
+            self.emulator.feed(data)
+
+    def write(self, data):
+        try:
+            os.write(self.master, data)
+        except OSError as err:
+            self.emulator.log.debug('PtyConnection: write failed: {}'.format(err))
+
+    def pause_reading(self):
+        self.loop.remove_reader(self.master)
+
+    def resume_reading(self):
+        self.loop.add_reader(self.master, self._read)
+
+    def close(self):
+        self.loop.remove_reader(self.master)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+@asyncio.coroutine
+def start_server(emulator, host='127.0.0.1', port=2323):
+    ''' listen for TCP connections, returns the asyncio server '''
+    return (yield from asyncio.get_event_loop().create_server(functools.partial(TcpConnection, emulator), host, port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Smoothie emulator for testing comms.py')
+    parser.add_argument('--pty', action='store_true', help='create a pty to connect to as serial://<pty>')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=2323, help='TCP port to listen on, 0 for no TCP')
+    parser.add_argument('--queue', type=int, default=32, help='planner queue depth')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='multiplies the time each move takes, 0 is instant')
+    parser.add_argument('--move-time', type=float, default=None, help='fixed time in seconds each move takes')
+    parser.add_argument('--line-time', type=float, default=0.0, help='time in seconds to parse each line before the ok')
+    parser.add_argument('--rx-buffer', type=int, default=256, help='receive buffer size in bytes, 0 for unlimited')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of line numbered lines to corrupt')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG if args.verbose else logging.INFO)
+
+    emulator = SmoothieEmulator(queue_size=args.queue, time_scale=args.time_scale, move_time=args.move_time,
+                                line_time=args.line_time, rx_buffer=args.rx_buffer, error_rate=args.error_rate)
+
+    loop = asyncio.get_event_loop()
+    emulator.start()
+    pty = None
+    if args.pty:
+        pty = PtyConnection(emulator)
+        print('Connect to serial://{}'.format(pty.name))
+
+    if args.port:
+        server = loop.run_until_complete(start_server(emulator, args.host, args.port))
+        print('Connect to net://{}:{}'.format(args.host, args.port))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+        if pty:
+            pty.close()
+        print(dict(emulator.stats))
+
+
+if __name__ == "__main__":
+    main()
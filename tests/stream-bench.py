@@ -0,0 +1,451 @@
+''' streaming throughput and latency benchmarks, streams files through Comms into the Smoothie emulator over TCP
+    run from the top level directory: python3 tests/stream-bench.py [-o results.json] [--compare old.json] [file ...]
+
+    With no files a corpus of 3d print, cnc adaptive and laser raster files is generated.
+    For each file and streaming mode it reports lines/sec, bytes/sec and the p50/p99 time from a line being written
+    to its ok, then for each mode the time from a pause to the last line the controller receives,
+    and the time from an abort to the controller receiving the ctrl-X.
+    Finally how long a jog and a kill take to get to the controller while a macro file is being sent
+'''
+import sys
+import os
+import math
+import time
+import json
+import asyncio
+import argparse
+import logging
+import tempfile
+import threading
+import collections
+import platform
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from comms import Comms
+from smoothie_emulator import SmoothieEmulator, start_server
+
+MODES = {
+    'ping-pong': {},
+    'fast': {'ping_pong': False},
+    'window': {'window_size': (8, 256)},
+    'window-autotune': {'window_size': (8, 256), 'window_autotune': True},
+    'line-numbers': {'line_numbers': True},
+    'window-line-numbers': {'window_size': (8, 256), 'line_numbers': True},
+    'window-minify': {'window_size': (8, 256), 'minify': True},
+}
+
+
+class BenchWindow():
+    ''' the main window callbacks Comms makes '''
+    is_printing = True
+
+    def __init__(self):
+        self.connected_event = threading.Event()
+        self.finished = threading.Event()
+        self.ok = False
+
+    def connected(self):
+        self.connected_event.set()
+
+    def disconnected(self):
+        self.connected_event.set()
+
+    def stream_finished(self, ok):
+        self.ok = ok
+        self.finished.set()
+
+    def get_queries(self, query_state=True):
+        return ''
+
+    def async_display(self, s):
+        pass
+
+    def action_paused(self, paused, suspended=False):
+        pass
+
+    def alarm_state(self, s):
+        pass
+
+    def update_status(self, sr):
+        pass
+
+    def update_state(self, a):
+        pass
+
+
+class BenchApp():
+    manual_tool_change = False
+    wait_on_m0 = False
+    fast_stream = False
+
+    def __init__(self):
+        self.main_window = BenchWindow()
+        self.last_probe = None
+
+
+class OkTimer():
+    ''' records when each line is written and matches it to its ok, or the reply sent instead of the ok '''
+
+    def __init__(self, comms):
+        self.comms = comms
+        self.sent = collections.deque()
+        self.latencies = []
+        self._write = comms._write
+        comms._write = self.write
+        for p, h in (('ok', comms.handle_ok), ('rs ', comms.handle_resend), ('!!', comms.handle_alarm_reply)):
+            comms.add_handler(p, self._replied(h))
+
+    def write(self, data):
+        # streamed lines are bytes, everything else is a str
+        if len(data) > 1 and data[-1] in ('\n', 0x0a):
+            self.sent.append(time.perf_counter())
+        self._write(data)
+
+    def _replied(self, h):
+        def f(s):
+            if self.sent:
+                self.latencies.append(time.perf_counter() - self.sent.popleft())
+            h(s)
+        return f
+
+    def reset(self):
+        self.sent.clear()
+        self.latencies = []
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        ll = sorted(self.latencies)
+        return ll[min(int(len(ll) * p / 100.0), len(ll) - 1)]
+
+
+class EmulatorTimer():
+    ''' records when the emulator receives lines and ctrl-X '''
+
+    def __init__(self, emulator):
+        self.last_line = 0
+        self.lines = 0
+        self.abort = None
+        self._feed = emulator.feed
+        emulator.feed = self.feed
+
+    def feed(self, data):
+        t = time.perf_counter()
+        if b'\x18' in data and self.abort is None:
+            self.abort = t
+        n = data.count(b'\n')
+        if n:
+            self.last_line = t
+            self.lines += n
+        self._feed(data)
+
+
+def run_emulator(emulator):
+    ''' runs the emulator on its own loop in a thread, returns the TCP port it is listening on '''
+    started = threading.Event()
+    port = []
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        emulator.start()
+        server = loop.run_until_complete(start_server(emulator, '127.0.0.1', 0))
+        port.append(server.sockets[0].getsockname()[1])
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return port[0]
+
+
+# ----------------------------------------------------------------------
+# corpus, generated to look like what the different kinds of CAM produce
+
+def gen_3dprint(f, n):
+    f.write('; generated 3d print\nM82\nG21\nG90\nM104 S200\nG28\n')
+    e = 0
+    z = 0
+    i = 0
+    while i < n:
+        z += 0.2
+        f.write('G92 E0\nG1 Z{:.3f} F3000\n'.format(z))
+        e = 0
+        r = 20 + 5 * math.sin(z)
+        for a in range(120):
+            t = a * math.pi / 60
+            e += 0.0523
+            f.write('G1 X{:.3f} Y{:.3f} E{:.5f} F1800\n'.format(100 + r * math.cos(t), 100 + r * math.sin(t), e))
+        i += 122
+
+
+def gen_cnc(f, n):
+    f.write('(generated cnc adaptive)\nG21\nG90\nG54\nM3 S12000\nG0 Z5\nG0 X0 Y0\nG1 Z-1 F300\n')
+    i = 0
+    x = 0.0
+    while i < n:
+        # trochoidal clearing, lots of tiny moves with an arc now and then
+        for a in range(36):
+            t = a * math.pi / 18
+            f.write('G1 X{:.4f} Y{:.4f} F1500\n'.format(x + 2 * math.cos(t), 2 * math.sin(t)))
+        f.write('G2 X{:.4f} Y0 I1 J0\n'.format(x + 2))
+        f.write('G3 X{:.4f} Y0 I1 J0\n'.format(x))
+        x += 0.5
+        i += 38
+    f.write('G0 Z5\nM5\n')
+
+
+def gen_laser(f, n):
+    f.write('; generated laser raster\nG21\nG90\nM3\nG0 X0 Y0\nF6000\n')
+    y = 0.0
+    i = 0
+    while i < n:
+        f.write('G0 X0 Y{:.2f}\n'.format(y))
+        for x in range(100):
+            f.write('G1 X{:.2f} S{:.3f}\n'.format(x * 0.5, (x * 37 % 100) / 100.0))
+        y += 0.1
+        i += 101
+    f.write('M5\n')
+
+
+def gen_corpus(d, n):
+    files = []
+    for name, gen in (('3dprint', gen_3dprint), ('cnc-adaptive', gen_cnc), ('laser-raster', gen_laser)):
+        fn = os.path.join(d, '{}.g'.format(name))
+        with open(fn, 'w') as f:
+            gen(f, n)
+        files.append(fn)
+    return files
+
+
+# ----------------------------------------------------------------------
+
+def set_mode(comms, mode):
+    comms.ping_pong = True
+    comms.window_size = None
+    comms.window_autotune = False
+    comms.line_numbers = False
+    comms.minify = False
+    for k, v in MODES[mode].items():
+        setattr(comms, k, v)
+
+
+def stream(comms, app, fn):
+    app.main_window.finished.clear()
+    start = time.perf_counter()
+    comms.stream_gcode(fn)
+    app.main_window.finished.wait()
+    return time.perf_counter() - start, app.main_window.ok
+
+
+def bench_throughput(comms, app, emulator, timer, fn, mode):
+    set_mode(comms, mode)
+    timer.reset()
+    emulator.stats.clear()
+    elapsed, ok = stream(comms, app, fn)
+    lines = Comms.file_len(fn)
+    nbytes = emulator.stats['bytes']
+    r = {
+        'file': os.path.basename(fn),
+        'mode': mode,
+        'ok': ok,
+        'lines': lines,
+        'bytes': nbytes,
+        'seconds': round(elapsed, 4),
+        'lines_per_sec': round(lines / elapsed, 1),
+        'bytes_per_sec': round(nbytes / elapsed, 1),
+        'ok_p50_ms': round(timer.percentile(50) * 1000, 3),
+        'ok_p99_ms': round(timer.percentile(99) * 1000, 3),
+    }
+    print('{file:<18} {mode:<20} {lines_per_sec:>10,.0f} lines/s {bytes_per_sec:>12,.0f} bytes/s  ok p50 {ok_p50_ms:7.3f}ms p99 {ok_p99_ms:7.3f}ms'.format(**r))
+    return r
+
+
+def wait_for(f, timeout):
+    ''' wait until f() is true, returns when it became true or None if it timed out '''
+    end = time.perf_counter() + timeout
+    while not f():
+        if time.perf_counter() > end:
+            return None
+        time.sleep(0.001)
+    return time.perf_counter()
+
+
+def bench_latency(comms, app, emulator, etimer, fn, mode, move_time):
+    set_mode(comms, mode)
+    emulator.move_time = move_time
+    app.main_window.finished.clear()
+    comms.stream_gcode(fn)
+
+    # pause part way through, and see how long until the controller stops getting lines and then stops moving
+    time.sleep(0.5)
+    n = etimer.lines
+    t = time.perf_counter()
+    comms.stream_pause(True)
+    idle = wait_for(lambda: emulator.state == 'Idle', 10)
+    idle = None if idle is None else idle - t
+    time.sleep(0.5)
+    pause = max(etimer.last_line - t, 0)
+    after = etimer.lines - n
+
+    # resume, and see how long until the controller gets the next line
+    n = etimer.lines
+    t = time.perf_counter()
+    comms.stream_pause(False)
+    resume = wait_for(lambda: etimer.lines > n, 10)
+    resume = None if resume is None else resume - t
+
+    # run for a bit then abort, and see how long until the controller gets the ctrl-X
+    time.sleep(0.5)
+    etimer.abort = None
+    t = time.perf_counter()
+    comms.stream_pause(False, True)
+    app.main_window.finished.wait()
+    # anything still buffered on the way to the controller is ahead of the ctrl-X, None if it took over 10 seconds
+    wait_for(lambda: etimer.abort is not None, 10)
+    abort = None if etimer.abort is None else etimer.abort - t
+
+    # let it finish whatever it had and clear the alarm from the abort
+    wait_for(lambda: not emulator._lines and not emulator._backlog and emulator.state != 'Run', 60)
+    emulator.move_time = 0
+    comms.write('M999\n')
+    time.sleep(0.2)
+
+    r = {
+        'mode': mode,
+        'pause_ms': round(pause * 1000, 3),
+        'lines_after_pause': after,
+        'pause_idle_ms': None if idle is None else round(idle * 1000, 3),
+        'resume_ms': None if resume is None else round(resume * 1000, 3),
+        'abort_ms': None if abort is None else round(abort * 1000, 3),
+    }
+    print('{mode:<20} pause {pause_ms:9.3f}ms ({lines_after_pause} lines after), idle after {pause_idle_ms}ms  resume {resume_ms}ms  abort {abort_ms}ms'.format(**r))
+    return r
+
+
+def bench_submit(comms, emulator, move_time, n=200):
+    ''' send a macro file of n moves, then a jog and see how long until the controller runs it,
+        then do the same with a kill and see how many moves from the macro still get run after it '''
+    handled = {}
+    handle_line = emulator._handle_line
+    abort = emulator._abort
+
+    def _handle_line(l):
+        handled.setdefault(l[:2], time.perf_counter())
+        return handle_line(l)
+
+    def _abort():
+        handled.setdefault('abort', time.perf_counter())
+        abort()
+
+    emulator._handle_line = _handle_line
+    emulator._abort = _abort
+    emulator.move_time = move_time
+    r = {}
+    try:
+        for test, data in (('jog', '$J X1\n'), ('kill', '\x18')):
+            handled.clear()
+            for i in range(n):
+                comms.write('G1 X{} F1000\n'.format(i % 10), Comms.BULK)
+            time.sleep(0.05)
+            t = time.perf_counter()
+            comms.write(data)
+            k = 'abort' if test == 'kill' else '$J'
+            wait_for(lambda: k in handled, 30)
+            r[test + '_ms'] = round((handled[k] - t) * 1000, 3) if k in handled else None
+            moves = emulator.stats['moves']
+
+            # let it finish whatever it had and clear the alarm from the kill
+            wait_for(lambda: not emulator._lines and not emulator._backlog and emulator.state != 'Run', 60)
+            if test == 'kill':
+                r['moves_after_kill'] = emulator.stats['moves'] - moves
+                comms.write('M999\n')
+            time.sleep(0.2)
+
+    finally:
+        emulator._handle_line = handle_line
+        emulator._abort = abort
+        emulator.move_time = 0
+
+    print('macro of {} lines: jog {}ms, kill {}ms, {} moves run after the kill'.format(n, r['jog_ms'], r['kill_ms'], r['moves_after_kill']))
+    return r
+
+
+def compare(old, new):
+    print('\nchange from {}'.format(old.get('date')))
+    o = {(r['file'], r['mode']): r for r in old.get('throughput', [])}
+    for r in new['throughput']:
+        p = o.get((r['file'], r['mode']))
+        if p:
+            print('{:<18} {:<20} lines/s {:+7.1%}  ok p99 {:+7.1%}'.format(
+                r['file'], r['mode'], r['lines_per_sec'] / p['lines_per_sec'] - 1, r['ok_p99_ms'] / p['ok_p99_ms'] - 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Comms streaming benchmarks')
+    parser.add_argument('files', nargs='*', help='gcode files to stream, default is a generated corpus')
+    parser.add_argument('-n', '--lines', type=int, default=5000, help='lines in each generated file')
+    parser.add_argument('-m', '--modes', default=','.join(MODES), help='comma separated streaming modes to run')
+    parser.add_argument('--queue', type=int, default=32, help='emulator planner queue depth')
+    parser.add_argument('--line-time', type=float, default=0.0, help='emulator time to parse each line')
+    parser.add_argument('--move-time', type=float, default=0.005, help='time each move takes for the pause and abort tests')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.WARNING)
+    modes = args.modes.split(',')
+    for m in modes:
+        if m not in MODES:
+            print('Unknown mode {}, use one of {}'.format(m, ', '.join(MODES)))
+            return
+
+    tmpdir = None
+    files = args.files
+    if not files:
+        tmpdir = tempfile.TemporaryDirectory()
+        files = gen_corpus(tmpdir.name, args.lines)
+
+    # moves execute instantly for the throughput tests, so we measure the host and the link
+    emulator = SmoothieEmulator(queue_size=args.queue, time_scale=0, move_time=0, line_time=args.line_time)
+    etimer = EmulatorTimer(emulator)
+    port = run_emulator(emulator)
+
+    app = BenchApp()
+    comms = Comms(app, 0)
+    t = comms.connect('net://127.0.0.1:{}'.format(port))
+    if not app.main_window.connected_event.wait(5) or not comms.proto:
+        print('Failed to connect to the emulator')
+        return
+    timer = OkTimer(comms)
+
+    results = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(), 'args': vars(args), 'throughput': [], 'latency': []}
+    try:
+        for fn in files:
+            for m in modes:
+                results['throughput'].append(bench_throughput(comms, app, emulator, timer, fn, m))
+
+        print()
+        for m in modes:
+            results['latency'].append(bench_latency(comms, app, emulator, etimer, files[0], m, args.move_time))
+
+        print()
+        results['submit'] = bench_submit(comms, emulator, args.move_time)
+
+    finally:
+        comms.stop()
+        t.join()
+        if tmpdir:
+            tmpdir.cleanup()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+''' tests for the arc fitter
+    run from the top level directory: python3 -m pytest tests/test_gcode_arcs.py
+'''
+import sys
+import os
+import math
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gcode_arcs import ArcFitter
+
+
+def arc_points(n, r=10.0, step=2.0):
+    # points along a circle around the origin, starting from (r, 0), step degrees apart
+    return [(r * math.cos(math.radians(a * step)), r * math.sin(math.radians(a * step))) for a in range(1, n + 1)]
+
+
+def test_arc_ends_at_e_of_last_fitted_segment():
+    lines = ['G90', 'M82', 'G92 E0', 'G0 X10 Y0']
+    e = 0.0
+    for x, y in arc_points(9):
+        e += 0.1
+        lines.append('G1 X{:.4f} Y{:.4f} E{:.4f}'.format(x, y, e))
+    # this does not fit on the arc so the run breaks here
+    lines.append('G1 X20 Y20 E{:.4f}'.format(e + 0.1))
+
+    out = list(ArcFitter().fit_lines(lines))
+    assert out[4].startswith('G3 ') and out[4].endswith(' E0.9')
+    assert out[5] == 'G1 X20 Y20 E1.0000'
+    assert len(out) == 6
+
+
+def test_explicit_g1_run_restores_g1_after_arc():
+    lines = ['G90', 'G0 X10 Y0']
+    lines += ['G1 X{:.4f} Y{:.4f}'.format(x, y) for x, y in arc_points(5)]
+    # modal move that relies on the G1 above
+    lines.append('X5 Y5')
+
+    out = list(ArcFitter().fit_lines(lines))
+    assert out[2].startswith('G3 ')
+    assert out[3] == 'G1 X5 Y5'
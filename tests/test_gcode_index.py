@@ -0,0 +1,75 @@
+''' tests for starting part way through a file
+    run from the top level directory: python3 -m pytest tests/test_gcode_index.py
+'''
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gcode_index import GcodeIndex, ModalState
+
+
+def scan(tmp_path, lines, line=None, z=None):
+    fn = str(tmp_path / 'test.g')
+    with open(fn, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return GcodeIndex.load(fn, cache=False).scan(line, z)
+
+
+def test_g91(tmp_path):
+    n, state = scan(tmp_path, ['G21', 'G90', 'G0 Z5', 'G0 X1 Y1', 'G91', 'G1 X1 Y1 F100', 'G1 X1', 'G1 X1'], 7)
+    assert n == 7
+    assert state.pos['X'] == 3 and state.pos['Y'] == 2
+    # the moves in the preamble are absolute, then it goes back to relative for the rest of the file
+    assert state.preamble() == ['G21', 'G17', 'G54', 'G90', 'G0 Z5', 'G0 X3 Y2', 'G1 F100', 'G91']
+
+
+def test_m83(tmp_path):
+    n, state = scan(tmp_path, ['M82', 'G92 E0', 'G1 X1 E1 F100', 'M83', 'G1 X2 E0.5', 'G1 X3 E0.5', 'G1 X4 E0.5'], 6)
+    assert n == 6
+    assert state.pos['E'] == 2
+    # relative extrusion does not need E set, just M83 put back
+    assert state.preamble() == ['G21', 'G17', 'G54', 'G90', 'G0 X3', 'G1 F100', 'M83']
+
+
+def test_m82_sets_e(tmp_path):
+    n, state = scan(tmp_path, ['M82', 'G92 E0', 'G1 X1 E1 F100', 'G1 X2 E2.5', 'G1 X3 E3'], 4)
+    assert state.preamble()[-1] == 'G92 E2.5'
+
+
+def test_g53_move_forgets_the_position(tmp_path):
+    n, state = scan(tmp_path, ['G0 Z5', 'G0 X1 Y1', 'G53 G0 Z0', 'G1 X2 Y2 F200', 'G1 X3'], 4)
+    assert state.pos['Z'] is None
+    # Z is not known in work coordinates so it only goes up to the highest Z seen
+    assert state.preamble() == ['G21', 'G17', 'G54', 'G90', 'G0 Z5', 'G0 X2 Y2', 'G1 F200']
+
+
+def test_laser_s_is_set_on_a_move(tmp_path):
+    n, state = scan(tmp_path, ['M4 S0', 'G1 X1 S100 F1000', 'M5', 'G1 X2 S200', 'G1 X3 S300'], 4)
+    assert state.preamble() == ['G21', 'G17', 'G54', 'G90', 'G0 X2', 'G1 F1000 S200']
+
+
+def test_spindle_started_before_going_down(tmp_path):
+    n, state = scan(tmp_path, ['T2', 'M3 S1000', 'G0 Z5', 'G0 X1 Y1', 'G1 Z-1 F100', 'G1 X2'], 4)
+    assert state.preamble() == ['G21', 'G17', 'G54', 'G90', 'T2', 'G0 Z5', 'G0 X1 Y1', 'M3 S1000', 'G1 Z-1 F100']
+
+
+def test_start_at_layer(tmp_path):
+    lines = ['G0 Z5', 'G0 X0 Y0', 'G1 Z-1 F100', 'G1 X10', 'G1 Z1', 'G0 Z5 X20', 'G1 Z-2', 'G1 X0']
+    n, state = scan(tmp_path, lines, z=-2)
+    assert n == 6
+    # already at the highest Z seen, so it does not go down again before the layer
+    assert state.preamble() == ['G21', 'G17', 'G54', 'G90', 'G0 Z5', 'G0 X20 Y0', 'G1 F100']
+
+
+def test_first_move_gets_the_motion_mode():
+    state = ModalState()
+    for l in ['G0 Z5', 'G0 X0 Y0', 'G1 Z-1 F100', 'G2 X10 Y0 I5 J0']:
+        state.apply(ModalState.words(l))
+
+    # the preamble does not leave G2 in effect, so the first move that relies on it gets it back
+    assert 'G2' not in state.preamble()
+    assert state.with_motion('M3 S100') is None
+    assert state.with_motion('G92 X0') is None
+    assert state.with_motion('X0 Y0 I-5 J0') == 'G2 X0 Y0 I-5 J0'
+    assert state.with_motion('G1 X1') == 'G1 X1'
@@ -0,0 +1,94 @@
+''' tests for making the streamed lines shorter
+    run from the top level directory: python3 -m pytest tests/test_gcode_minify.py
+'''
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gcode_minify import GcodeMinifier
+
+
+def send(m, lines):
+    ''' minify the lines as they are read, then as they are sent, without the lines that are not sent '''
+    return [m.modal(l) for l in map(m.minify, lines) if not m.redundant(l)]
+
+
+def test_comments_spaces_and_zeros():
+    m = GcodeMinifier()
+    assert m.minify('G1  X1.500 Y-0.0100 (cut) ; more') == 'G1 X1.5 Y-.01'
+    assert m.minify('G1 X010.0 Y+.5') == 'G1 X10 Y.5'
+    assert m.minify('G1X0.000Y2') == 'G1 X0 Y2'
+
+
+def test_text_lines_are_left_alone():
+    m = GcodeMinifier()
+    for l in ['M117 Hello  0.50', '$H', 'M118 X1.000', '(just a comment)']:
+        assert m.minify(l) == l
+        assert m.modal(l) == l
+
+
+def test_rounding():
+    m = GcodeMinifier(0.01)
+    assert m.minify('G1 X1.23456 Y2.001 F100.00') == 'G1 X1.23 Y2 F100'
+    # relative moves are not rounded as the error would add up
+    assert m.minify('G91') == 'G91'
+    assert m.minify('G1 X1.23456') == 'G1 X1.23456'
+    assert m.minify('G90 G20') == 'G90 G20'
+    assert m.minify('G1 X1.23456') == 'G1 X1.2346'
+
+
+def test_motion_and_feed_in_effect_are_dropped():
+    m = GcodeMinifier()
+    assert send(m, ['G1 X1 Y1 F100', 'G1 X2 Y2 F100', 'G1 Z1', 'G0 X0 Y0', 'G0 X1 Y1', 'G1 X3 F200']) == \
+        ['G1 X1 Y1 F100', 'X2 Y2', 'G1 Z1', 'G0 X0 Y0', 'X1 Y1', 'G1 X3 F200']
+
+
+def test_redundant_feed_is_not_sent():
+    m = GcodeMinifier()
+    assert send(m, ['G1 X1 F100', 'F100', 'X2', 'F200', 'X3']) == ['G1 X1 F100', 'X2', 'F200', 'X3']
+
+
+def test_feed_is_kept_until_the_motion_is_known():
+    m = GcodeMinifier()
+    assert send(m, ['F100', 'G1 X1 F100', 'G1 X2']) == ['F100', 'G1 X1 F100', 'X2']
+
+
+def test_forget_keeps_the_next_motion_and_feed():
+    m = GcodeMinifier()
+    lines = [m.minify(l) for l in ['G1 X1 Y1 F100', 'G1 X2 Y2 F100', 'G1 X3 Y3 F100', 'F100']]
+    # the lines are all read ahead before anything is sent
+    assert m.modal(lines[0]) == 'G1 X1 Y1 F100'
+    assert m.modal(lines[1]) == 'X2 Y2'
+    # eg a jog was sent while paused
+    m.forget()
+    assert not m.redundant(lines[3])
+    assert m.modal(lines[2]) == 'G1 X3 Y3 F100'
+    assert m.redundant(lines[3])
+
+
+def test_canned_cycle_and_other_words_stop_the_dropping():
+    m = GcodeMinifier()
+    assert send(m, ['G1 X1 F100', 'G81 X1 Y1 Z-1 R1 F100', 'G1 X2 F100', 'G1 X3 F100']) == \
+        ['G1 X1 F100', 'G81 X1 Y1 Z-1 R1 F100', 'G1 X2 F100', 'X3']
+    assert send(m, ['G1 X2 M3 S100', 'G1 X3']) == ['G1 X2 M3 S100', 'X3']
+
+
+def test_seek_rate_is_kept_separately():
+    m = GcodeMinifier()
+    assert send(m, ['G0 X1 F1000', 'G1 X2 F100', 'G0 X3 F1000', 'G1 X4 F100']) == \
+        ['G0 X1 F1000', 'G1 X2 F100', 'G0 X3', 'G1 X4']
+
+
+def test_inverse_time_feed_is_always_sent():
+    m = GcodeMinifier()
+    assert send(m, ['G93', 'G1 X1 F10', 'G1 X2 F10', 'G94']) == ['G93', 'G1 X1 F10', 'X2 F10', 'G94']
+
+
+def test_counted_lines_are_not_dropped():
+    # the streamer counts the lines that start with GMXY, so they have to be counted the same way
+    m = GcodeMinifier()
+    lines = ['G1 X1 F100', 'G1 Y1', 'G1 Z1 F100', 'M3 S100', 'X2']
+    out = send(m, lines)
+    assert [l[0] in 'GMXY' for l in out] == [l[0] in 'GMXY' for l in lines]
+    assert m.bytes_in > m.bytes_out and m.saved() > 0
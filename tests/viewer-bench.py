@@ -0,0 +1,166 @@
+''' frame time benchmark for the gcode viewer, draws a file the old way with a Line for each run of moves,
+    with the batched meshes, and with the batched meshes and levels of detail, then pans the view a bit every
+    frame and reports how long the frames take
+    run from the top level directory: python3 tests/viewer-bench.py file.g [-n frames] [-2d] [-z zoom]
+'''
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ['KIVY_NO_ARGS'] = '1'
+
+from kivy.config import Config
+Config.set('graphics', 'maxfps', '0')
+Config.set('graphics', 'vsync', '0')
+Config.set('graphics', 'width', '800')  # the 7" Pi screen
+Config.set('graphics', 'height', '480')
+
+from kivy.app import App
+from kivy.clock import Clock
+from kivy.core.window import Window
+from kivy.graphics import Color, Line, Mesh
+from kivy.graphics.opengl import glFinish
+from kivy.graphics.transformation import Matrix
+from kivy.properties import BooleanProperty, NumericProperty, ListProperty
+from kivy.uix.screenmanager import ScreenManager
+
+import viewer
+from viewer import GcodeViewerScreen
+from gcode_toolpath import Toolpath
+
+
+def legacy_draw_segments(self, start, end, scale):
+    # how the segments used to be drawn, a Color and a Line for each run of connected cuts and for every move
+    tp = self.toolpath
+    x0, y0, x1, y1, kind = tp.x0, tp.y0, tp.x1, tp.y1, tp.kind
+    points = []
+    for i in range(start, end):
+        k = kind[i]
+        if k == Toolpath.LASER_OFF:
+            if self.laser_mode:
+                continue
+            k = Toolpath.CUT
+
+        if k == Toolpath.CUT:
+            if points and (points[-2] != x0[i] or points[-1] != y0[i]):
+                self.canv.add(Color(0, 0, 0))
+                self.canv.add(Line(points=points, width=1, cap='none', joint='none'))
+                points = []
+            if not points:
+                points = [x0[i], y0[i]]
+            points.append(x1[i])
+            points.append(y1[i])
+            continue
+
+        if points:
+            self.canv.add(Color(0, 0, 0))
+            self.canv.add(Line(points=points, width=1, cap='none', joint='none'))
+            points = []
+
+        self.canv.add(Color(1, 0, 0))
+        if k == Toolpath.RAPID:
+            self.canv.add(Line(points=[x0[i], y0[i], x1[i], y1[i]], width=1, dash_offset=1, cap='none', joint='none'))
+        else:
+            self.canv.add(Line(points=[x0[i], y0[i], x1[i], y1[i]], width=1, cap='none', joint='none'))
+
+    if points:
+        self.canv.add(Color(0, 0, 0))
+        self.canv.add(Line(points=points, width=1, cap='none', joint='none'))
+
+
+WARMUP = 10
+
+
+class BenchApp(App):
+    is_cnc = BooleanProperty(False)
+    is_connected = BooleanProperty(False)
+    is_desktop = NumericProperty(2)
+    wpos = ListProperty([0, 0, 0])
+
+    def __init__(self, args, **kwargs):
+        super(BenchApp, self).__init__(**kwargs)
+        self.args = args
+        self.gcode_file = args.file
+        self.modes = ['lines', 'mesh', 'lod']
+        self.results = []
+        self.lod_min_lines = viewer.LOD_MIN_LINES
+        # parse it before the viewer is shown, so it does not get parsed again
+        Toolpath.load(self.gcode_file)
+
+    def build(self):
+        self.sm = ScreenManager()
+        self.viewer = GcodeViewerScreen(name='viewer')
+        self.sm.add_widget(self.viewer)
+        return self.sm
+
+    def on_start(self):
+        # wait for each frame to be rendered, otherwise the driver queues them up and stalls now and then
+        Window.bind(on_flip=lambda *args: glFinish())
+        Clock.schedule_once(self._next_mode, 1)
+
+    def _next_mode(self, *args):
+        if not self.modes:
+            for r in self.results:
+                print('{:<6} {:>8} instructions {:>8} lines  draw {:>8.1f}ms  frame mean {:>7.2f}ms p50 {:>7.2f}ms p99 {:>7.2f}ms'.format(*r))
+            self.stop()
+            return
+
+        self.mode = self.modes.pop(0)
+        v = self.viewer
+        if self.mode == 'lines':
+            v._draw_segments = legacy_draw_segments.__get__(v)
+        else:
+            v.__dict__.pop('_draw_segments', None)
+        # mesh mode draws everything, lod mode uses the levels of detail if the file is big enough
+        viewer.LOD_MIN_LINES = float('inf') if self.mode == 'mesh' else self.lod_min_lines
+
+        v.twod_mode = self.args.twod
+        v.toolpath = Toolpath.load(self.gcode_file)
+        v.ids.surface.canvas.remove(v.canv)
+        t = time.perf_counter()
+        v._show_layer(1)
+        self.draw_time = (time.perf_counter() - t) * 1000
+        if self.args.zoom != 1:
+            v.ids.surface.apply_transform(Matrix().scale(self.args.zoom, self.args.zoom, self.args.zoom), post_multiply=True,
+                                          anchor=v.ids.surface.to_widget(*v.ids.view_window.center))
+            v.moved(None, None)
+        self.frames = []
+        self.last = None
+        self.warmup = True
+        Clock.schedule_interval(self._frame, 0)
+
+    def _frame(self, dt):
+        now = time.perf_counter()
+        if self.last is not None:
+            self.frames.append((now - self.last) * 1000)
+        self.last = now
+        if self.warmup and len(self.frames) == WARMUP:
+            # the first few frames include uploading the vertices
+            self.frames = []
+            self.warmup = False
+
+        if len(self.frames) >= self.args.frames:
+            ll = sorted(self.frames)
+            ins = list(self.viewer.canv.children)
+            if self.viewer.lod_group in ins:
+                ins += [i for g in self.viewer.lod_group.children for i in g.children]
+            lines = sum(len(i.vertices) // 4 for i in ins if isinstance(i, Mesh))
+            self.results.append((self.mode, len(ins), lines or '-', self.draw_time, sum(ll) / len(ll),
+                                 ll[len(ll) // 2], ll[min(int(len(ll) * 0.99), len(ll) - 1)]))
+            Clock.schedule_once(self._next_mode, 0.5)
+            return False
+
+        # pan back and forth
+        d = 2 if (len(self.frames) // 50) % 2 == 0 else -2
+        self.viewer.ids.surface.apply_transform(Matrix().translate(d, 0, 0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Gcode viewer frame time bench')
+    parser.add_argument('file', help='gcode file to view')
+    parser.add_argument('-n', '--frames', type=int, default=300, help='frames to time in each mode')
+    parser.add_argument('-2d', dest='twod', action='store_true', help='draw the whole file not just the first layer')
+    parser.add_argument('-z', '--zoom', type=float, default=1, help='zoom in this much before timing')
+    BenchApp(parser.parse_args()).run()
@@ -3,7 +3,7 @@ from kivy.app import App
 from kivy.lang import Builder
 from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.logger import Logger, LOG_LEVELS
-from kivy.graphics import Color, Line, Scale, Translate, PopMatrix, PushMatrix, Rectangle
+from kivy.graphics import Color, Line, Mesh, Scale, Translate, PopMatrix, PushMatrix, Rectangle
 from kivy.graphics import InstructionGroup
 from kivy.properties import NumericProperty, BooleanProperty, ListProperty
 from kivy.graphics.transformation import Matrix
@@ -13,6 +13,7 @@ from kivy.uix.image import Image
 from kivy.clock import Clock, mainthread
 from kivy.core.text import Label as CoreLabel
 from message_box import MessageBox
+from gcode_toolpath import Toolpath, SegmentGrid
 
 import logging
 import sys
@@ -21,6 +22,11 @@ import math
 import time
 import threading
 import traceback
+from array import array
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 Builder.load_string('''
 <GcodeViewerScreen>:
@@ -114,9 +120,73 @@ Builder.load_string('''
                 on_press: root.manager.current = 'main'
 ''')
 
-XY = 0
-XZ = 1
-CNC_accuracy = 0.001
+DASH_LENGTH = 4  # pixels in a dash of a G0 move when the view is first drawn
+MAX_DASHES = 64  # most dashes a single G0 move gets broken into
+MESH_VERTICES = 65534  # Mesh indices are unsigned shorts so each mesh can only have this many vertices
+MESH_FORMAT = [(b'v_pos', 2, 'float')]
+LOD_ZOOMS = (1, 4, 16)  # zooms a coarser level of detail is built for, past the last one everything is drawn
+LOD_PIXELS = 1.0  # grid the lines are snapped to at each level of detail, in pixels at that zoom
+LOD_MIN_LINES = 20000  # fewer lines than this are always drawn in full
+SNAP_PIXELS = 20  # how close the select cursor has to be to the toolpath to snap to it
+
+
+KIND_RUNS = re.compile(rb'(.)\1*', re.DOTALL)
+
+
+def _add_lines(vertices, tp, s, e):
+    # add segments s to e of the toolpath as lines, the columns are interleaved into x0, y0, x1, y1 for each one
+    v = array('f', bytes(16 * (e - s)))
+    v[0::4] = tp.x0[s:e]
+    v[1::4] = tp.y0[s:e]
+    v[2::4] = tp.x1[s:e]
+    v[3::4] = tp.y1[s:e]
+    vertices.extend(v)
+
+
+def _add_dashes(vertices, x0, y0, x1, y1, dash):
+    # break the line up into dash long lines with dash long gaps
+    n = min(int(math.hypot(x1 - x0, y1 - y0) / (2 * dash)), MAX_DASHES)
+    if n < 2:
+        vertices.extend((x0, y0, x1, y1))
+        return
+
+    dx = (x1 - x0) / (2 * n - 1)
+    dy = (y1 - y0) / (2 * n - 1)
+    for k in range(0, 2 * n, 2):
+        vertices.extend((x0 + k * dx, y0 + k * dy, x0 + (k + 1) * dx, y0 + (k + 1) * dy))
+
+
+def _decimate(vertices, grid):
+    # snap the lines to a grid, then drop the ones that end up with no length and the ones drawn twice
+    q = np.rint(np.frombuffer(vertices, np.float32).reshape(-1, 4) / grid).astype(np.int64)
+    q = q[(q[:, 0] != q[:, 2]) | (q[:, 1] != q[:, 3])]
+    if len(q) == 0:
+        return array('f')
+
+    # number the grid points, then a line is the same either way round so the lower numbered end goes first
+    lo = q.min(axis=0)
+    ny = max(q[:, 1].max(), q[:, 3].max()) - min(lo[1], lo[3]) + 1
+    ox, oy = min(lo[0], lo[2]), min(lo[1], lo[3])
+    ends = np.sort(np.stack(((q[:, 0] - ox) * ny + q[:, 1] - oy, (q[:, 2] - ox) * ny + q[:, 3] - oy), axis=1), axis=1)
+    points = ends.max() + 1
+    if points < 2**31:
+        ends = np.unique(ends[:, 0] * points + ends[:, 1])
+        ends = np.stack((ends // points, ends % points), axis=1)
+    else:
+        ends = np.unique(ends, axis=0)
+
+    v = np.empty((len(ends), 4), np.float32)
+    v[:, 0::2] = (ends // ny + ox) * grid
+    v[:, 1::2] = (ends % ny + oy) * grid
+    return array('f', v.tobytes())
+
+
+def _meshes(vertices):
+    # vertices are x, y pairs, two per line, split into meshes that are small enough to index
+    step = MESH_VERTICES * 2
+    for i in range(0, len(vertices), step):
+        v = vertices[i:i + step]
+        yield Mesh(vertices=v, indices=array('H', range(len(v) // 2)), mode='lines', fmt=MESH_FORMAT)
 
 
 class GcodeViewerScreen(Screen):
@@ -129,7 +199,6 @@ class GcodeViewerScreen(Screen):
     def __init__(self, comms=None, **kwargs):
         super(GcodeViewerScreen, self).__init__(**kwargs)
         self.app = App.get_running_app()
-        self.last_file_pos = None
         self.canv = InstructionGroup()
         self.bind(pos=self._redraw, size=self._redraw)
         self.last_target_layer = 0
@@ -138,38 +207,63 @@ class GcodeViewerScreen(Screen):
         self.scale = 1.0
         self.comms = comms
         self.twod_mode = self.app.is_cnc
-        self.rval = 0.0
+        self.toolpath = None
+        self.li = None
+        self.lods = []  # (zoom, groups, boxes) for each level of detail, finest last, see _tiles
+        self.lod = None
+        self.lod_group = InstructionGroup()
+        self.shown = (0, 0)  # the segments of the toolpath that are drawn
+        self.pick = (None, None)  # SegmentGrid of the drawn segments for the select cursor, and their ids
+        self.cursor_pos = None  # where the select cursor has been moved to
+        self.cursor_wpos = None  # where it is snapped to in model coordinates
 
     def loading(self, ll=1):
         self.valid = False
+        self.ids.surface.canvas.remove(self.canv)
+        if self.toolpath is not None and self.toolpath.is_current(self.app.gcode_file):
+            # the file has already been parsed, so changing layers or view type just draws a different part of it
+            self._show_layer(ll)
+            return
+
         self.li = Image(source='img/image-loading.gif')
         self.add_widget(self.li)
-        self.ids.surface.canvas.remove(self.canv)
         threading.Thread(target=self._load_file, args=(ll,)).start()
 
-    @mainthread
-    def _loaded(self):
-        Logger.debug("GcodeViewerScreen: in _loaded. ok: {}".format(self._loaded_ok))
-        self.remove_widget(self.li)
-        self.li = None
-        self.ids.surface.canvas.add(self.canv)
-        self.valid = self._loaded_ok
-        if self._loaded_ok:
-            # not sure why we need to do this
-            self.ids.surface.top = Window.height
-            if self.app.is_connected:
-                self.app.bind(wpos=self.update_tool)
-
     def _load_file(self, ll):
-        self._loaded_ok = False
         try:
-            self.parse_gcode_file(self.app.gcode_file, ll, True)
+            tp = Toolpath.load(self.app.gcode_file)
         except Exception:
-            print(traceback.format_exc())
+            Logger.warning("GcodeViewerScreen: exception parsing file: {}".format(traceback.format_exc()))
+            tp = None
+
+        self._loaded(tp, ll)
+
+    @mainthread
+    def _loaded(self, tp, ll):
+        Logger.debug("GcodeViewerScreen: in _loaded. ok: {}".format(tp is not None))
+        if self.li:
+            self.remove_widget(self.li)
+            self.li = None
+        if tp is None:
+            self.ids.surface.canvas.add(self.canv)
             mb = MessageBox(text='File not found: {}'.format(self.app.gcode_file))
             mb.open()
+            return
+
+        self.toolpath = tp
+        self._show_layer(ll)
 
-        self._loaded()
+    def _show_layer(self, ll):
+        ok = self.draw_toolpath(ll)
+        self.ids.surface.canvas.add(self.canv)
+        self.valid = ok
+        if ok:
+            # not sure why we need to do this
+            self.ids.surface.top = Window.height
+            if self.app.is_connected:
+                self.app.bind(wpos=self.update_tool)
+            if self.select_mode:
+                self._start_pick()
 
     def _redraw(self, instance, value):
         self.ids.surface.canvas.remove(self.canv)
@@ -190,6 +284,10 @@ class GcodeViewerScreen(Screen):
         self.valid = False
         self.is_visible = False
         self.canv.clear()
+        self.lod_group.clear()
+        self.lods = []
+        self.lod = None
+        self.pick = (None, None)
         self.ids.surface.canvas.remove(self.canv)
 
         self.last_target_layer = 0
@@ -210,85 +308,28 @@ class GcodeViewerScreen(Screen):
     def print(self):
         self.app.main_window._start_print()
 
-    # ----------------------------------------------------------------------
-    # Return center x,y,z,r for arc motions 2,3 and set self.rval
-    # Cribbed from bCNC
-    # ----------------------------------------------------------------------
-
-    def motionCenter(self, gcode, plane, xyz_cur, xyz_val, ival, jval, kval=0.0):
-        if self.rval > 0.0:
-            if plane == XY:
-                x = xyz_cur[0]
-                y = xyz_cur[1]
-                xv = xyz_val[0]
-                yv = xyz_val[1]
-            elif plane == XZ:
-                x = xyz_cur[0]
-                y = xyz_cur[2]
-                xv = xyz_val[0]
-                yv = xyz_val[2]
-            else:
-                x = xyz_cur[1]
-                y = xyz_cur[2]
-                xv = xyz_val[1]
-                yv = xyz_val[2]
-
-            ABx = xv - x
-            ABy = yv - y
-            Cx = 0.5 * (x + xv)
-            Cy = 0.5 * (y + yv)
-            AB = math.sqrt(ABx**2 + ABy**2)
-            try:
-                OC = math.sqrt(self.rval**2 - AB**2 / 4.0)
-            except Exception:
-                OC = 0.0
-
-            if gcode == 2:
-                OC = -OC  # CW
-            if AB != 0.0:
-                return Cx - OC * ABy / AB, Cy + OC * ABx / AB
-            else:
-                # Error!!!
-                return x, y
-        else:
-            # Center
-            xc = xyz_cur[0] + ival
-            yc = xyz_cur[1] + jval
-            zc = xyz_cur[2] + kval
-            self.rval = math.sqrt(ival**2 + jval**2 + kval**2)
-
-            if plane == XY:
-                return xc, yc
-            elif plane == XZ:
-                return xc, zc
-            else:
-                return yc, zc
-
-    extract_gcode = re.compile(r"(G|X|Y|Z|I|J|K|E|S)(-?\d*\.?\d*\.?)")
-
-    def parse_gcode_file(self, fn, target_layer=0, one_layer=False):
-        # open file parse gcode and draw
-        Logger.debug("GcodeViewerScreen: parsing file {}". format(fn))
-        lastpos = [self.app.wpos[0], self.app.wpos[1], -1]  # XYZ, set to initial tool position
-        lastz = None
-        lastdeltaz = None
-        laste = 0
-        lasts = 1
-        layer = -1
-        last_gcode = -1
-        points = []
-        max_x = float('nan')
-        max_y = float('nan')
-        min_x = float('nan')
-        min_y = float('nan')
-        has_e = False
-        plane = XY
-        rel_move = False
+    def draw_toolpath(self, target_layer=0):
+        # draw the layer, or in 2D mode the whole file, from the parsed toolpath, returns True if something was drawn
+        tp = self.toolpath
         self.is_visible = True
         if self.laser_mode:
             self.twod_mode = True  # laser mode implies 2D mode
 
+        if self.twod_mode:
+            target_layer = 0
+            start, end = 0, len(tp)
+        else:
+            if tp.layers() == 0:
+                Logger.info("GcodeViewerScreen: no layers found")
+                return False
+            # stay on the first or last layer if we go past them
+            target_layer = min(max(target_layer, 1), tp.layers())
+            start, end = tp.layer(target_layer)
+            self.current_z = tp.layer_z[target_layer]
+
         self.last_target_layer = target_layer
+        self.shown = (start, end)
+        self.pick = (None, None)
 
         # reset scale and translation
         m = Matrix()
@@ -297,300 +338,20 @@ class GcodeViewerScreen(Screen):
 
         # remove all instructions from canvas
         self.canv.clear()
-
         self.canv.add(PushMatrix())
-        modal_g = 0
-        cnt = 0
-        found_layer = False
-        x = lastpos[0]
-        y = lastpos[1]
-        z = lastpos[2]
-
-        with open(fn) as f:
-            # if self.last_file_pos:
-            #     # jump to last read position
-            #     f.seek(self.last_file_pos)
-            #     self.last_file_pos= None
-            #     print('Jumped to Saved position: {}'.format(self.last_file_pos))
-            for ln in f:
-                cnt += 1
-                ln = ln.strip()
-                if not ln: continue
-                if ln.startswith(';'): continue
-                if ln.startswith('('): continue
-                p = ln.find(';')
-                if p >= 0: ln = ln[:p]
-                matches = self.extract_gcode.findall(ln)
-
-                # this handles multiple G codes on one line
-                gcodes = []
-                d = {}
-                for m in matches:
-                    #print(m)
-                    if m[0] == 'G' and 'G' in d:
-                        # we have another G code on the same line
-                        gcodes.append(d)
-                        d = {}
-                    d[m[0]] = float(m[1])
-
-                gcodes.append(d)
-
-                for d in gcodes:
-                    if not d: continue
-
-                    Logger.debug("GcodeViewerScreen: d={}".format(d))
-
-                    # handle modal commands
-                    if 'G' not in d and ('X' in d or 'Y' in d or 'Z' in d or 'S' in d):
-                        d['G'] = modal_g
-
-                    gcode = int(d['G'])
-
-                    # G92 E0 resets E
-                    if 'G' in d and gcode == 92 and 'E' in d:
-                        laste = float(d['E'])
-                        has_e = True
-
-                    if 'G' in d and (gcode == 91 or gcode == 90):
-                        rel_move = gcode == 91
-
-                    # only deal with G0/1/2/3
-                    if gcode > 3: continue
-
-                    modal_g = gcode
-
-                    # see if it is 3d printing (ie has an E axis on a G1)
-                    if not has_e and ('E' in d and 'G' in d and gcode == 1): has_e = True
-
-                    if rel_move:
-                        x += 0 if 'X' not in d else float(d['X'])
-                        y += 0 if 'Y' not in d else float(d['Y'])
-                        z += 0 if 'Z' not in d else float(d['Z'])
-
-                    else:
-                        x = lastpos[0] if 'X' not in d else float(d['X'])
-                        y = lastpos[1] if 'Y' not in d else float(d['Y'])
-                        z = lastpos[2] if 'Z' not in d else float(d['Z'])
-
-                    i = 0.0 if 'I' not in d else float(d['I'])
-                    j = 0.0 if 'J' not in d else float(d['J'])
-                    self.rval = 0.0 if 'R' not in d else float(d['R'])
-
-                    e = laste if 'E' not in d else float(d['E'])
-                    s = lasts if 'S' not in d else float(d['S'])
-
-                    if not self.twod_mode :
-                        # handle layers (when Z changes)
-                        if z == -1:
-                            # no z seen yet
-                            layer = -1
-                            continue
-
-                        if lastz is None:
-                            # first layer
-                            lastz = z
-                            layer = 1
-
-
-                        if z != lastz:
-                            # count layers
-                            layer += 1
-                            lastz = z
-
-                        # wait until we get to the requested layer
-                        if layer != target_layer:
-                            lastpos[2] = z
-                            continue
-
-                        if layer > target_layer and one_layer:
-                            # FIXME for some reason this does not work, -- not counting layers
-                            #self.last_file_pos= f.tell()
-                            #print('Saved position: {}'.format(self.last_file_pos))
-                            break
-
-                        self.current_z = z
-
-                    found_layer = True
-
-                    Logger.debug("GcodeViewerScreen: x= {}, y= {}, z= {}, s= {}".format(x, y, z, s))
-
-                    # find bounding box
-                    if math.isnan(min_x) or x < min_x: min_x = x
-                    if math.isnan(min_y) or y < min_y: min_y = y
-                    if math.isnan(max_x) or x > max_x: max_x = x
-                    if math.isnan(max_y) or y > max_y: max_y = y
-
-                    # accumulating vertices is more efficient but we need to flush them at some point
-                    # Here we flush them if we encounter a new G code like G3 following G1
-                    if last_gcode != gcode:
-                        # flush vertices
-                        if points:
-                            self.canv.add(Color(0, 0, 0))
-                            self.canv.add(Line(points=points, width=1, cap='none', joint='none'))
-                            points = []
-
-                    last_gcode = gcode
-
-                    # in slicer generated files there is no G0 so we need a way to know when to draw, so if there is an E then draw else don't
-                    if gcode == 0:
-                        #print("move to: {}, {}, {}".format(x, y, z))
-                        # draw moves in dashed red
-                        self.canv.add(Color(1, 0, 0))
-                        self.canv.add(Line(points=[lastpos[0], lastpos[1], x, y], width=1, dash_offset=1, cap='none', joint='none'))
-
-                    elif gcode == 1:
-                        if ('X' in d or 'Y' in d):
-                            if self.laser_mode and s <= 0.01:
-                                # do not draw non cutting lines
-                                if points:
-                                    # draw accumulated points upto this point
-                                    self.canv.add(Color(0, 0, 0))
-                                    self.canv.add(Line(points=points, width=1, cap='none', joint='none'))
-                                    points = []
-
-                            # for 3d printers (has_e) only draw if there is an E
-                            elif not has_e or 'E' in d:
-                                # if a CNC gcode file or there is an E in the G1 (3d printing)
-                                #print("draw to: {}, {}, {}".format(x, y, z))
-                                # collect points but don't draw them yet
-                                if len(points) < 2:
-                                    points.append(lastpos[0])
-                                    points.append(lastpos[1])
-
-                                points.append(x)
-                                points.append(y)
-
-                            else:
-                                # a G1 with no E, treat as G0 and draw moves in red
-                                #print("move to: {}, {}, {}".format(x, y, z))
-                                if points:
-                                    # draw accumulated points upto this point
-                                    self.canv.add(Color(0, 0, 0))
-                                    self.canv.add(Line(points=points, width=1, cap='none', joint='none'))
-                                    points = []
-                                # now draw the move in red
-                                self.canv.add(Color(1, 0, 0))
-                                self.canv.add(Line(points=[lastpos[0], lastpos[1], x, y], width=1, cap='none', joint='none'))
-
-                        else:
-                            # A G1 with no X or Y, maybe E only move (retract) or Z move (layer change)
-                            if points:
-                                # draw accumulated points upto this point
-                                self.canv.add(Color(0, 0, 0))
-                                self.canv.add(Line(points=points, width=1, cap='none', joint='none'))
-                                points = []
-
-                    elif gcode in [2, 3]:  # CW=2,CCW=3 circle
-                        # code cribbed from bCNC
-                        xyz = []
-                        xyz.append((lastpos[0], lastpos[1], lastpos[2]))
-                        uc, vc = self.motionCenter(gcode, plane, lastpos, [x, y, z], i, j)
-
-                        if plane == XY:
-                            u0 = lastpos[0]
-                            v0 = lastpos[1]
-                            w0 = lastpos[2]
-                            u1 = x
-                            v1 = y
-                            w1 = z
-                        elif plane == XZ:
-                            u0 = lastpos[0]
-                            v0 = lastpos[2]
-                            w0 = lastpos[1]
-                            u1 = x
-                            v1 = z
-                            w1 = y
-                            gcode = 5 - gcode  # flip 2-3 when XZ plane is used
-                        else:
-                            u0 = lastpos[1]
-                            v0 = lastpos[2]
-                            w0 = lastpos[0]
-                            u1 = y
-                            v1 = z
-                            w1 = x
-                        phi0 = math.atan2(v0-vc, u0-uc)
-                        phi1 = math.atan2(v1-vc, u1-uc)
-                        try:
-                            sagitta = 1.0-CNC_accuracy/self.rval
-                        except ZeroDivisionError:
-                            sagitta = 0.0
-                        if sagitta > 0.0:
-                            df = 2.0*math.acos(sagitta)
-                            df = min(df, math.pi/4.0)
-                        else:
-                            df = math.pi/4.0
-
-                        if gcode == 2:
-                            if phi1 >= phi0-1e-10: phi1 -= 2.0*math.pi
-                            ws  = (w1-w0)/(phi1-phi0)
-                            phi = phi0 - df
-                            while phi > phi1:
-                                u = uc + self.rval*math.cos(phi)
-                                v = vc + self.rval*math.sin(phi)
-                                w = w0 + (phi-phi0)*ws
-                                phi -= df
-                                if plane == XY:
-                                    xyz.append((u,v,w))
-                                elif plane == XZ:
-                                    xyz.append((u,w,v))
-                                else:
-                                    xyz.append((w,u,v))
-                        else:
-                            if phi1 <= phi0+1e-10: phi1 += 2.0*math.pi
-                            ws  = (w1-w0)/(phi1-phi0)
-                            phi = phi0 + df
-                            while phi < phi1:
-                                u = uc + self.rval*math.cos(phi)
-                                v = vc + self.rval*math.sin(phi)
-                                w = w0 + (phi-phi0)*ws
-                                phi += df
-                                if plane == XY:
-                                    xyz.append((u,v,w))
-                                elif plane == XZ:
-                                    xyz.append((u,w,v))
-                                else:
-                                    xyz.append((w,u,v))
-
-                        xyz.append((x, y, z))
-                        # plot the points
-                        points = []
-                        for t in xyz:
-                            x1, y1, z1 = t
-                            points.append(x1)
-                            points.append(y1)
-                            max_x = max(x1, max_x)
-                            min_x = min(x1, min_x)
-                            max_y = max(y1, max_y)
-                            min_y = min(y1, min_y)
-
-                        self.canv.add(Color(0, 0, 0))
-                        self.canv.add(Line(points=points, width=1, cap='none', joint='none'))
-                        points = []
-
-                    # always remember last position
-                    lastpos = [x, y, z]
-                    laste = e
-                    lasts = s
-
-        if not found_layer:
-            # we hit the end of file before finding the layer we want
-            Logger.info("GcodeViewerScreen: last layer was at {}".format(lastz))
-            self.last_target_layer -= 1
-            return
 
-        # flush any points not yet drawn
-        if points:
-            # draw accumulated points upto this point
-            self.canv.add(Color(0, 0, 0))
-            self.canv.add(Line(points=points, width=1, cap='none', joint='none'))
-            points = []
+        bounds = tp.bounds(start, end)
+        if bounds is None:
+            Logger.warning("GcodeViewerScreen: nothing to draw")
+            return False
+        min_x, min_y, max_x, max_y = bounds
 
         # center the drawing and scale it
         dx = max_x - min_x
         dy = max_y - min_y
         if dx == 0 or dy == 0:
             Logger.warning("GcodeViewerScreen: size is bad, maybe need 2D mode")
-            return
+            return False
 
         dx += 4
         dy += 4
@@ -621,6 +382,8 @@ class GcodeViewerScreen(Screen):
         Logger.debug("GcodeViewerScreen: cx= {}, cy= {}".format(self.ids.surface.center[0], self.ids.surface.center[1]))
         Logger.debug("GcodeViewerScreen: sx= {}, sy= {}".format(self.ids.surface.size[0], self.ids.surface.size[1]))
 
+        self._draw_segments(start, end, scale)
+
         # axis Markers
         self.canv.add(Color(0, 1, 0, mode='rgb'))
         self.canv.add(Line(points=[0, -10, 0, self.ids.surface.height / scale], width=1, cap='none', joint='none'))
@@ -638,8 +401,105 @@ class GcodeViewerScreen(Screen):
         # self.canv.add(Rectangle(pos=(x-r/2, y), size=(r, 1/scale), group="tool"))
 
         self.canv.add(PopMatrix())
-        self._loaded_ok = True
-        Logger.debug("GcodeViewerScreen: done loading")
+        Logger.debug("GcodeViewerScreen: done drawing")
+        return True
+
+    def _draw_segments(self, start, end, scale):
+        # the segments are drawn as a few meshes of GL lines, one batch for each colour, instead of a Line
+        # instruction for each run of moves, so a big file is a handful of draw calls not tens of thousands
+        tp = self.toolpath
+        cut = array('f')
+        moves = array('f')
+        dash = DASH_LENGTH / scale
+        kinds = tp.kind[start:end].tobytes()
+        for m in KIND_RUNS.finditer(kinds):
+            # each run of segments of the same kind is added in one go
+            k = kinds[m.start()]
+            s, e = start + m.start(), start + m.end()
+            if k == Toolpath.CUT or (k == Toolpath.LASER_OFF and not self.laser_mode):
+                _add_lines(cut, tp, s, e)
+            elif k == Toolpath.TRAVEL:
+                _add_lines(moves, tp, s, e)
+            elif k == Toolpath.RAPID:
+                for i in range(s, e):
+                    _add_dashes(moves, tp.x0[i], tp.y0[i], tp.x1[i], tp.y1[i], dash)
+            # laser off moves are not drawn in laser mode
+
+        # the segments go in their own group so the level of detail can be changed without redrawing
+        self.lod_group.clear()
+        self.canv.add(self.lod_group)
+        self.lod = None
+        if np is None or len(cut) + len(moves) < LOD_MIN_LINES * 4:
+            self.lods = [(float('inf'), [self._mesh_group(cut, moves)], None)]
+        else:
+            # the full detail is only seen zoomed in, so it is split into tiles and only the ones in view are drawn
+            self.lods = [(float('inf'),) + self._tiles(cut, moves, scale * LOD_ZOOMS[-1])]
+            # coarser levels for when the view is zoomed out, each one is built from the finer one
+            for zoom in reversed(LOD_ZOOMS):
+                grid = LOD_PIXELS / (scale * zoom)
+                n = len(cut) + len(moves)
+                cut, moves = _decimate(cut, grid), _decimate(moves, grid)
+                if len(cut) + len(moves) > n * 0.75:
+                    # not worth having another level
+                    self.lods.insert(0, (zoom,) + self.lods[0][1:])
+                elif zoom > 1:
+                    self.lods.insert(0, (zoom,) + self._tiles(cut, moves, scale * zoom))
+                else:
+                    self.lods.insert(0, (zoom, [self._mesh_group(cut, moves)], None))
+            Logger.debug("GcodeViewerScreen: levels of detail: {}".format([(z, len(g)) for z, g, b in self.lods]))
+        self._update_view()
+
+    def _tiles(self, cut, moves, scale):
+        # split the lines into tiles about the size of the view at this scale, returns a group for each tile and
+        # the bounds of the lines in them
+        tile = max(self.ids.view_window.size) / scale
+        groups = []
+        boxes = []
+        for vertices, color in ((cut, (0, 0, 0)), (moves, (1, 0, 0))):
+            if not vertices:
+                continue
+            v = np.frombuffer(vertices, np.float32).reshape(-1, 4)
+            grid = SegmentGrid(v[:, 0], v[:, 1], v[:, 2], v[:, 3], tile)
+            for c in range(len(grid)):
+                g = InstructionGroup()
+                g.add(Color(*color))
+                for m in _meshes(array('f', v[grid.segments(c)].tobytes())):
+                    g.add(m)
+                groups.append(g)
+            boxes.append(grid.boxes)
+        return groups, np.concatenate(boxes) if boxes else None
+
+    def _mesh_group(self, cut, moves):
+        # moves in red, G0 dashed
+        g = InstructionGroup()
+        for vertices, color in ((cut, (0, 0, 0)), (moves, (1, 0, 0))):
+            if vertices:
+                g.add(Color(*color))
+                for m in _meshes(vertices):
+                    g.add(m)
+        return g
+
+    def _update_view(self):
+        # show the coarsest level of detail that is still within a pixel or so at the current zoom, and only the
+        # tiles of it that are in view
+        zoom = self.ids.surface.scale
+        lod = next((i for i, l in enumerate(self.lods) if zoom <= l[0]), None)
+        if lod is None:
+            return
+        groups, boxes = self.lods[lod][1:]
+        if boxes is None:
+            tiles = range(len(groups))
+        else:
+            vw = self.ids.view_window
+            x0, y0 = self.transform_to_wpos(vw.x, vw.y)
+            x1, y1 = self.transform_to_wpos(vw.right, vw.top)
+            tiles = np.nonzero((boxes[:, 0] <= x1) & (boxes[:, 2] >= x0) & (boxes[:, 1] <= y1) & (boxes[:, 3] >= y0))[0]
+        if self.lod == (lod, tuple(tiles)):
+            return
+        self.lod = (lod, tuple(tiles))
+        self.lod_group.clear()
+        for i in tiles:
+            self.lod_group.add(groups[i])
 
     def update_tool(self, i, v):
         if not self.is_visible or not self.app.is_connected: return
@@ -665,7 +525,7 @@ class GcodeViewerScreen(Screen):
     def transform_to_spos(self, posx, posy):
         ''' inverse transform of model coordinates to scatter coordinates '''
         pos = ((((posx + self.tx) * self.scale) + self.offs[0]), (((posy + self.ty) * self.scale) + self.offs[1]))
-        spos = self.ids.surface.to_window(*pos)
+        spos = self.ids.surface.to_window(*pos, initial=False)
         #print("pos= {}, spos= {}".format(pos, spos))
         return spos
 
@@ -681,34 +541,97 @@ class GcodeViewerScreen(Screen):
         # hide tool marker
         self.canv.remove_group('tool')
 
+        if self.lods:
+            self._update_view()
+
     def start_cursor(self, x, y):
-        tx, ty = self.transform_to_wpos(x, y)
-        label = CoreLabel(text="{:1.2f},{:1.2f}".format(tx, ty))
-        label.refresh()
-        texture = label.texture
-        px, py = (x, y)
         with self.ids.surface.canvas.after:
             Color(0, 0, 1, mode='rgb', group='cursor_group')
             self.crossx = [
-                Rectangle(pos=(px, 0), size=(1, self.height), group='cursor_group'),
-                Rectangle(pos=(0, py), size=(self.width, 1), group='cursor_group'),
-                Line(circle=(px, py, 20), group='cursor_group'),
-                Rectangle(texture=texture, pos=(px - texture.size[0] / 2, py - 40), size=texture.size, group='cursor_group')
+                Rectangle(pos=(x, 0), size=(1, self.height), group='cursor_group'),
+                Rectangle(pos=(0, y), size=(self.width, 1), group='cursor_group'),
+                Line(circle=(x, y, 20), group='cursor_group'),
+                Rectangle(group='cursor_group')
             ]
+        self.cursor_pos = (x, y)
+        self._place_cursor()
+        self._start_pick()
 
     def move_cursor_by(self, dx, dy):
-        x, y = (self.crossx[0].pos[0] + dx, self.crossx[1].pos[1] + dy)
+        self.cursor_pos = (self.cursor_pos[0] + dx, self.cursor_pos[1] + dy)
+        self._place_cursor()
+
+    def _place_cursor(self):
+        # put the cursor where it has been moved to, or on the toolpath if that is close by
+        x, y = self.cursor_pos
+        wx, wy = self.transform_to_wpos(x, y)
+        text = "{:1.2f},{:1.2f}"
+        snap = self._snap(wx, wy)
+        if snap is not None:
+            wx, wy, ln = snap
+            x, y = self.transform_to_spos(wx, wy)
+            text += " line {}".format(ln)
+        self.cursor_wpos = (wx, wy)
 
         self.crossx[0].pos = x, 0
         self.crossx[1].pos = 0, y
         self.crossx[2].circle = (x, y, 20)
-        tx, ty = self.transform_to_wpos(x, y)
-        label = CoreLabel(text="{:1.2f},{:1.2f}".format(tx, ty))
+        label = CoreLabel(text=text.format(wx, wy))
         label.refresh()
         texture = label.texture
         self.crossx[3].texture = texture
+        self.crossx[3].size = texture.size
         self.crossx[3].pos = x - texture.size[0] / 2, y - 40
 
+    def _snap(self, wx, wy):
+        # the end of the nearest drawn segment, or the nearest point on it, and its line in the file, if there is one
+        # within SNAP_PIXELS of wx, wy
+        grid, ids = self.pick
+        if grid is None:
+            return None
+        r = SNAP_PIXELS / (self.scale * self.ids.surface.scale)
+        hit = grid.nearest(wx, wy, r)
+        if hit is None:
+            return None
+
+        tp = self.toolpath
+        i = int(ids[hit[0]])
+        x0, y0, x1, y1 = tp.x0[i], tp.y0[i], tp.x1[i], tp.y1[i]
+        d0 = math.hypot(wx - x0, wy - y0)
+        d1 = math.hypot(wx - x1, wy - y1)
+        if min(d0, d1) <= r:
+            x, y = (x0, y0) if d0 < d1 else (x1, y1)
+        else:
+            dx, dy = x1 - x0, y1 - y0
+            t = ((wx - x0) * dx + (wy - y0) * dy) / (dx * dx + dy * dy)
+            x, y = x0 + t * dx, y0 + t * dy
+        return x, y, tp.line[i]
+
+    def _start_pick(self):
+        # index the drawn segments so the cursor can snap to them, it can take a while on a big file
+        if np is None or self.toolpath is None or self.pick[0] is not None:
+            return
+        start, end = self.shown
+        kinds = (Toolpath.CUT, Toolpath.RAPID, Toolpath.TRAVEL) if self.laser_mode else None
+        threading.Thread(target=self._build_pick, args=(self.toolpath, start, end, kinds)).start()
+
+    def _build_pick(self, tp, start, end, kinds):
+        try:
+            pick = tp.grid(start, end, kinds)
+        except Exception:
+            Logger.warning("GcodeViewerScreen: exception indexing toolpath: {}".format(traceback.format_exc()))
+            return
+        self._picked(tp, (start, end), pick)
+
+    @mainthread
+    def _picked(self, tp, shown, pick):
+        if tp is not self.toolpath or shown != self.shown:
+            # something else has been drawn since
+            return
+        self.pick = pick
+        if self.select_mode and self.crossx:
+            self._place_cursor()
+
     def stop_cursor(self, x=0, y=0):
         self.ids.surface.canvas.after.remove_group('cursor_group')
         self.crossx = None
@@ -776,10 +699,10 @@ class GcodeViewerScreen(Screen):
         self.select_mode = False
         self.ids.select_mode_but.state = 'normal'
 
-        # convert to original model coordinates (mm), need to take into account scale and translate
+        # where the cursor is in the original model coordinates (mm)
         x, y = (self.crossx[0].pos[0], self.crossx[1].pos[1])
         self.stop_cursor(x, y)
-        wpos = self.transform_to_wpos(x, y)
+        wpos = self.cursor_wpos
 
         if self.comms:
             self.comms.write('G0 X{:1.2f} Y{:1.2f}\n'.format(wpos[0], wpos[1]))
@@ -794,10 +717,10 @@ class GcodeViewerScreen(Screen):
         self.select_mode = False
         self.ids.select_mode_but.state = 'normal'
 
-        # convert to original model coordinates (mm), need to take into account scale and translate
+        # where the cursor is in the original model coordinates (mm)
         x, y = (self.crossx[0].pos[0], self.crossx[1].pos[1])
         self.stop_cursor(x, y)
-        wpos = self.transform_to_wpos(x, y)
+        wpos = self.cursor_wpos
         if self.comms:
             self.comms.write('G10 L20 P0 X{:1.2f} Y{:1.2f}\n'.format(wpos[0], wpos[1]))
         else: